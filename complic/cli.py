@@ -5,14 +5,17 @@ CLI entrypoint and main execution logic.
 
 import logging
 import argparse
+import itertools
 import os
 import sys
 import json
 import re
 
 import complic.utils.fs
+import complic.utils.shell
 
 import complic.scanner
+import complic.scanner.base
 
 import complic.utils.config
 
@@ -20,19 +23,58 @@ import complic.licenses.exceptions
 import complic.licenses.regex
 import complic.licenses.compat
 import complic.licenses.evidence
+import complic.licenses.fuzzy
+import complic.licenses.text
 
 
-def get_dependencies(scanners, files):
-    dependencies = []
-    for scanner in scanners:
-        for dependency in scanner.scan(files):
-            dependencies.append(dependency)
-    return dependencies
+# What some package managers fill in when no license was declared
+PLACEHOLDERS = set(['', 'UNKNOWN', 'None'])
+
+
+def get_dependencies(scanners, files, jobs=1, processes=1):
+    """Runs all scanners through a single pass over the file list.
+
+    Up to <jobs> scanners run concurrently, handlers which support it are
+    spread over <processes> worker processes."""
+    dispatcher = complic.scanner.base.Dispatcher(scanners, jobs, processes)
+    return dispatcher.scan(files)
+
 
+def detect_licenses(detector, dependency, report):
+    """Identifies the license of <dependency> from the license files in its
+    package directory, when none was declared.
 
-def engine(directory, name):
+    Returns the licenses found (-> confidence), which are reported as
+    guesses to be confirmed (see Report.add_detected)."""
+    if not dependency.package_dir or dependency.licenses - PLACEHOLDERS:
+        return {}
+    found = detector.scan(dependency.package_dir)
+    if not found:
+        return {}
+    dependency.licenses = set(found)
+    for lic, confidence in found.items():
+        dependency.confidence[lic] = confidence
+        report.add_detected(dependency.identifier, lic, confidence)
+    return found
+
+
+def engine(directory, name, ignore=None, cache=False, jobs=1, processes=1,
+           offline=False, site_packages=None, wheelhouses=None):
     """Finds all dependencies and corresponding licenses in a given directory.
 
+    Directories matching any of the <ignore> globs aren't scanned. With
+    <cache>, results from previous runs (in ~/.complic/cache) are reused.
+    <jobs> is the number of threads used to traverse the directory and the
+    number of scanners allowed to run at the same time. CPU bound handlers
+    (such as parsing package.json files) use <processes> worker processes.
+    <offline> avoids running build tools (mvn, etc.) when possible.
+    Python packages are read from <site_packages> instead of installed, and
+    from the wheels and sdists in <wheelhouses> (walked along <directory>).
+    Dependencies without a declared license get one identified from the
+    LICENSE (COPYING, etc.) file they ship, if any, reported as a problem
+    until it's confirmed (in the configuration). Licenses which remain
+    unknown come with suggestions: the known licenses closest to them.
+
     Returns a dictionary containing:
          {
             '<license_spdx>': {
@@ -49,7 +91,9 @@ def engine(directory, name):
     """
 
     # Normalizes strings into the SPDX index (when possible)
-    normalizer = complic.licenses.regex.Normalizer()
+    normalizer = complic.licenses.regex.Normalizer(persistent=cache)
+    # Identifies licenses from LICENSE files instead
+    detector = complic.licenses.text.Detector()
 
     # Generate the following map:
     # {
@@ -60,10 +104,27 @@ def engine(directory, name):
 
 
     config = complic.utils.config.Manager()
-    filelist = complic.utils.fs.Find(directory).files
+    directory = os.path.abspath(directory)
+    ignore = complic.utils.fs.DEFAULT_IGNORE + (ignore or [])
+    tree_cache = None
+    complic.utils.shell.CACHE = cache
+    if cache:
+        tree_cache = complic.utils.fs.TreeCache(directory, ignore)
+    filelist = complic.utils.fs.Find(directory, ignore, tree_cache, jobs)
+    wheelhouses = [os.path.abspath(path) for path in wheelhouses or []]
+    outside = [complic.utils.fs.Find(path, ignore, jobs=jobs) \
+               for path in wheelhouses \
+               if not (path + os.sep).startswith(directory + os.sep)]
+    if outside:
+        filelist = itertools.chain(filelist, *outside)
     report = complic.licenses.evidence.Report(name,
                                               complic.licenses.compat.get())
-    dependencies = get_dependencies(complic.scanner.get(), filelist)
+    # License strings the normalizer doesn't know about
+    unknown = set()
+    scanners = complic.scanner.get(offline, site_packages, wheelhouses)
+    dependencies = get_dependencies(scanners, filelist, jobs, processes)
+    for scanner in scanners:
+        report.add_stats(scanner.__module__, scanner.stats)
 
     for dependency in dependencies:
         for dep in config['dependencies']:
@@ -71,16 +132,28 @@ def engine(directory, name):
                 continue
             logging.debug("Dependency in configuration: %s", dependency.identifier)
             dependency.licenses = set(config['dependencies'][dep].split(','))
+        detected = detect_licenses(detector, dependency, report)
         if not dependency.licenses:
             report.add_license('<no license>', dependency.identifier, False)
             continue
         for lic in dependency.licenses:
+            if lic in detected:
+                continue # Already reported, as a guess
             try:
                 report.add_license(normalizer.match(lic),
                                    dependency.identifier,
                                    True)
             except complic.licenses.exceptions.UnknownLicenseError:
                 report.add_license(lic, dependency.identifier, False)
+                if lic not in PLACEHOLDERS:
+                    unknown.add(lic)
+    if unknown:
+        suggester = complic.licenses.fuzzy.Suggester(normalizer.index['exact'])
+        for lic, suggestions in suggester.suggest(unknown).items():
+            report.add_suggestions(lic, suggestions)
+    normalizer.save()
+    report.add_stats(normalizer.__module__, normalizer.stats)
+    report.add_stats(detector.__module__, detector.stats)
 
     return report
 
@@ -96,10 +169,34 @@ def main(): # pragma: nocover
         help="The directory to scan.")
     parser.add_argument("-n", "--name", default=None, \
         help="The name to identify this project with (defaults to directory).")
+    parser.add_argument("-i", "--ignore", action="append", default=[], \
+        help="Directory name glob to skip while scanning (may be repeated).")
+    parser.add_argument("-c", "--cache", action="store_true", \
+        help="Reuse results from previous runs (kept in ~/.complic/cache).")
+    parser.add_argument("-j", "--jobs", type=int, default=1, \
+        help="Number of parallel workers (defaults to 1).")
+    parser.add_argument("-p", "--processes", type=int, default=1, \
+        help="Number of processes parsing package files (defaults to 1).")
+    parser.add_argument("-o", "--offline", action="store_true", \
+        help="Read metadata from local caches (~/.m2, etc.) instead of \
+              running build tools.")
+    parser.add_argument("-s", "--site-packages", default=None, \
+        help="Read python packages from this site-packages directory \
+              instead of installing them.")
+    parser.add_argument("-w", "--wheelhouse", action="append", default=None, \
+        help="Read python packages from the wheels and sdists in this \
+              directory (a wheelhouse, pip's cache, etc.), can be repeated.")
+    parser.add_argument("-t", "--timeout", type=int, default=None, \
+        help="Kill build tools (mvn, pip, etc.) running for longer than \
+              this many seconds.")
 
     args = parser.parse_args()
 
-    logging.basicConfig(format='%(asctime)s::%(levelname)s::%(message)s')
+    log_format = '%(asctime)s::%(levelname)s::%(message)s'
+    if args.jobs > 1:
+        # Tell apart messages from scanners running at the same time
+        log_format = '%(asctime)s::%(levelname)s::%(threadName)s::%(message)s'
+    logging.basicConfig(format=log_format)
     logging.getLogger().setLevel(getattr(logging, 'INFO'))
 
     if args.verbose:
@@ -111,9 +208,12 @@ def main(): # pragma: nocover
 
     if not args.name:
         args.name = args.directory
+    complic.utils.shell.TIMEOUT = args.timeout
 
     report_path = os.path.join(args.directory, 'complic-report.json')
-    report = engine(args.directory, args.name)
+    report = engine(args.directory, args.name, args.ignore, args.cache,
+                    args.jobs, args.processes, args.offline,
+                    args.site_packages, args.wheelhouse)
 
     logging.info("Writing complic report to: %s", report_path)
     with open(report_path, 'w') as report_file:
@@ -6,6 +6,10 @@ import copy
 import datetime
 
 
+# How licenses identified from a license file (not declared) are reported
+DETECTED = '%s (detected)'
+
+
 class Report(object):
 
     def __init__(self, name, compat_checkers=[]):
@@ -13,10 +17,32 @@ class Report(object):
         self.compat_checkers = compat_checkers
         self.licenses = {}
         self.dependencies = {}
+        # {'scanner': {'counter': value}}
+        self.stats = {}
+        # {'identifier': {'license': confidence}} for guessed licenses
+        self.detected = {}
+        # {'unknown license': [(license, score), ...]} closest known ones
+        self.suggestions = {}
 
     def add_compat(self, compat):
         self.compat_checkers.append(compat)
 
+    def add_stats(self, scanner, stats):
+        if stats:
+            self.stats.setdefault(scanner, {}).update(stats)
+
+    def add_detected(self, identifier, lic, confidence):
+        """<lic> was guessed (with some <confidence>) for <identifier>.
+
+        Never reported as a known license, not even when some other
+        dependency declares it: it's a problem until someone confirms it."""
+        self.detected.setdefault(identifier, {})[lic] = confidence
+        self.add_license(DETECTED % (lic), identifier, False)
+
+    def add_suggestions(self, name, suggestions):
+        """Known licenses (with scores) which look like the unknown <name>."""
+        self.suggestions[name] = list(suggestions)
+
     def add_license(self, name, identifier, known):
         logging.debug("Report license: %s %s %s", name, identifier, known)
         if not name in self.licenses:
@@ -51,16 +77,24 @@ class Report(object):
 
                 problems.append(problem)
 
+        detected = set(DETECTED % (lic) for lics in self.detected.values() \
+                       for lic in lics)
         for lic, known in self.licenses.items():
             if not known:
                 deps = self.get_license_deps(lic)
                 deps = ','.join(list(deps))
                 desc = "Uknown/no license means no rights to use/modify/share."
+                if lic in detected:
+                    desc = "Not declared, identified from the license file" \
+                           " of the dependency. Confirm it in the" \
+                           " configuration (dependencies)."
                 problem = {
                     'licenses': [lic],
                     'dependencies': list(self.get_license_deps(lic)),
                     'description': desc,
                 }
+                if lic in self.suggestions:
+                    problem['suggestions'] = self.suggestions[lic]
                 problems.append(problem)
 
         return problems
@@ -73,6 +107,9 @@ class Report(object):
             'licenses': copy.deepcopy(self.licenses),
             'dependencies': {},
             'compatibility': {},
+            'stats': copy.deepcopy(self.stats),
+            'detected': copy.deepcopy(self.detected),
+            'suggestions': copy.deepcopy(self.suggestions),
         }
 
         for dep, licenses in self.dependencies.items():
@@ -98,6 +135,9 @@ class Report(object):
         for p in self.problems:
             msg = "[{lic}] {reason}\n"
             msg += "\tDependencies: {deps}"
+            if p.get('suggestions'):
+                msg += "\n\tClosest known licenses: " + ', '.join(
+                    "%s (%.2f)" % (lic, score) for lic, score in p['suggestions'])
             prob_list.append(msg.format(lic=','.join(p['licenses']),
                                         reason=p['description'],
                                         deps=','.join(p['dependencies']))
@@ -112,6 +152,9 @@ class Report(object):
         if len(probs):
             msg += "\n\bProblem(s):\n"
             msg += ' - ' + '\n - '.join(prob_list)
+        for scanner, stats in sorted(self.stats.items()):
+            for stat, value in sorted(stats.items()):
+                msg += "\n%s: %s: %s" % (scanner, stat, value)
 
         return msg
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Suggests licenses for strings the Normalizer doesn't know about.
+"""
+
+import collections
+import logging
+import math
+import re
+
+from complic.licenses import regex
+
+
+def simplify(string):
+    """Canonical <string> with versions written the same way:
+    'GPL v3.0' == 'gpl 3'."""
+    string = re.sub(r'\bv(?=\d)', '', regex.canonical(string))
+    return re.sub(r'(\d)(\.0)+(?![.\d])', r'\1', string)
+
+
+def ngrams(string, size):
+    """Character <size>-grams of the simplified <string> (-> count)."""
+    padded = ' %s ' % simplify(string)
+    return collections.Counter(padded[i:i + size] \
+                               for i in range(len(padded) - size + 1))
+
+
+class Suggester(object):
+    """Ranks the licenses whose names look the most like a string.
+
+    Meant as a last resort for strings no regex matches ("Apache 2",
+    "MIT/X11", ...), so that whoever reviews the report has something to
+    start from. Names are compared through their character n-grams, each
+    one weighted by how rare it is (TF-IDF) and the score is the cosine
+    similarity, from 0 to 1.
+
+    Names are kept in an inverted index (n-gram -> names containing it):
+    scoring a batch of strings only goes through the names sharing some
+    n-gram with each of them, never through all of them.
+    """
+
+    NGRAM = 3
+    TOP = 3
+    MIN_SCORE = 0.3
+
+    def __init__(self, names):
+        """<names> maps each license name (or identifier) to its license,
+        such as Normalizer.index['exact']."""
+        self.licenses = []
+        self.postings = {}
+        vectors = []
+        frequency = collections.Counter()
+        for name, lic in sorted(names.items()):
+            grams = ngrams(name, self.NGRAM)
+            frequency.update(grams.keys())
+            vectors.append(grams)
+            self.licenses.append(lic)
+
+        total = len(vectors)
+        self.idf = dict((gram, math.log(float(total + 1) / (count + 1)) + 1) \
+                        for gram, count in frequency.items())
+        for row, grams in enumerate(vectors):
+            for gram, weight in self.weigh(grams).items():
+                self.postings.setdefault(gram, []).append((row, weight))
+
+    def weigh(self, grams):
+        """TF-IDF vector of <grams>, normalized (unknown n-grams dropped)."""
+        vector = dict((gram, count * self.idf[gram]) \
+                      for gram, count in grams.items() if gram in self.idf)
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return dict((gram, weight / norm) for gram, weight in vector.items())
+
+    def rank(self, string, top):
+        scores = collections.defaultdict(float)
+        for gram, weight in self.weigh(ngrams(string, self.NGRAM)).items():
+            for row, other in self.postings[gram]:
+                scores[row] += weight * other
+
+        # A license has several names, only the closest one counts
+        best = {}
+        for row, score in scores.items():
+            lic = self.licenses[row]
+            if score >= self.MIN_SCORE and score > best.get(lic, 0.0):
+                best[lic] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        return [(lic, round(score, 3)) for lic, score in ranked[:top]]
+
+    def suggest(self, strings, top=TOP):
+        """Returns {string: [(license, score), ...]} with the <top> closest
+        licenses for each of <strings>, best first. Strings without any
+        license close enough aren't included."""
+        suggestions = {}
+        for string in set(strings):
+            ranked = self.rank(string, top)
+            if ranked:
+                suggestions[string] = ranked
+            else:
+                logging.debug("No license looks like: %s", string)
+        return suggestions
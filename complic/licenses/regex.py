@@ -1,11 +1,139 @@
 #!/usr/bin/env python
 
+import collections
 import os
 import json
 import re
 import logging
+import sre_parse
 
 from complic.licenses import exceptions
+from complic.utils import cache
+
+
+INVENTORY = os.path.join(os.path.dirname(__file__), 'inventory.json')
+# Built by tools/licgen from the inventory, see build_index
+INDEX = os.path.join(os.path.dirname(__file__), 'index.json')
+
+
+def canonical(string):
+    """Lowercase, with anything but letters, digits, '.' and '+' squashed
+    into single spaces: 'Apache-2.0' == 'apache 2.0'."""
+    return re.sub(r'[^a-z0-9.+]+', ' ', string.lower()).strip()
+
+
+def literal_prefixes(items):
+    """Set of literals every match of the parsed regex <items> starts with.
+
+    None if a match could start with anything."""
+    prefix = []
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            prefix.append(unichr(av))
+            continue
+        if prefix:
+            break
+        if op == sre_parse.SUBPATTERN:
+            return literal_prefixes(av[-1])
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] > 0:
+            return literal_prefixes(av[2])
+        if op == sre_parse.BRANCH:
+            prefixes = set()
+            for branch in av[1]:
+                nested = literal_prefixes(branch)
+                if nested is None:
+                    return None
+                prefixes.update(nested)
+            return prefixes
+        return None
+    return set([''.join(prefix)]) if prefix else None
+
+
+def required_literals(items):
+    """Literals every match of the parsed regex <items> contains."""
+    found = []
+    run = []
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            run.append(unichr(av))
+            continue
+        if run:
+            found.append(''.join(run))
+            run = []
+        if op == sre_parse.SUBPATTERN:
+            found.extend(required_literals(av[-1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] > 0:
+            found.extend(required_literals(av[2]))
+    if run:
+        found.append(''.join(run))
+    return found
+
+
+def build_index(lics):
+    """Everything needed to match strings against the inventory <lics>.
+
+    Only the regexes are kept from the inventory, along with:
+        * exact (canonical) license identifiers and names
+        * the literal prefixes a regex requires (re.match is anchored)
+        * otherwise, a literal the regex requires somewhere
+    Only contains strings, lists and dicts so that it can be stored as
+    JSON (see tools/licgen)."""
+    index = {
+        # license -> regex
+        'licenses': {},
+        # canonical name/id -> license, current ids win over deprecated ones
+        'exact': {},
+        # first character -> [(prefix, license)]
+        'by_prefix': {},
+        # literal -> [license]
+        'by_literal': {},
+        # license -> position in the inventory, regexes are tried in order
+        'order': {},
+        'unindexed': [],
+    }
+
+    for position, lic in enumerate(lics):
+        index['order'][lic] = position
+
+    ordered = sorted(lics.items(), key=lambda item: (bool(item[1].get(
+        'isDeprecatedLicenseId')), item[0]))
+    for lic, props in ordered:
+        index['licenses'][lic] = props['regexp']
+        for name in [lic, props.get('licenseId'), props.get('name')]:
+            if name:
+                index['exact'].setdefault(canonical(name), lic)
+
+        parsed = sre_parse.parse(props['regexp'])
+        literals = required_literals(parsed)
+        prefixes = literal_prefixes(parsed)
+        if prefixes:
+            for prefix in sorted(prefixes):
+                index['by_prefix'].setdefault(prefix[0], []).append([prefix,
+                                                                     lic])
+        elif literals:
+            longest = max(literals, key=len)
+            index['by_literal'].setdefault(longest, []).append(lic)
+        else:
+            index['unindexed'].append(lic)
+    return index
+
+
+def load_index():
+    """The index of the default inventory.
+
+    Read from the precompiled INDEX when it's up to date (built from the
+    current inventory), otherwise built from the inventory itself."""
+    digest = cache.file_digest(INVENTORY)
+    if os.path.isfile(INDEX):
+        with open(INDEX, 'r') as index_file:
+            index = json.loads(index_file.read())
+        if index.get('inventory') == digest:
+            return index
+        logging.warning("Outdated %s, run tools/licgen/generate.py", INDEX)
+    with open(INVENTORY, 'r') as inventory:
+        index = build_index(json.loads(inventory.read()))
+    index['inventory'] = digest
+    return index
 
 
 class Normalizer(object):
@@ -20,39 +148,133 @@ class Normalizer(object):
     usually into its SPDX definition (if it exists). We keep track of all
     known licenses in our own inventory since the SPDX index is extensive
     but still limited.
+
+    Running every regex of the inventory for each string is slow, so they
+    are indexed (see build_index) and only the regexes whose requirements
+    are met by a string are run. The index is only loaded once the first
+    string is matched and each regex is only compiled when first needed.
+
+    The same few strings show up over and over, so the results (unknown
+    licenses included) of the last MEMO_SIZE strings are remembered.
     """
 
-    def __init__(self, lics=None):
+    MEMO_SIZE = 4096
+
+    def __init__(self, lics=None, persistent=False):
         """The license inventory file <licenses> has the mandatory structure:
 
         unique_lic_identifier:
             'regex': some([regex]expression)
+
+        With <persistent>, results are also kept between runs (see save),
+        for as long as the inventory doesn't change.
         """
-        self.licenses = {}
-        if lics is None:
-            inventory_path = os.path.join(os.path.dirname(__file__),
-                                          'inventory.json')
-            with open(inventory_path, 'r') as inventory:
-                lics = json.loads(inventory.read())
+        self.lics = lics
+        self._index = None
+        self.compiled = {}
+
+        self.memo = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store = None
+        if persistent:
+            self.store = cache.Store('licenses')
+            if lics is None:
+                self.key = cache.file_digest(INVENTORY)
+            else:
+                self.key = cache.digest(json.dumps(lics, sort_keys=True))
+            for string, lic in self.store.get(self.key, []):
+                self.memo[string] = lic
+
+    @property
+    def index(self):
+        if self._index is None:
+            if self.lics is None:
+                self._index = load_index()
+            else:
+                self._index = build_index(self.lics)
+        return self._index
 
-        for lic, props in lics.items():
-            props['regexp'] = re.compile(props['regexp'])
-            self.licenses[lic] = props
+    @property
+    def licenses(self):
+        """License identifier -> regex (not compiled)."""
+        return self.index['licenses']
+
+    def regexp(self, lic):
+        if lic not in self.compiled:
+            self.compiled[lic] = re.compile(self.licenses[lic])
+        return self.compiled[lic]
+
+    def candidates(self, string):
+        """Licenses whose regex could possibly match <string>."""
+        index = self.index
+        found = set(index['unindexed'])
+        for prefix, lic in index['by_prefix'].get(string[:1], []):
+            if string.startswith(prefix):
+                found.add(lic)
+        for literal, lics in index['by_literal'].items():
+            if literal in string:
+                found.update(lics)
+        return found
 
     def match(self, string):
-        """Finds the first regex that matches and returns its "name".
+        """Returns the license <string> refers to (see lookup).
+
+        If there are no matches, an exception is thrown."""
+        if string in self.memo:
+            self.hits += 1
+            lic = self.memo.pop(string) # Re-inserted as the most recent
+        else:
+            self.misses += 1
+            lic = self.lookup(string)
+            if len(self.memo) >= self.MEMO_SIZE:
+                self.memo.popitem(last=False)
+        self.memo[string] = lic
+        if lic is None:
+            raise exceptions.UnknownLicenseError
+        return lic
+
+    def save(self):
+        """Keeps the remembered results for the next runs (if persistent)."""
+        if self.store:
+            self.store.set(self.key, list(self.memo.items()))
 
-        If there are no matches, an exception is thrown.
+    @property
+    def stats(self):
+        return {'cache hits': self.hits, 'cache misses': self.misses}
+
+    def lookup(self, string):
+        """Finds the regex that best matches and returns its "name".
+
+        An exact license identifier or name (case, spaces and dashes
+        aside) wins. Otherwise it's the first regex matching, in the order
+        of the inventory: the index only skips the regexes which can't
+        match, the answer is the same as trying all of them in turn.
+
+        If there are no matches, None is returned.
 
         Example:
-            >>> match('Licensed with BSD 2-Clause')
+            >>> lookup('Licensed with BSD 2-Clause')
             BSD-2
 
-            >>> match('This is some unknown license')
-            raise UnknownLicenseError
+            >>> lookup('This is some unknown license')
+            None
         """
-        for lic, props in self.licenses.items():
-            if props['regexp'].match(string):
-                logging.debug("SPDX (%s) found for: %s", lic, string)
-                return lic
-        raise exceptions.UnknownLicenseError
+        lic = self.index['exact'].get(canonical(string))
+        if lic:
+            logging.debug("SPDX (%s) found for: %s", lic, string)
+            return lic
+
+        best = None
+        for lic in self.candidates(string):
+            found = self.regexp(lic).match(string)
+            if not found:
+                continue
+            rank = (self.index['order'][lic], lic)
+            if best is None or rank < best:
+                best = rank
+        if best is None:
+            logging.debug("No SPDX found for: %s", string)
+            return None
+        logging.debug("SPDX (%s) found for: %s", best[1], string)
+        return best[1]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Identifies licenses from their full text (LICENSE, COPYING, etc. files).
+"""
+
+import collections
+import logging
+import os
+import re
+import zlib
+
+from complic.utils import fs
+
+
+# Reference texts, named after the SPDX identifier of the license
+TEXTS = os.path.join(os.path.dirname(__file__), 'texts')
+
+# Files in which packages ship their license: LICENSE, COPYING.txt, ...
+LICENSE_FILE = re.compile(r'^(licen[cs]e|copying|notice)([.\-_].*)?$', re.I)
+
+# What changes between two copies of the same license: copyright lines
+# and <placeholders> (in the reference texts) for the copyright holders
+NOTICE = re.compile(u'^\\W*((portions\\s+)?copyright\\s*(\\(c\\)|\xa9|\\d|<)'
+                    u'|(\\(c\\)|\xa9)\\s*\\d'
+                    u'|all rights reserved\\W*$).{0,160}$', re.I | re.M | re.U)
+PLACEHOLDER = re.compile(r'<[^<>\n]{1,80}>')
+# Numbering of the clauses: "1.", "(a)", "*", ...
+ITEM = re.compile(u'^[ \\t]*(\\(?(\\d{1,2}|[a-z])[.)]|[*\\-\u2022])[ \\t]',
+                  re.I | re.M | re.U)
+# A title above the copyright notice ("The MIT License (MIT)") is left out
+TITLE_WORDS = 6
+# Clauses naming whoever licenses the software ("the copyright holder",
+# "the Regents", "Google Inc.", ...), reduced to the same words
+HOLDERS = [
+    (re.compile(r'\bneither the name of (\w+ ){0,12}?nor the names of\b'),
+     'neither the name of holder nor the names of'),
+    (re.compile(r'\bprovided by (\w+ ){0,8}?as is\b'),
+     'provided by holder as is'),
+    (re.compile(r'\bin no event shall (\w+ ){0,8}?be liable\b'),
+     'in no event shall holder be liable'),
+    (re.compile(r'\bas is and (\w+ ){0,8}?disclaims? all warranties\b'),
+     'as is and holder disclaims all warranties'),
+]
+# Anything after it (how to apply the license, etc.) isn't part of the terms
+END_OF_TERMS = re.compile(r'\bend of terms and conditions\b')
+
+
+def tokenize(text):
+    """Lowercase words of the license terms, punctuation, layout, copyright
+    notices and copyright holders don't matter."""
+    notice = NOTICE.search(text)
+    if notice and len(re.findall(r'\w+', text[:notice.start()], re.U)) \
+            <= TITLE_WORDS:
+        text = text[notice.end():]
+    text = PLACEHOLDER.sub(' ', NOTICE.sub(' ', ITEM.sub(' ', text)))
+    text = ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+    for regex, replacement in HOLDERS:
+        text = regex.sub(replacement, text)
+    end = END_OF_TERMS.search(text)
+    if end:
+        text = text[:end.end()]
+    return text.split()
+
+
+def shingle_sequence(text, size):
+    """Hashes of every run of <size> consecutive words of <text>, in order."""
+    words = tokenize(text)
+    runs = range(max(len(words) - size + 1, 1)) if words else []
+    return [zlib.crc32(' '.join(words[i:i + size]).encode('utf8')) \
+            & 0xffffffff for i in runs]
+
+
+def shingles(text, size):
+    """Hashes of <text> (see shingle_sequence), in no particular order."""
+    return set(shingle_sequence(text, size))
+
+
+def trim(ordered, reference):
+    """Shingles of <ordered> from the first to the last one found in
+    <reference>: what comes before or after the license terms (a title,
+    a preamble, an appendix...) is left out, what's in between stays."""
+    found = [i for i, value in enumerate(ordered) if value in reference]
+    if not found:
+        return set()
+    return set(ordered[found[0]:found[-1] + 1])
+
+
+def similarity(first, second):
+    """Jaccard index of two shingle sets."""
+    if not first or not second:
+        return 0.0
+    return float(len(first & second)) / len(first | second)
+
+
+def license_files(directory):
+    """Paths of the files in <directory> that look like license texts."""
+    try:
+        _, files = fs.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(files) \
+            if LICENSE_FILE.match(name)]
+
+
+class Detector(object):
+    """Tells which license a text is, along with how confident we are.
+
+    Each text is turned into shingles (hashes of SHINGLE consecutive
+    words) and those into a MinHash signature (one permutation: the
+    lowest hash in each of HASHES bins). Signatures are split in bands of
+    ROWS values, reference texts sharing a band with the text are the
+    only ones compared (locality sensitive hashing), so the cost of a
+    lookup doesn't depend on how many reference texts there are. The
+    confidence is the similarity (Jaccard index) of the shingles.
+
+    Licenses often come in variants only a sentence apart (MIT and JSON,
+    BSD-3-Clause and BSD-4-Clause, ...). Those have reference texts of
+    their own and anything below MIN_CONFIDENCE is left unidentified:
+    a wrong license is worse than none. What varies between copies of the
+    same license doesn't count against it: copyright notices and holders
+    (see tokenize), text around the terms (see trim).
+
+    The reference texts (see TEXTS) are only read and indexed once the
+    first text is identified.
+    """
+
+    SHINGLE = 5
+    HASHES = 64
+    ROWS = 2
+    MIN_CONFIDENCE = 0.95
+    # Only the beginning of (huge) files is read
+    MAX_SIZE = 64 * 1024
+    # Value of the bins no hash fell into
+    EMPTY = 1 << 32
+
+    def __init__(self, texts=TEXTS):
+        self.texts = texts
+        self._index = None
+        self.stats = collections.Counter()
+
+    def signature(self, hashes):
+        signature = [self.EMPTY] * self.HASHES
+        for value in hashes:
+            # Scrambled first, crc32 values of similar shingles are close
+            value = (value * 0x9e3779b1) & 0xffffffff
+            slot = value % self.HASHES
+            if value < signature[slot]:
+                signature[slot] = value
+        return signature
+
+    def bands(self, hashes):
+        """Keys of the LSH buckets a shingle set falls into."""
+        signature = self.signature(hashes)
+        return [(start, tuple(signature[start:start + self.ROWS])) \
+                for start in range(0, self.HASHES, self.ROWS)]
+
+    @property
+    def index(self):
+        if self._index is None:
+            logging.debug("Indexing license texts from: %s", self.texts)
+            index = {'shingles': {}, 'buckets': {}}
+            _, files = fs.listdir(self.texts)
+            for name in sorted(files):
+                lic, extension = os.path.splitext(name)
+                if extension != '.txt':
+                    continue
+                with open(os.path.join(self.texts, name), 'rb') as text:
+                    hashes = shingles(text.read().decode('utf8'), self.SHINGLE)
+                index['shingles'][lic] = hashes
+                for band in self.bands(hashes):
+                    index['buckets'].setdefault(band, []).append(lic)
+            self._index = index
+        return self._index
+
+    def identify(self, text):
+        """Returns (license, confidence) for the reference text closest to
+        <text>, None if there's nothing similar enough."""
+        ordered = shingle_sequence(text, self.SHINGLE)
+        if not ordered:
+            return None
+        index = self.index
+        candidates = set()
+        for band in self.bands(set(ordered)):
+            candidates.update(index['buckets'].get(band, []))
+
+        best = None
+        for lic in sorted(candidates):
+            reference = index['shingles'][lic]
+            confidence = similarity(trim(ordered, reference), reference)
+            if best is None or confidence > best[1]:
+                best = (lic, confidence)
+        if best is None or best[1] < self.MIN_CONFIDENCE:
+            return None
+        return best
+
+    def identify_file(self, path):
+        try:
+            with open(path, 'rb') as text:
+                contents = text.read(self.MAX_SIZE)
+        except IOError as e:
+            logging.warning("Unable to read %s: %s", path, e)
+            return None
+        found = self.identify(contents.decode('utf8', 'replace'))
+        if found:
+            self.stats['license files identified'] += 1
+            logging.debug("License text (%s, %.2f) found in: %s",
+                          found[0], found[1], path)
+        else:
+            self.stats['license files unidentified'] += 1
+        return found
+
+    def scan(self, directory):
+        """Licenses (-> confidence) of the license files in <directory>."""
+        found = {}
+        for path in license_files(directory):
+            result = self.identify_file(path)
+            if result:
+                lic, confidence = result
+                found[lic] = max(confidence, found.get(lic, 0.0))
+        return found
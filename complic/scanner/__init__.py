@@ -1,13 +1,48 @@
 #!/usr/bin/env python
 
-from . import java, npm, python, cocoapods
+from .base import LazyScanner, under
 
 
+# Scanner module -> files it's interested in. The modules are only
+# imported when (and if) one of those files is found.
+PATTERNS = [
+    ('complic.scanner.java', [r'.*/pom.xml$']),
+    ('complic.scanner.npm', [r'.*/package.json$',
+                             r'.*/package-lock.json$',
+                             r'.*/yarn.lock$',
+                             r'.*/pnpm-lock.yaml$']),
+    ('complic.scanner.python', [r'.*/setup.py$', r'.*/pyvenv.cfg$']),
+    ('complic.scanner.cocoapods', [r'.*/Podfile.lock$',
+                                   r'.*/Pods/Manifest.lock$']),
+]
 
-def get():
-    return [
-        java.Scanner(),
-        npm.Scanner(),
-        python.Scanner(),
-        cocoapods.Scanner(),
-    ]
+
+# Python archives, only read from wheelhouses (see python.Scanner)
+ARCHIVES = [r'\.whl$', r'\.(tar\.gz|tgz|tar\.bz2|zip)$']
+
+
+def get(offline=False, site_packages=None, wheelhouses=None):
+    """All the scanners. <offline> scanners avoid invoking build tools
+    whenever they have a way around it. Python packages are read from
+    <site_packages> (if given) instead of being installed, and from the
+    archives in <wheelhouses>.
+
+    They are LazyScanners, loaded once the Dispatcher finds a file for
+    them."""
+    args = {
+        'complic.scanner.java': (offline,),
+        'complic.scanner.python': (site_packages, wheelhouses),
+        'complic.scanner.cocoapods': (offline,),
+    }
+    extra = {
+        'complic.scanner.python': [under(wheelhouses, archive) \
+                                   for archive in ARCHIVES] \
+                                  if wheelhouses else [],
+    }
+    scanners = [LazyScanner(module, patterns + extra.get(module, []),
+                            *args.get(module, ()))
+                for module, patterns in PATTERNS]
+    if site_packages:
+        # Read whether or not any python project file shows up
+        scanners[2].load()
+    return scanners
@@ -6,8 +6,325 @@
     The "scan" method should be left alone, everything else should be overriden.
 """
 
+import collections
+import importlib
 import logging
+import multiprocessing
 import re
+import threading
+from multiprocessing.pool import ThreadPool
+
+import complic.utils.fs
+
+
+# Handler regexes such as r'.*/pom.xml$' or r'.*\.whl$' only look at the end of
+# the path. Those are routed through a lookup table instead of evaluating
+# every regex against every file.
+_BASENAME_REGEX = re.compile(r'^\.\*/((?:[\w\-]|\\?\.)+)\$$')
+_SUFFIX_REGEX = re.compile(r'^\.\*(\\\.(?:[\w\-]|\\?\.)+)\$$')
+
+
+def under(directories, pattern):
+    """Regex (a string) for the paths matching <pattern>, such as r'\\.whl$',
+    found anywhere below one of <directories>."""
+    prefix = '|'.join(re.escape(d.rstrip('/')) for d in directories)
+    return r'^(?:%s)/.*%s' % (prefix, pattern)
+
+
+# Number of files handed to a worker process at once
+CHUNK_SIZE = 256
+
+
+def run_batch(batch):
+    """Runs a handler over a list of paths, inside a worker process.
+
+    <batch> is (module, handler name, [path, ...]). The handler is looked up
+    by name in the module's Scanner class since functions can't be pickled.
+
+    Returns (dependencies, stats), the scanner's stats are sent back to be
+    merged in the parent process.
+    """
+    module, name, paths = batch
+    scanner = importlib.import_module(module).Scanner
+    handler = getattr(scanner, name)
+    deps = []
+    for path in paths:
+        deps.extend(handler(path))
+    counter = getattr(scanner, 'stats', collections.Counter())
+    stats = dict(counter)
+    counter.clear()
+    return deps, stats
+
+
+def literal_match(regex):
+    """Returns ('basename'|'suffix', literal) if <regex> can be replaced by
+    a plain string comparison on the end of the path, (None, None) otherwise.
+
+    Candidates found through the literal are still confirmed with the regex,
+    this only decides which regexes are worth trying."""
+    for kind, pattern in [('basename', _BASENAME_REGEX),
+                          ('suffix', _SUFFIX_REGEX)]:
+        match = pattern.match(regex.pattern)
+        if match:
+            return kind, match.group(1).replace('\\.', '.')
+    return None, None
+
+
+class Dispatcher(object):
+    """Routes each file to the handlers (of all scanners) interested in it.
+
+    The file list is traversed only once, whatever the number of scanners
+    and handlers. Dependencies are returned grouped by scanner, in the
+    order the scanners were given.
+
+    Every path seen goes into a complic.utils.fs.Index shared with the
+    scanners (as scanner.index) so handlers can look around their file
+    without walking the filesystem again. Handlers are only invoked once
+    the whole file list went through it.
+
+    With <jobs> greater than 1, the files are routed first and then each
+    scanner runs its handlers in its own thread (at most <jobs> at once).
+    A scanner blowing up is logged and contributes no dependencies, the
+    others carry on. The results are the same as running serially.
+
+    With <processes> greater than 1, files for handlers registered as
+    parallel are sent in chunks to a pool of worker processes. Their
+    dependencies come after the ones from the other handlers of the same
+    scanner.
+    """
+
+    def __init__(self, scanners, jobs=1, processes=1):
+        self.scanners = list(scanners)
+        self.jobs = jobs
+        self.processes = processes
+        self.pool = None
+        self.index = None
+        self.basenames = {}
+        self.suffixes = {}
+        self.fallback = []
+        for position, scanner in enumerate(self.scanners):
+            self.add_routes(position, scanner)
+
+    def add_routes(self, position, scanner):
+        """Routes files to the handlers of <scanner>.
+
+        A LazyScanner only gets its files routed to itself (the handler is
+        None) and is replaced by the actual scanner on the first one."""
+        if isinstance(scanner, LazyScanner):
+            handlers = [(regex, None) for regex in scanner.patterns]
+        else:
+            handlers = scanner.handlers.items()
+        for regex, handler in handlers:
+            entry = (position, regex, handler, regex in scanner.parallel)
+            kind, literal = literal_match(regex)
+            if kind == 'basename':
+                self.basenames.setdefault(literal, []).append(entry)
+            elif kind == 'suffix':
+                self.suffixes.setdefault(literal, []).append(entry)
+            else:
+                self.fallback.append(entry)
+
+    def remove_routes(self, position):
+        for table in list(self.basenames.values()) + \
+                     list(self.suffixes.values()) + [self.fallback]:
+            table[:] = [entry for entry in table if entry[0] != position]
+
+    def load(self, position):
+        """Replaces the LazyScanner at <position> with the actual scanner."""
+        scanner = self.scanners[position].load()
+        scanner.reset()
+        scanner.index = self.index
+        self.scanners[position] = scanner
+        self.remove_routes(position)
+        self.add_routes(position, scanner)
+
+    def route(self, path):
+        """Yields (scanner position, handler, parallel) for every handler
+        matching <path>."""
+        basename = path.rsplit('/', 1)[-1]
+        candidates = list(self.basenames.get(basename, []))
+        for suffix, entries in self.suffixes.items():
+            if basename.endswith(suffix):
+                candidates.extend(entries)
+        candidates.extend(self.fallback)
+        matches = [(position, handler, parallel) \
+                   for position, regex, handler, parallel in candidates \
+                   if regex.match(path)]
+        lazy = set(position for position, handler, _ in matches \
+                   if handler is None)
+        if lazy:
+            for position in sorted(lazy):
+                self.load(position)
+            matches = list(self.route(path))
+        return matches
+
+    def submit(self, handler, paths):
+        """Sends a chunk of paths to the process pool."""
+        batch = (handler.__module__, handler.__name__, paths)
+        return self.pool.apply_async(run_batch, (batch,))
+
+    def run(self, job):
+        """Runs the handlers of one scanner, used in concurrent mode.
+
+        <job> is (scanner position, [(handler, path), ...])."""
+        position, work = job
+        scanner = self.scanners[position]
+        threading.current_thread().name = scanner.__module__
+        deps = []
+        try:
+            for handler, path in work:
+                deps.extend(handler(path))
+        except Exception: # pylint: disable=broad-except
+            logging.exception("Scanner failed, ignoring its results: %s",
+                              scanner.__module__)
+            return []
+        return deps
+
+    def collect(self, position, deps, results):
+        """Adds the dependencies of the chunks (AsyncResults) the process
+        pool ran for a scanner to <deps>. As in run, a failing handler
+        only drops the results of its own scanner."""
+        scanner = self.scanners[position]
+        try:
+            for result in results:
+                chunk, stats = result.get()
+                deps.extend(chunk)
+                scanner.stats.update(stats)
+        except Exception: # pylint: disable=broad-except
+            logging.exception("Scanner failed, ignoring its results: %s",
+                              scanner.__module__)
+            return []
+        return deps
+
+    def finish(self, position, deps):
+        """Adds what the scanner at <position> finds once all the files
+        went through it to <deps>, failures isolated as in run."""
+        scanner = self.scanners[position]
+        try:
+            deps.extend(scanner.finish())
+        except Exception: # pylint: disable=broad-except
+            logging.exception("Scanner failed, ignoring its results: %s",
+                              scanner.__module__)
+            return []
+        return deps
+
+    def dispatch(self, filelist):
+        """Runs the handlers over <filelist>, returns their dependencies
+        grouped by scanner.
+
+        Handlers only run once the whole file list went through the index:
+        any directory they query is fully known by then."""
+        found = [[] for _ in self.scanners]
+        # Process pool mode: {(position, handler): [path, ...]} not yet sent
+        chunks = collections.OrderedDict()
+        # [[AsyncResult, ...], ...] for each scanner
+        submitted = [[] for _ in self.scanners]
+        for path in filelist:
+            self.index.add(path)
+            for position, handler, parallel in self.route(path):
+                if parallel and self.pool is not None:
+                    chunk = chunks.setdefault((position, handler), [])
+                    chunk.append(path)
+                    if len(chunk) >= CHUNK_SIZE:
+                        submitted[position].append(self.submit(handler, chunk))
+                        chunks[(position, handler)] = []
+                else:
+                    found[position].append((handler, path))
+
+        for (position, handler), chunk in chunks.items():
+            if chunk:
+                submitted[position].append(self.submit(handler, chunk))
+
+        if self.jobs > 1:
+            pool = ThreadPool(min(self.jobs, len(self.scanners)))
+            try:
+                found = pool.map(self.run, enumerate(found))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            found = [[dep for handler, path in work for dep in handler(path)] \
+                     for work in found]
+
+        if self.pool is not None:
+            for position, results in enumerate(submitted):
+                found[position] = self.collect(position, found[position],
+                                               results)
+        return found
+
+    def scan(self, filelist):
+        index = complic.utils.fs.Index(ignore=getattr(filelist, 'ignore', None))
+        self.index = index
+        for scanner in self.scanners:
+            logging.info("Scanning with: %s", scanner.__module__)
+            scanner.reset()
+            scanner.index = index
+        if self.processes > 1:
+            # Forked before any thread starts (walking the tree, running the
+            # scanners): a thread holding a lock while forking leaves it
+            # locked for good in the workers
+            self.pool = multiprocessing.Pool(self.processes)
+        try:
+            found = self.dispatch(filelist)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+        found = [self.finish(position, deps) \
+                 for position, deps in enumerate(found)]
+
+        dependencies = []
+        for scanner, deps in zip(self.scanners, found):
+            logging.info("Dependencies collected by %s: %i",
+                         scanner.__module__, len(deps))
+            for stat, value in sorted(scanner.stats.items()):
+                logging.info("%s: %s: %i", scanner.__module__, stat, value)
+            dependencies.extend(deps)
+        return dependencies
+
+
+class LazyScanner(object):
+    """Stands for the Scanner of <module> until it's actually needed.
+
+    Files matching any of the <patterns> (regexes, which must cover all
+    the handlers the scanner registers) are what the scanner is interested
+    in. Only when the Dispatcher comes across one, the module is imported
+    and its Scanner instantiated (with <args>). Until then, nothing is
+    imported and no executable is looked for."""
+
+    parallel = frozenset()
+
+    def __init__(self, module, patterns, *args):
+        # Reported as the module it stands for, same as actual scanners
+        self.__module__ = module
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.args = args
+        self.scanner = None
+        self.index = None
+
+    def load(self):
+        if self.scanner is None:
+            logging.debug("Loading scanner: %s", self.__module__)
+            module = importlib.import_module(self.__module__)
+            self.scanner = module.Scanner(*self.args)
+        return self.scanner
+
+    def reset(self):
+        if self.scanner:
+            self.scanner.reset()
+
+    def finish(self):
+        if self.scanner:
+            return self.scanner.finish()
+        return []
+
+    @property
+    def stats(self):
+        if self.scanner:
+            return self.scanner.stats
+        return collections.Counter()
 
 
 class Scanner(object):
@@ -16,30 +333,56 @@ class Scanner(object):
     """
 
     def __init__(self):
+        # Counters about the scan, shown in the report. Static handlers
+        # (which may run in worker processes) can't reach the instance:
+        # subclasses counting from those point it to a class attribute.
+        self.stats = collections.Counter()
         self.handlers = {}
+        # Regexes whose handler may run in a worker process
+        self.parallel = set()
+        # Index of all the files in the scan, set by the Dispatcher
+        self.index = None
+
+    def get_index(self, directory, *changed):
+        """Returns an index covering <directory>.
+
+        That's the shared index, after re-reading <changed> (directories
+        some build tool has just written to). Without a shared index (the
+        handler is invoked directly), <directory> is walked instead."""
+        if self.index is None:
+            return complic.utils.fs.Index(complic.utils.fs.Find(directory))
+        for path in changed:
+            self.index.refresh(path)
+        return self.index
 
-    def register_handler(self, regex, callback):
+    def reset(self):
+        """Forgets about previous scans, called before each one."""
+        self.stats.clear()
+
+    def finish(self):
+        """Dependencies which don't come from any file in particular, called
+        once all the files went through the handlers."""
+        return []
+
+    def register_handler(self, regex, callback, parallel=False):
         """Handler is a simple regex-based callback.
 
         If the file matches the regex, the callback is invoked.
+
+        A <parallel> handler may be invoked in a worker process, so it must
+        be a staticmethod of the module's Scanner class, only depend on the
+        path it's given and return picklable dependencies.
         """
         self.handlers[regex] = callback
+        if parallel:
+            self.parallel.add(regex)
 
     def scan(self, filelist):
         """This should be left alone.
 
         The interface used by the logic engine to invoke all scanners.
         """
-        logging.info("Scanning with: %s", self.__module__)
-        dependencies = []
-        for path in filelist:
-            for regex, handler in self.handlers.items():
-                if not regex.match(path):
-                    continue
-                for dependency in handler(path):
-                    dependencies.append(dependency)
-        logging.info("Dependencies collected: %i", len(dependencies))
-        return dependencies
+        return Dispatcher([self]).scan(filelist)
 
 
 class Dependency(object):
@@ -67,6 +410,13 @@ class Dependency(object):
         """
         self.licenses = set()
 
+        # The directory the package itself lives in (if known), where its
+        # LICENSE file may be. Never the directory of the project scanned.
+        self.package_dir = None
+        # License -> confidence (0 to 1), for licenses which were guessed
+        # instead of declared (see complic.licenses.text)
+        self.confidence = {}
+
     def __repr__(self): # pragma: nocover
         """This is only used for debugging."""
         lics = set('Unknown')
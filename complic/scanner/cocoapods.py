@@ -3,12 +3,15 @@
     Scan all Podfile.lock files.
 """
 
+import glob
+import hashlib
 import logging
 import json
+import os
 import re
-import distutils
+from multiprocessing.pool import ThreadPool
 
-from complic.utils import shell
+from complic.utils import cache, shell
 
 from . import base
 from . import npm
@@ -17,31 +20,106 @@ from . import npm
 class Scanner(base.Scanner):
     """Scan all Podfile.lock files.
 
-    Depends on having "pod" executable in the PATH."""
+    Depends on having "pod" executable in the PATH.
 
-    def __init__(self):
+    Podspecs are first looked for on disk: in the project's Pods/ and in
+    the Specs repos "pod setup" cloned to ~/.cocoapods/repos. Only when
+    they aren't there (and we're not <offline>) "pod" is invoked.
+
+    Podspecs are resolved with up to <JOBS> "pod" processes at once and
+    kept in ~/.complic/cache/podspecs: a given version of a pod never
+    changes, so it's only ever resolved once."""
+
+    JOBS = 8
+    REPOS = os.path.join(os.environ.get("HOME", os.getcwd()),
+                         '.cocoapods', 'repos')
+
+    def __init__(self, offline=False):
         super(Scanner, self).__init__()
+        self.offline = offline
 
-        if not distutils.spawn.find_executable('pod'):
+        if not offline and not shell.which('pod'):
             logging.error("Unable to find 'pod' executable in PATH.")
 
         self.register_handler(re.compile(r'.*/Podfile.lock$'),
-                              Scanner.handle_podfile)
+                              self.handle_podfile)
+        # Same format, used for projects which don't commit their Podfile.lock
+        self.register_handler(re.compile(r'.*/Pods/Manifest.lock$'),
+                              self.handle_manifest)
+
+    @staticmethod
+    def get_spec_dirs():
+        """The Specs directories of all the repos in ~/.cocoapods/repos."""
+        spec_dirs = []
+        for repo in sorted(glob.glob(os.path.join(Scanner.REPOS, '*'))):
+            specs = os.path.join(repo, 'Specs')
+            spec_dirs.append(specs if os.path.isdir(specs) else repo)
+        return spec_dirs
 
     @staticmethod
-    def get_podspec(podname):
-        """Returns the JSON structure of the given pod name.
+    def find_podspec(podname, version, project_dir, spec_dirs):
+        """Returns the path of the podspec JSON of <podname> <version>.
 
-        This should have a "version" parameter for completeness sake, but
-        I don't know how to query for specific versions :(
+        Looks in <project_dir>/Pods/Local Podspecs (development pods) and
+        then in <spec_dirs>, which are either sharded by the first
+        characters of the md5 of the name (Specs/1/3/f/Name/1.0/...) or
+        not (Specs/Name/1.0/...). None when it isn't anywhere.
         """
+        filename = podname + '.podspec.json'
+        local = os.path.join(project_dir, 'Pods', 'Local Podspecs', filename)
+        if os.path.isfile(local):
+            return local
+
+        shards = list(hashlib.md5(podname.encode('utf8')).hexdigest()[:3])
+        for spec_dir in spec_dirs:
+            for layout in [shards, []]:
+                path = os.path.join(spec_dir, *(layout + [podname, version,
+                                                         filename]))
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def resolve(self, podname, version, project_dir, spec_dirs):
+        """Podspec from disk if possible, from "pod" otherwise."""
+        path = Scanner.find_podspec(podname, version, project_dir, spec_dirs)
+        if path:
+            logging.debug("Found podspec: %s", path)
+            with open(path, 'r') as podspec:
+                try:
+                    return json.loads(podspec.read())
+                except ValueError:
+                    logging.warning("Invalid podspec: %s", path)
+        if self.offline:
+            logging.warning("Podspec not found locally: %s %s", podname, version)
+            return {}
+        return Scanner.get_podspec(podname, version)
+
+    @staticmethod
+    def get_podspec(podname, version=None):
+        """Returns the JSON structure of the given pod name (and version).
+
+        Without a version, whatever "pod" considers the latest is returned
+        and nothing is cached.
+        """
+        store = cache.Store('podspecs')
+        key = '%s@%s' % (podname, version)
+        if version:
+            podspec = store.get(key)
+            if podspec is not None:
+                return podspec
+
         command = "pod spec cat '%s'" % (podname)
+        if version:
+            command += " --version='%s'" % (version)
         return_code, out, _ = shell.cmd(command)
         if return_code != 0:
             if 'Unable to find a pod with name matching' in out:
                 logging.error("Make sure you have 'pod setup' executed.")
             return {}
-        return json.loads(out)
+        podspec = json.loads(out)
+        if version:
+            store.set(key, podspec)
+        return podspec
 
     @staticmethod
     def get_ids_from_podfile(string):
@@ -65,18 +143,38 @@ class Scanner(base.Scanner):
             identifiers.add(':'.join(['pod', name, version]))
         return identifiers
 
-    @staticmethod
-    def handle_podfile(file_path):
+    def handle_manifest(self, file_path):
+        """Handles Pods/Manifest.lock, unless there's a Podfile.lock too."""
+        project_dir = os.path.dirname(os.path.dirname(file_path))
+        if os.path.isfile(os.path.join(project_dir, 'Podfile.lock')):
+            return []
+        return self.handle_podfile(file_path, project_dir)
+
+    def handle_podfile(self, file_path, project_dir=None):
         """Handles Podfile.lock file.
 
         We should be doing real parsing with a YAML parser, but we just do
         basic stuff instead."""
 
-        dependencies = []
+        project_dir = project_dir or os.path.dirname(file_path)
+        spec_dirs = Scanner.get_spec_dirs()
+        podfile = open(file_path, 'r').read()
+        identifiers = sorted(Scanner.get_ids_from_podfile(podfile))
+
+        def resolve(identifier):
+            _, podname, version = identifier.split(':')
+            return self.resolve(podname, version, project_dir, spec_dirs)
 
-        for identifier in Scanner.get_ids_from_podfile(open(file_path, 'r').read()):
+        pool = ThreadPool(Scanner.JOBS)
+        try:
+            specs = pool.map(resolve, identifiers)
+        finally:
+            pool.close()
+            pool.join()
+
+        dependencies = []
+        for identifier, spec in zip(identifiers, specs):
             dependency = base.Dependency(identifier, file_path)
-            spec = Scanner.get_podspec(identifier.split(':')[1])
             for lic in npm.Scanner.get_licenses(spec):
                 dependency.licenses.add(lic)
             dependencies.append(dependency)
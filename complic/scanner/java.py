@@ -6,30 +6,264 @@
 import logging
 import re
 import os
-import distutils.spawn
+import time
+import xml.etree.ElementTree
 
-import complic.utils.fs
 import complic.utils.shell
 
 from . import base
 
 
+def _children(element, name):
+    """Child elements of <element> called <name>, ignoring namespaces."""
+    if element is None:
+        return []
+    return [child for child in element if child.tag.split('}')[-1] == name]
+
+
+def _child(element, name):
+    children = _children(element, name)
+    return children[0] if children else None
+
+
+def _text(element, name, default=None):
+    child = _child(element, name)
+    if child is None or child.text is None:
+        return default
+    return child.text.strip()
+
+
+class LocalRepository(object):
+    """Reads license information straight from the poms in ~/.m2/repository.
+
+    Poms are parsed with their <parent> chain (memoized, since most
+    artifacts share a handful of parents) into a small model:
+        {
+            'coords': (group, artifact, version),
+            'properties': {name: value},
+            'licenses': [name, ...],
+            'management': {(group, artifact): version},
+            'dependencies': [{'coords', 'scope', 'optional', 'exclusions'}],
+        }
+
+    This is a best-effort approximation of Maven's resolution: version
+    ranges, profiles and relocations aren't supported.
+    """
+
+    # Transitive dependencies with any other scope don't end up in the build
+    SCOPES = [None, 'compile', 'runtime']
+    # Direct ones do, except for tests (like -Dlicense.excludedScopes=test)
+    EXCLUDED_SCOPES = ['test']
+    # Model of a pom without a parent
+    EMPTY = {
+        'coords': (None, None, None),
+        'properties': {},
+        'licenses': [],
+        'management': {},
+        'dependencies': [],
+    }
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(os.environ.get("HOME", os.getcwd()),
+                                '.m2', 'repository')
+        self.path = path
+        self.models = {}
+
+    def pom_path(self, group, artifact, version):
+        return os.path.join(self.path, group.replace('.', os.sep), artifact,
+                            version, '%s-%s.pom' % (artifact, version))
+
+    def get(self, group, artifact, version):
+        """Returns the model of an artifact in the repository (or None)."""
+        coords = (group, artifact, version)
+        if coords not in self.models:
+            self.models[coords] = None
+            path = self.pom_path(*coords)
+            if os.path.isfile(path):
+                self.models[coords] = self.load(path, resolve_relative=False)
+            else:
+                logging.debug("Pom not found in local repository: %s", path)
+        return self.models[coords]
+
+    @staticmethod
+    def interpolate(value, properties):
+        """Replaces ${property} references (recursively, within reason)."""
+        if value is None:
+            return None
+        for _ in range(10):
+            expanded = re.sub(r'\$\{([^}]+)\}',
+                              lambda m: properties.get(m.group(1)) or m.group(0),
+                              value)
+            if expanded == value:
+                break
+            value = expanded
+        return value
+
+    def load(self, pom_path, resolve_relative=True):
+        """Builds the model of the pom in <pom_path>.
+
+        Project poms (<resolve_relative>) look for their parent in the
+        <relativePath> first, like Maven does for reactor modules."""
+        try:
+            project = xml.etree.ElementTree.parse(pom_path).getroot()
+        except (IOError, xml.etree.ElementTree.ParseError):
+            logging.warning("Unable to parse pom: %s", pom_path)
+            return None
+
+        parent = None
+        parent_element = _child(project, 'parent')
+        if parent_element is not None:
+            coords = (_text(parent_element, 'groupId'),
+                      _text(parent_element, 'artifactId'),
+                      _text(parent_element, 'version'))
+            if resolve_relative:
+                relative = _text(parent_element, 'relativePath', '../pom.xml')
+                relative = os.path.join(os.path.dirname(pom_path), relative)
+                if os.path.isdir(relative):
+                    relative = os.path.join(relative, 'pom.xml')
+                if os.path.isfile(relative):
+                    parent = self.load(relative)
+                    if parent and parent['coords'] != coords:
+                        parent = None
+            if parent is None:
+                # Even if it isn't in the repository, the groupId and
+                # version are inherited from it
+                parent = self.get(*coords) or dict(self.EMPTY, coords=coords)
+        return self.parse(project, parent)
+
+    def parse(self, project, parent):
+        """Merges the <project> element with its <parent> model."""
+        parent = parent or self.EMPTY
+        group = _text(project, 'groupId', parent['coords'][0])
+        artifact = _text(project, 'artifactId')
+        version = _text(project, 'version', parent['coords'][2])
+
+        properties = dict(parent['properties'])
+        props = _child(project, 'properties')
+        for prop in (list(props) if props is not None else []):
+            properties[prop.tag.split('}')[-1]] = (prop.text or '').strip()
+        for prefix in ['project.', 'pom.', '']:
+            properties[prefix + 'groupId'] = group
+            properties[prefix + 'artifactId'] = artifact
+            properties[prefix + 'version'] = version
+        properties['project.parent.version'] = parent['coords'][2]
+        properties['project.parent.groupId'] = parent['coords'][0]
+        version = self.interpolate(version, properties)
+
+        licenses = [_text(lic, 'name') for lic in \
+                    _children(_child(project, 'licenses'), 'license')]
+        licenses = [lic for lic in licenses if lic] or parent['licenses']
+
+        management = dict(parent['management'])
+        managed = _child(_child(project, 'dependencyManagement'), 'dependencies')
+        for dep in self.parse_dependencies(managed, properties):
+            dep_group, dep_artifact, dep_version = dep['coords']
+            if dep['scope'] == 'import':
+                bom = self.get(*dep['coords'])
+                for key, value in (bom or {}).get('management', {}).items():
+                    management.setdefault(key, value)
+                continue
+            management[(dep_group, dep_artifact)] = dep_version
+
+        dependencies = list(parent['dependencies'])
+        for dep in self.parse_dependencies(_child(project, 'dependencies'),
+                                           properties):
+            if not dep['coords'][2]:
+                dep['coords'] = dep['coords'][:2] + \
+                    (management.get(dep['coords'][:2]),)
+            dependencies.append(dep)
+
+        return {
+            'coords': (group, artifact, version),
+            'properties': properties,
+            'licenses': licenses,
+            'management': management,
+            'dependencies': dependencies,
+        }
+
+    def parse_dependencies(self, element, properties):
+        deps = []
+        for dep in _children(element, 'dependency'):
+            exclusions = set()
+            for exclusion in _children(_child(dep, 'exclusions'), 'exclusion'):
+                exclusions.add((_text(exclusion, 'groupId'),
+                                _text(exclusion, 'artifactId')))
+            deps.append({
+                'coords': tuple(self.interpolate(_text(dep, name), properties) \
+                                for name in ['groupId', 'artifactId', 'version']),
+                'scope': self.interpolate(_text(dep, 'scope'), properties),
+                'optional': _text(dep, 'optional') == 'true',
+                'exclusions': exclusions,
+            })
+        return deps
+
+    def resolve(self, model):
+        """Returns the models of all the runtime dependencies of <model>.
+
+        Breadth first, so the nearest version of an artifact wins."""
+        resolved = []
+        seen = set([model['coords'][:2]])
+        pending = [(dep, set()) for dep in model['dependencies'] \
+                   if dep['scope'] not in self.EXCLUDED_SCOPES]
+        while pending:
+            dep, exclusions = pending.pop(0)
+            group, artifact, version = dep['coords']
+            if (group, artifact) in seen or (group, artifact) in exclusions:
+                continue
+            seen.add((group, artifact))
+            version = model['management'].get((group, artifact), version)
+            if not version or not re.match(r'^[\w.\-]+$', version):
+                logging.debug("Unable to determine version of: %s:%s (%s)",
+                              group, artifact, version)
+                continue
+            resolved.append((group, artifact, version))
+            dep_model = self.get(group, artifact, version)
+            if dep_model is None:
+                continue
+            excluded = exclusions | dep['exclusions']
+            for transitive in dep_model['dependencies']:
+                if transitive['scope'] in self.SCOPES and not transitive['optional']:
+                    pending.append((transitive, excluded))
+        return resolved
+
+
 class Scanner(base.Scanner):
     """
         The handler looks for pom files. We then run the maven plugin
         which produces some THIRD-PARTY files which we will then parse
         for licensing details.
+
+        Without mvn (or when running <offline>) the licenses are read from
+        the poms in the local repository instead (see LocalRepository).
     """
 
-    def __init__(self):
+    def __init__(self, offline=False):
         super(Scanner, self).__init__()
 
-        if not distutils.spawn.find_executable('mvn'):
+        # Reactor root poms already handled in this run
+        self.reactors = set()
+        # {pom path: [module pom path, ...]}
+        self.modules = {}
+        self.repository = LocalRepository()
+
+        if not offline and not complic.utils.shell.which('mvn'):
             logging.error("Unable to find 'mvn' executable in PATH.")
+            offline = True
+
+        if offline:
+            logging.info("Reading licenses from: %s", self.repository.path)
+            self.register_handler(re.compile(r'.*/pom.xml$'),
+                                  self.handle_pom_offline)
             return
 
         self.register_handler(re.compile(r'.*/pom.xml$'),
-                              Scanner.handle_pom)
+                              self.handle_pom)
+
+    def reset(self):
+        super(Scanner, self).reset()
+        self.reactors.clear()
+        self.modules.clear()
 
     @staticmethod
     def parse_thirdparty(thirdparty):
@@ -62,36 +296,155 @@ class Scanner(base.Scanner):
         return dependencies
 
     @staticmethod
-    def handle_pom(file_path):
+    def parse_modules(pom):
+        """Returns the <module> entries (relative paths) of a pom's contents.
+
+        Modules declared inside profiles are included as well, we'd rather
+        look at too many modules than miss some."""
+        try:
+            project = xml.etree.ElementTree.fromstring(pom)
+        except xml.etree.ElementTree.ParseError:
+            logging.warning("Unable to parse pom, assuming no modules.")
+            return []
+        modules = []
+        for element in project.iter():
+            # Strip the {http://maven.apache.org/POM/4.0.0} namespace
+            if element.tag.split('}')[-1] == 'module' and element.text:
+                modules.append(element.text.strip())
+        return modules
+
+    def get_modules(self, pom_path):
+        """Module pom paths declared by <pom_path> (memoized)."""
+        if pom_path not in self.modules:
+            modules = []
+            if os.path.isfile(pom_path):
+                with open(pom_path, 'r') as pom:
+                    names = Scanner.parse_modules(pom.read())
+                for name in names:
+                    path = os.path.join(os.path.dirname(pom_path), name)
+                    if not path.endswith('.xml'):
+                        path = os.path.join(path, 'pom.xml')
+                    modules.append(os.path.normpath(path))
+            self.modules[pom_path] = modules
+        return self.modules[pom_path]
+
+    def get_reactor(self, pom_path):
+        """Returns the reactor root pom of <pom_path> and all its modules.
+
+        We go up the directory tree for as long as the pom in the parent
+        directory declares the current one as a module (the usual layout).
+        Modules are then collected recursively from the root."""
+        root = os.path.normpath(os.path.abspath(pom_path))
+        while True:
+            parent = os.path.join(os.path.dirname(os.path.dirname(root)),
+                                  'pom.xml')
+            if parent == root or root not in self.get_modules(parent):
+                break
+            root = parent
+
+        modules = []
+        pending = [root]
+        while pending:
+            module = pending.pop(0)
+            if module in modules:
+                continue
+            modules.append(module)
+            pending.extend(self.get_modules(module))
+        return root, modules
+
+    def handle_pom(self, file_path):
         """The licensing plugin which does all the hard work for us.
 
-        This is not very elegant since, in the case of multi-module projects,
-        we're running too many times without any need."""
+        The plugin is invoked once per reactor (its aggregate goal) on the
+        root pom, every other pom of the same reactor is then skipped. Each
+        dependency is attributed to the module whose THIRD-PARTY file lists
+        it, or to the reactor root when only the aggregate one does. Files
+        left over from earlier builds (not written by this run) are ignored."""
 
         logging.debug("Matched pom handler: %s", file_path)
 
+        root, modules = self.get_reactor(file_path)
+        if root in self.reactors:
+            logging.debug("Already handled as part of reactor: %s", root)
+            return []
+        self.reactors.add(root)
+
         print_error = True
-        target_dir = os.path.join(os.path.dirname(file_path), 'target')
+        root_dir = os.path.dirname(root)
+        target_dir = os.path.join(root_dir, 'target')
         if not os.path.isdir(target_dir):
             print_error = False
             logging.warning("Unable to find target/, results will be unreliable.")
 
         command = "mvn org.codehaus.mojo:license-maven-plugin"
-        command += ":add-third-party -q -B -f %s" % (file_path)
+        command += ":aggregate-add-third-party -q -B -f %s" % (root)
         command += " -Dlicense.excludedScopes=test"
-        logging.info("Running license-mvn-plugin on: %s", file_path)
-        return_code, _, _ = complic.utils.shell.cmd(command, print_error=print_error)
+        logging.info("Running license-mvn-plugin on reactor (%i modules): %s",
+                     len(modules), root)
+        targets = [os.path.join(os.path.dirname(m), 'target') for m in modules]
+        outputs = [os.path.join(target, 'generated-sources', 'license',
+                                'THIRD-PARTY.txt') for target in targets]
+        # Whole seconds, some filesystems don't keep finer modification times
+        started = int(time.time())
+        return_code, _, _ = complic.utils.shell.cmd(command,
+                                                    print_error=print_error,
+                                                    inputs=modules,
+                                                    outputs=outputs)
         if return_code != 0:
             return []
 
-        deps = []
-        for path in complic.utils.fs.Find(os.path.dirname(file_path)).files:
-            if not path.endswith('THIRD-PARTY.txt'):
-                continue
+        index = self.get_index(root_dir, *targets)
+
+        # Module files first, so that the aggregate only fills in the gaps
+        aggregate = os.path.join(target_dir, 'generated-sources', 'license',
+                                 'THIRD-PARTY.txt')
+        paths = [path for path in index.find(root_dir, ['THIRD-PARTY.txt']) \
+                 if os.path.getmtime(path) >= started]
+        paths.sort(key=lambda path: path == aggregate)
+
+        deps = {}
+        for path in paths:
             string = open(path, 'r').read()
             for identifier, licenses in Scanner.parse_thirdparty(string).items():
+                if identifier in deps:
+                    deps[identifier].licenses.update(licenses)
+                    continue
                 dependency = base.Dependency(identifier, path)
                 dependency.licenses = licenses
-                deps.append(dependency)
+                deps[identifier] = dependency
 
-        return deps
+        return [deps[identifier] for identifier in sorted(deps)]
+
+    def handle_pom_offline(self, file_path):
+        """Resolves the dependencies of a whole reactor from ~/.m2.
+
+        Same identifiers as the license plugin would produce, without
+        starting a JVM. Artifacts whose pom isn't in the local repository
+        are reported without licenses."""
+
+        logging.debug("Matched offline pom handler: %s", file_path)
+
+        root, modules = self.get_reactor(file_path)
+        if root in self.reactors:
+            logging.debug("Already handled as part of reactor: %s", root)
+            return []
+        self.reactors.add(root)
+
+        models = [self.repository.load(module) for module in modules]
+        models = [model for model in models if model]
+        reactor = set(model['coords'][:2] for model in models)
+
+        deps = {}
+        for model in models:
+            for coords in self.repository.resolve(model):
+                identifier = 'java:' + ':'.join(coords)
+                if coords[:2] in reactor or identifier in deps:
+                    continue
+                dependency = base.Dependency(identifier,
+                                             self.repository.pom_path(*coords))
+                dep_model = self.repository.get(*coords)
+                if dep_model:
+                    dependency.licenses = set(dep_model['licenses'])
+                deps[identifier] = dependency
+
+        return [deps[identifier] for identifier in sorted(deps)]
@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 """
-    Scan all package.json files.
+    Scan all package.json files and lockfiles (npm, yarn and pnpm).
 """
 
+import collections
 import logging
 import json
+import os
 import re
-import distutils.spawn
+
+from complic.utils import shell
 
 from . import base
 
@@ -21,27 +24,103 @@ class Scanner(base.Scanner):
     Ideally, we would connect to the npm registry itself and download the
     information in case we can't find the package in the node_modules
     directory (of either the project or in the local cache (~/.)).
+
+    Projects with a lockfile are read from it instead: a single file lists
+    every package (and, for package-lock.json v2+, its license). Their
+    node_modules is then only looked at for packages without a license,
+    wherever they're installed (see make_dependencies).
     """
 
+    LOCKFILES = ['package-lock.json', 'yarn.lock', 'pnpm-lock.yaml']
+    # "name" and "version" keys of a package.json (see sniff)
+    SNIFF = re.compile(r'"(name|version)"\s*:\s*"([^"]*)"')
+
+    # {project directory: bool}, whether a lockfile is present
+    lockfiles = {}
+    # {(name, version): licenses} of the package.json files already parsed
+    manifests = {}
+    stats = collections.Counter()
+
     def __init__(self):
         super(Scanner, self).__init__()
+        # Shared with handle_pkgjson, a static handler
+        self.stats = Scanner.stats
+
+        # Reading lockfiles doesn't need npm
+        self.register_handler(re.compile(r'.*/package-lock.json$'),
+                              self.handle_package_lock)
+        self.register_handler(re.compile(r'.*/yarn.lock$'),
+                              self.handle_yarn_lock)
+        self.register_handler(re.compile(r'.*/pnpm-lock.yaml$'),
+                              self.handle_pnpm_lock)
 
-        if not distutils.spawn.find_executable('npm'):
+        if not shell.which('npm'):
             logging.error("Unable to find 'npm' executable in PATH.")
             return
 
         self.register_handler(re.compile(r'.*/package.json$'),
-                              Scanner.handle_pkgjson)
+                              Scanner.handle_pkgjson,
+                              parallel=True)
 
+    def reset(self):
+        super(Scanner, self).reset()
+        Scanner.lockfiles.clear()
+        Scanner.manifests.clear()
+
+    @staticmethod
+    def sniff(string):
+        """Cheaply guesses (name, version) of a package.json, without parsing.
+
+        Takes the "name" and "version" strings of the top level object (one
+        brace deep, not "author": {"name": ...}), None unless there's exactly
+        one of each. Only used to recognize copies of packages we've already
+        parsed, the guess is checked against the real values the first time
+        around."""
+        found = {'name': [], 'version': []}
+        for match in Scanner.SNIFF.finditer(string):
+            start = match.start()
+            if string.count('{', 0, start) - string.count('}', 0, start) == 1:
+                found[match.group(1)].append(match.group(2))
+        if len(found['name']) != 1 or len(found['version']) != 1:
+            return None
+        return found['name'][0], found['version'][0]
+
+    @staticmethod
+    def has_lockfile(project_dir):
+        """Whether <project_dir> has a lockfile (memoized)."""
+        if project_dir not in Scanner.lockfiles:
+            Scanner.lockfiles[project_dir] = any(
+                os.path.isfile(os.path.join(project_dir, lockfile)) \
+                for lockfile in Scanner.LOCKFILES)
+        return Scanner.lockfiles[project_dir]
 
     @staticmethod
     def handle_pkgjson(file_path):
         """Handles package.json file.
 
+        Packages inside node_modules are skipped if the project has a
+        lockfile, since they've already been read from it. The same
+        name@version shows up many times in node_modules, only the first
+        one is actually parsed.
+
         If any parsing errores are found, an empty list is returned."""
 
+        if '/node_modules/' in file_path:
+            project_dir = file_path[:file_path.index('/node_modules/')]
+            if Scanner.has_lockfile(project_dir):
+                return []
+
+        string = open(file_path, 'r').read()
+        key = Scanner.sniff(string)
+        if key in Scanner.manifests:
+            Scanner.stats['duplicate package.json parses avoided'] += 1
+            dependency = base.Dependency('js:' + ':'.join(key), file_path)
+            dependency.package_dir = os.path.dirname(file_path)
+            dependency.licenses.update(Scanner.manifests[key])
+            return [dependency]
+
         try:
-            pkgjson = json.loads(open(file_path, 'r').read())
+            pkgjson = json.loads(string)
         except ValueError:
             logging.error("File appears invalid package.json: %s", file_path)
             return []
@@ -51,10 +130,14 @@ class Scanner(base.Scanner):
 
         identifier = 'js:' + name + ':' + version
         dependency = base.Dependency(identifier, file_path)
+        dependency.package_dir = os.path.dirname(file_path)
 
         for lic in Scanner.get_licenses(pkgjson):
             dependency.licenses.add(lic)
 
+        if key == (name, version):
+            Scanner.manifests[key] = set(dependency.licenses)
+
         return [dependency]
 
     @staticmethod
@@ -93,3 +176,152 @@ class Scanner(base.Scanner):
                 else:
                     lics.append(lic['type'])
         return lics
+
+    def find_installed(self, project_dir):
+        """{name: [package.json, ...]} of every package installed in the
+        node_modules of <project_dir>: hoisted, nested (node_modules inside
+        packages) or in pnpm's store (node_modules/.pnpm)."""
+        node_modules = os.path.join(project_dir, 'node_modules')
+        installed = {}
+        for path in self.get_index(node_modules).find(node_modules,
+                                                      ['package.json']):
+            name = path.rsplit('/node_modules/', 1)[-1][:-len('/package.json')]
+            installed.setdefault(name, []).append(path)
+        return installed
+
+    @staticmethod
+    def get_installed(project_dir, name, version, paths):
+        """(licenses, package.json) of <name> at <version> out of the
+        installed copies of the package in <paths> (relative to
+        <project_dir> or absolute), (None, None) if none is that version."""
+        for path in paths:
+            pkgjson_path = os.path.join(project_dir, path)
+            if not path.endswith('package.json'):
+                pkgjson_path = os.path.join(pkgjson_path, 'package.json')
+            try:
+                pkgjson = json.loads(open(pkgjson_path, 'r').read())
+            except (IOError, ValueError):
+                continue
+            if pkgjson.get('version') == version:
+                return Scanner.get_licenses(pkgjson), pkgjson_path
+        return None, None
+
+    def make_dependencies(self, lockfile, packages):
+        """Dependencies out of [(name, version, licenses, path), ...] read
+        from <lockfile>, one per name@version.
+
+        Packages without licenses in the lockfile are looked for in
+        node_modules: in <path> if the lockfile has it, otherwise wherever
+        a copy with the right version is installed."""
+        project_dir = os.path.dirname(lockfile)
+        hoisted = os.path.join(project_dir, 'node_modules')
+        installed = None
+        dependencies = {}
+        for name, version, licenses, path in packages:
+            identifier = 'js:' + name + ':' + version
+            if identifier in dependencies:
+                continue
+            dependency = base.Dependency(identifier, lockfile)
+            if not licenses:
+                if installed is None:
+                    installed = self.find_installed(project_dir)
+                # The hoisted copy first, then the nested ones
+                paths = sorted(installed.get(name, []),
+                               key=lambda p: os.path.dirname(p) != \
+                                             os.path.join(hoisted, name))
+                licenses, pkgjson_path = Scanner.get_installed(
+                    project_dir, name, version, ([path] if path else []) + paths)
+                if pkgjson_path:
+                    dependency.package_dir = os.path.dirname(pkgjson_path)
+            for lic in licenses or []:
+                dependency.licenses.add(lic)
+            dependencies[identifier] = dependency
+        logging.debug("Dependencies found in %s: %i", lockfile, len(dependencies))
+        return [dependencies[identifier] for identifier in sorted(dependencies)]
+
+    @staticmethod
+    def parse_package_lock(lock):
+        """Yields (name, version, licenses, path) out of a package-lock.json.
+
+        Version 2+ lists every installed package under "packages" (keyed by
+        its path), version 1 nests them under "dependencies"."""
+        if 'packages' in lock:
+            for path, props in lock['packages'].items():
+                if '/node_modules/' not in '/' + path or 'version' not in props:
+                    continue
+                name = props.get('name', path.rsplit('node_modules/', 1)[-1])
+                yield name, props['version'], Scanner.get_licenses(props), path
+            return
+
+        pending = list(lock.get('dependencies', {}).items())
+        while pending:
+            name, props = pending.pop()
+            if 'version' in props:
+                yield name, props['version'], [], None
+            pending.extend(props.get('dependencies', {}).items())
+
+    def handle_package_lock(self, file_path):
+        try:
+            lock = json.loads(open(file_path, 'r').read())
+        except ValueError:
+            logging.error("File appears invalid package-lock.json: %s", file_path)
+            return []
+        return self.make_dependencies(file_path,
+                                      Scanner.parse_package_lock(lock))
+
+    @staticmethod
+    def parse_yarn_lock(lines):
+        """Yields (name, version, [], None) out of yarn.lock lines.
+
+        Entries look like (classic and berry formats):
+            "@babel/core@^7.0.0", "@babel/core@^7.1.0":
+              version "7.1.2"
+            "left-pad@npm:^1.3.0":
+              version: 1.3.0
+        """
+        name = None
+        for line in lines:
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            if not line[0].isspace():
+                spec = line.rstrip().rstrip(':').split(',')[0].strip().strip('"')
+                # The name ends at the @ preceding the version range
+                name = spec[:spec.index('@', 1)] if '@' in spec[1:] else None
+                continue
+            match = re.match(r'^\s+version:?\s+"?([^"\s]+)"?', line)
+            if name and match:
+                yield name, match.group(1), [], None
+                name = None
+
+    def handle_yarn_lock(self, file_path):
+        with open(file_path, 'r') as lines:
+            return self.make_dependencies(file_path,
+                                          Scanner.parse_yarn_lock(lines))
+
+    @staticmethod
+    def parse_pnpm_lock(lines):
+        """Yields (name, version, [], None) out of pnpm-lock.yaml lines.
+
+        Only the keys of the "packages" section are needed, whose format
+        changed over time:
+            /left-pad/1.3.0:            (v5)
+            /left-pad@1.3.0:            (v6)
+            left-pad@1.3.0:             (v9)
+            '@babel/core@7.1.2(peer@1.0)':
+        """
+        regex = re.compile(r"^  '?/?((?:@[^/\s]+/)?[^/@\s]+)[/@]([^(_:'/\s]+)")
+        in_packages = False
+        for line in lines:
+            if not line[0:1].isspace() and line.strip():
+                in_packages = line.startswith('packages:')
+                continue
+            if not in_packages:
+                continue
+            match = regex.match(line)
+            if match:
+                yield match.group(1), match.group(2), [], None
+
+    def handle_pnpm_lock(self, file_path):
+        with open(file_path, 'r') as lines:
+            return self.make_dependencies(file_path,
+                                          Scanner.parse_pnpm_lock(lines))
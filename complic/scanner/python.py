@@ -11,16 +11,34 @@ Why not something reasonably structured? Even XML is better than this.
 Python: there should be one obvious way to do it... except packaging.
 """
 
+import ast
+import atexit
+import glob
+import json
 import logging
+import pipes
 import re
 import os
+import shutil
 import sys
-import distutils.spawn
-import setuptools
+import tarfile
+import tempfile
+import threading
+import zipfile
 
-from complic.utils import fs, shell
+try:
+    import ConfigParser as configparser
+except ImportError: # pragma: nocover
+    import configparser
 
-from . import base
+from complic.utils import cache, fs, shell
+
+from . import ARCHIVES, base
+
+
+# Executed in a separate interpreter, never imported (it needs setuptools)
+SETUP_PROBE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'setup_probe.py')
 
 
 class Scanner(base.Scanner):
@@ -31,17 +49,53 @@ class Scanner(base.Scanner):
     when handling the requirements, but since we handle each of
     those requirements individually, we may end up capturing
     different licenses for each one.
+
+    If the project already has a virtualenv (.venv or venv) or a
+    <site_packages> directory is given, the installed packages are read
+    from there instead, once per scan (see finish) and whether or not
+    there's a setup.py.
+
+    Wheels and sdists are read (without extracting them) only from the
+    given <wheelhouses>: directories such as a wheelhouse or pip's cache.
+    Anywhere else an archive is just an archive.
     """
 
-    def __init__(self):
-        super(Scanner, self).__init__()
+    # Maximum number of setup.py files being executed at the same time
+    PROBES = threading.BoundedSemaphore(4)
+
+    # Upper bound (bytes) for all the cached pip environments together
+    ENVIRONMENTS_SIZE = 2 * 1024 ** 3
+    # Where pip environments go without shell.CACHE, for this run only
+    temporary = None
+
+    # Where projects usually keep their virtualenv
+    VENV_NAMES = ['.venv', 'venv']
 
-        if not distutils.spawn.find_executable('pip'):
+    def __init__(self, site_packages=None, wheelhouses=None):
+        super(Scanner, self).__init__()
+        self.site_packages = site_packages
+        # Site-packages of the virtualenvs found in this scan
+        self.virtualenvs = set()
+
+        self.register_handler(re.compile(r'.*/pyvenv.cfg$'),
+                              self.handle_pyvenv)
+
+        # Reading archives doesn't require pip
+        if wheelhouses:
+            wheels, sdists = [base.under(wheelhouses, archive) \
+                              for archive in ARCHIVES]
+            self.register_handler(re.compile(wheels),
+                                  Scanner.handle_wheel, parallel=True)
+            self.register_handler(re.compile(sdists),
+                                  Scanner.handle_sdist, parallel=True)
+
+        if not site_packages and \
+           not shell.which('pip'):
             logging.error("Unable to find 'pip' executable in PATH.")
             return
 
         self.register_handler(re.compile(r'.*/setup.py$'),
-                              Scanner.handle_setuppy)
+                              self.handle_setuppy)
 
     @staticmethod
     def parse_metadata(metadata):
@@ -51,54 +105,399 @@ class Scanner(base.Scanner):
         regex_lic = re.compile(r'^\s*License: (.*)$', flags=re.MULTILINE)
         name = regex_name.search(metadata).group(1)
         version = regex_ver.search(metadata).group(1)
-        lic = regex_lic.search(metadata).group(1)
+        # Optional: newer metadata may only have License-Expression or
+        # classifiers, None then
+        lic = regex_lic.search(metadata)
+        lic = lic.group(1) if lic else None
 
         return ':'.join(['python', name, version]), lic
 
+    @staticmethod
+    def read_header(handle):
+        """Reads the header block of a metadata file (stops at the body)."""
+        lines = []
+        for line in handle:
+            if not line.strip():
+                break
+            lines.append(line.decode('utf8', 'replace'))
+        return ''.join(lines)
+
+    @staticmethod
+    def make_dependency(header, archive):
+        try:
+            identifier, lic = Scanner.parse_metadata(header)
+        except AttributeError:
+            logging.warning("Incomplete metadata in: %s", archive)
+            return []
+        dependency = base.Dependency(identifier, archive)
+        if lic is not None:
+            dependency.licenses.add(lic)
+        return [dependency]
+
+    @staticmethod
+    def handle_wheel(file_path):
+        """Reads *.dist-info/METADATA straight from the wheel (a zip file).
+
+        Only the central directory and the header of METADATA are read,
+        nothing is extracted to disk."""
+        try:
+            with zipfile.ZipFile(file_path) as wheel:
+                names = [name for name in wheel.namelist() \
+                         if re.match(r'^[^/]+\.dist-info/METADATA$', name)]
+                if not names:
+                    logging.warning("No METADATA found in: %s", file_path)
+                    return []
+                with wheel.open(names[0]) as metadata:
+                    header = Scanner.read_header(metadata)
+        except zipfile.BadZipfile as e:
+            logging.warning("Unable to read %s: %s", file_path, e)
+            return []
+        return Scanner.make_dependency(header, file_path)
+
+    @staticmethod
+    def handle_sdist(file_path):
+        """Reads <name>-<version>/PKG-INFO from a source distribution.
+
+        Archives which don't look like a python sdist are ignored. For
+        tarballs only the members up to PKG-INFO are decompressed."""
+        pkg_info = re.compile(r'^[^/]+/PKG-INFO$')
+        header = None
+        try:
+            if file_path.endswith('.zip'):
+                with zipfile.ZipFile(file_path) as sdist:
+                    names = [name for name in sdist.namelist() \
+                             if pkg_info.match(name)]
+                    if names:
+                        with sdist.open(names[0]) as metadata:
+                            header = Scanner.read_header(metadata)
+            else:
+                with tarfile.open(file_path, 'r:*') as sdist:
+                    for member in sdist:
+                        if member.isfile() and pkg_info.match(member.name):
+                            metadata = sdist.extractfile(member)
+                            header = Scanner.read_header(metadata)
+                            break
+        except (zipfile.BadZipfile, tarfile.TarError, IOError) as e:
+            logging.warning("Unable to read %s: %s", file_path, e)
+            return []
+        if header is None:
+            return []
+        logging.debug("Matched sdist handler: %s", file_path)
+        return Scanner.make_dependency(header, file_path)
+
+    def reset(self):
+        super(Scanner, self).reset()
+        self.virtualenvs.clear()
+
+    @staticmethod
+    def venv_site_packages(venv):
+        """The site-packages of the virtualenv in <venv>, if there's one."""
+        candidates = glob.glob(os.path.join(venv, 'lib', 'python*',
+                                            'site-packages'))
+        candidates.append(os.path.join(venv, 'Lib', 'site-packages'))
+        for candidate in sorted(candidates):
+            if os.path.isdir(candidate):
+                return candidate
+        return None
+
+    @staticmethod
+    def find_site_packages(project_dir):
+        """The site-packages of the project's virtualenv, if it has one."""
+        for name in Scanner.VENV_NAMES:
+            site_packages = Scanner.venv_site_packages(
+                os.path.join(project_dir, name))
+            if site_packages:
+                return site_packages
+        return None
+
+    def handle_pyvenv(self, file_path):
+        """Virtualenvs (with a pyvenv.cfg) named like VENV_NAMES are read
+        in finish, even without a setup.py next to them."""
+        venv = os.path.dirname(file_path)
+        if os.path.basename(venv) not in Scanner.VENV_NAMES:
+            return []
+        site_packages = Scanner.venv_site_packages(venv)
+        if site_packages:
+            self.virtualenvs.add(site_packages)
+        return []
+
+    def finish(self):
+        """Reads the given site-packages and the ones of the virtualenvs
+        found during the scan, each one once."""
+        directories = set(self.virtualenvs)
+        if self.site_packages:
+            directories.add(self.site_packages)
+        deps = []
+        for site_packages in sorted(directories):
+            deps.extend(Scanner.scan_site_packages(site_packages))
+        return deps
+
+    @staticmethod
+    def scan_site_packages(site_packages):
+        """Reads the metadata of every package installed in <site_packages>.
+
+        Only the directory itself is listed (no walking) and only the
+        header of each *.dist-info/METADATA or *.egg-info is read."""
+        logging.info("Reading installed packages from: %s", site_packages)
+        dirs, files = fs.listdir(site_packages)
+        paths = []
+        for name in sorted(dirs):
+            if name.endswith('.dist-info'):
+                paths.append(os.path.join(site_packages, name, 'METADATA'))
+            elif name.endswith('.egg-info'):
+                paths.append(os.path.join(site_packages, name, 'PKG-INFO'))
+        for name in sorted(files):
+            if name.endswith('.egg-info'): # Old distutils installs
+                paths.append(os.path.join(site_packages, name))
+
+        deps = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as metadata:
+                    header = Scanner.read_header(metadata)
+            except IOError as e:
+                logging.warning("Unable to read %s: %s", path, e)
+                continue
+            for dependency in Scanner.make_dependency(header, path):
+                if os.path.basename(path) in ('METADATA', 'PKG-INFO'):
+                    dependency.package_dir = os.path.dirname(path)
+                deps.append(dependency)
+        return deps
+
+    @staticmethod
+    def parse_setup_py(setup_py):
+        """Statically look for the 'extras_require' given to setup().
+
+        Understands literal dicts, either passed directly or through a
+        module level variable. Returns None when the answer can't be known
+        without running the script (no setup() call, **kwargs, computed
+        values...)."""
+        with open(setup_py, 'r') as handle:
+            try:
+                tree = ast.parse(handle.read(), setup_py)
+            except SyntaxError:
+                return None
+
+        assignments = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        assignments[target.id] = node.value
+
+        calls = [node for node in ast.walk(tree) \
+                 if isinstance(node, ast.Call) and \
+                 getattr(node.func, 'id', getattr(node.func, 'attr', None)) \
+                 == 'setup']
+        if len(calls) != 1:
+            return None
+        call = calls[0]
+        if getattr(call, 'kwargs', None) or \
+           any(keyword.arg is None for keyword in call.keywords):
+            return None
+
+        for keyword in call.keywords:
+            if keyword.arg != 'extras_require':
+                continue
+            value = keyword.value
+            if isinstance(value, ast.Name):
+                value = assignments.get(value.id)
+            if not isinstance(value, ast.Dict):
+                return None
+            try:
+                return sorted(ast.literal_eval(key) for key in value.keys)
+            except ValueError:
+                return None
+        return []
+
+    @staticmethod
+    def parse_setup_cfg(setup_cfg):
+        """Extras declared in the [options.extras_require] of setup.cfg."""
+        config = configparser.RawConfigParser()
+        try:
+            config.read(setup_cfg)
+        except configparser.Error as e:
+            logging.warning("Unable to parse %s: %s", setup_cfg, e)
+            return []
+        if not config.has_section('options.extras_require'):
+            return []
+        return config.options('options.extras_require')
+
+    @staticmethod
+    def parse_pyproject(pyproject):
+        """Extras declared in the [project.optional-dependencies] table.
+
+        We only need the keys, so a full TOML parser isn't needed."""
+        extras = []
+        in_table = False
+        # Brackets still open: lines of a multi-line array aren't keys
+        depth = 0
+        with open(pyproject, 'r') as handle:
+            for line in handle:
+                line = line.strip()
+                brackets = re.sub(r'"[^"]*"|\'[^\']*\'|#.*$', '', line)
+                if depth > 0:
+                    depth += brackets.count('[') - brackets.count(']')
+                    continue
+                if line.startswith('['):
+                    in_table = line == '[project.optional-dependencies]'
+                    continue
+                match = re.match(r'^["\']?([\w.-]+)["\']?\s*=', line)
+                if match:
+                    depth = brackets.count('[') - brackets.count(']')
+                if in_table and match:
+                    extras.append(match.group(1))
+        return extras
+
+    @staticmethod
+    def probe_setup_py(setup_py):
+        """Execute <setup_py> in a separate interpreter (see setup_probe).
+
+        With shell.CACHE, results are cached by the contents of setup.py.
+        The number of probes running at the same time is bounded."""
+        key = cache.file_digest(setup_py)
+        if shell.CACHE:
+            result = cache.Store('setup-probe').get(key)
+            if result is not None:
+                return result['extras_require']
+
+        command = ' '.join(pipes.quote(arg) \
+                           for arg in [sys.executable, SETUP_PROBE, setup_py])
+        with Scanner.PROBES:
+            return_code, out, _ = shell.cmd(command, print_error=True,
+                                            cwd=os.path.dirname(setup_py))
+        if return_code != 0:
+            logging.error("Unable to execute: %s", setup_py)
+            return []
+        try:
+            result = json.loads(out)
+        except ValueError:
+            logging.error("Unexpected output when executing: %s", setup_py)
+            return []
+        if shell.CACHE:
+            cache.Store('setup-probe').set(key, result)
+        return result['extras_require']
+
     @staticmethod
     def get_extra_requirements(setup_py):
-        """Parse/execute the setup.py file looking for 'extra_requirements'.
+        """Find every 'extras_require' of the project owning <setup_py>.
 
-        Since the setup.py file is a python script, it can contain anything,
-        beyond what a few regexes could ever hope to achieve. As such, we
-        execute the file and obtain the final extras_require.
+        Since the setup.py file is a python script, it can contain anything.
+        Most of them are simple enough to be understood without running
+        them, only the rest are actually executed (in a subprocess).
+        setup.cfg and pyproject.toml are taken into account as well.
 
-        The extras_require is then used to run a full "pip install" with
+        The extras are then used to run a full "pip install" with
         all optional dependencies."""
-        def mock_setup(**kwargs):
-            mock_setup.extras = kwargs.get('extras_require', {}).keys()
-        setuptools.setup = mock_setup
-        setup_py_dir = os.path.dirname(setup_py)
-        sys.path = [setup_py_dir] + sys.path
-        with fs.chdir(setup_py_dir):
-            import setup # This triggers the execution of mock_setup
-            sys.path = sys.path[1:] # Remove the taint from our environment
-            return mock_setup.__dict__.get('extras', [])
+        extras = Scanner.parse_setup_py(setup_py)
+        if extras is None:
+            logging.debug("Unable to parse %s statically.", setup_py)
+            extras = Scanner.probe_setup_py(setup_py)
+        extras = set(extras)
+
+        project_dir = os.path.dirname(setup_py)
+        setup_cfg = os.path.join(project_dir, 'setup.cfg')
+        if os.path.isfile(setup_cfg):
+            extras.update(Scanner.parse_setup_cfg(setup_cfg))
+        pyproject = os.path.join(project_dir, 'pyproject.toml')
+        if os.path.isfile(pyproject):
+            extras.update(Scanner.parse_pyproject(pyproject))
+        return sorted(extras)
 
     @staticmethod
-    def pip_install(setup_py, extras=None):
-        """Runs a pip install, with extra requirements if provided.
-
-        Returns (bool) depending on the exit code."""
+    def get_environment_key(setup_py, extras=None):
+        """Hash of everything deciding what pip installs for <setup_py>.
+
+        That's the packaging files of the project (setup.py, setup.cfg,
+        pyproject.toml, requirements*.txt), the extras and the pip used."""
+        project_dir = os.path.dirname(setup_py)
+        parts = [shell.which('pip') or 'pip']
+        parts.extend(sorted(extras or []))
+        for name in sorted(os.listdir(project_dir)):
+            if name in ['setup.py', 'setup.cfg', 'pyproject.toml'] or \
+               re.match(r'^requirements.*\.txt$', name):
+                path = os.path.join(project_dir, name)
+                parts.extend([name, cache.file_digest(path)])
+        return cache.digest(*parts)
 
-        with fs.chdir(os.path.dirname(setup_py)) as new_dir:
-            build_dir = os.path.join(new_dir, 'builddir')
-            os.makedirs(build_dir)
-            command = "PYTHONUSERBASE='%s' " % (build_dir)
-            command += "pip install --ignore-installed ."
-            if extras:
-                command += "[%s]" % (','.join(extras))
+    @staticmethod
+    def get_environments():
+        """Directory of the pip environments: inside the cache with
+        shell.CACHE, otherwise a temporary one removed on exit."""
+        if shell.CACHE:
+            return cache.get_dir('pipenv')
+        if Scanner.temporary is None:
+            Scanner.temporary = tempfile.mkdtemp(prefix='complic-pipenv-')
+            atexit.register(shutil.rmtree, Scanner.temporary, True)
+        return Scanner.temporary
 
-            logging.info("Running pip install on %s", new_dir)
-            return_code, _, _ = shell.cmd(command, print_error=True)
+    @staticmethod
+    def pip_install(setup_py, extras=None):
+        """Runs a pip install, with extra requirements if provided.
 
-            if return_code != 0:
-                logging.error("Make sure ~/.pip/pip.conf is correctly configured.")
-                return False
-        return True
+        Everything is installed (--target) into an environment (see
+        get_environments) named after get_environment_key. If it already
+        exists the install is skipped altogether, so unchanged projects (or
+        projects with the very same requirements) are only installed once.
+
+        Returns the environment's directory, None if pip failed."""
+        project_dir = os.path.dirname(setup_py)
+        environments = Scanner.get_environments()
+        key = Scanner.get_environment_key(setup_py, extras)
+        env_dir = os.path.join(environments, key)
+        if os.path.isdir(env_dir):
+            logging.info("Reusing pip environment for %s: %s",
+                         project_dir, env_dir)
+            os.utime(env_dir, None) # Keep track of the last usage
+            return env_dir
+
+        # Built aside and renamed when done, so it's never seen half-built
+        build_dir = tempfile.mkdtemp(prefix='.build-', dir=environments)
+        command = "pip install --ignore-installed --target %s ." % \
+                  (pipes.quote(build_dir))
+        if extras:
+            command += "[%s]" % (','.join(extras))
+
+        # Not chdir'ing since other scanners may be running concurrently
+        logging.info("Running pip install on %s", project_dir)
+        return_code, _, _ = shell.cmd(command, print_error=True,
+                                      cwd=project_dir)
+
+        if return_code != 0:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            logging.error("Make sure ~/.pip/pip.conf is correctly configured.")
+            return None
+
+        try:
+            os.rename(build_dir, env_dir)
+        except OSError:
+            # Someone else built the same environment in the meantime
+            shutil.rmtree(build_dir, ignore_errors=True)
+        Scanner.evict_environments(environments, env_dir)
+        return env_dir
 
     @staticmethod
-    def handle_setuppy(file_path):
+    def evict_environments(environments, keep):
+        """Removes the least recently used environments over the size limit.
+
+        <keep> (the environment being used right now) is never removed."""
+        used = []
+        for name in os.listdir(environments):
+            path = os.path.join(environments, name)
+            if name.startswith('.') or path == keep:
+                continue # Still being built or in use
+            used.append((os.path.getmtime(path), path))
+
+        total = fs.disk_usage(keep)
+        for _, path in sorted(used, reverse=True):
+            size = fs.disk_usage(path)
+            if total + size <= Scanner.ENVIRONMENTS_SIZE:
+                total += size
+                continue
+            logging.info("Evicting pip environment: %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def handle_setuppy(self, file_path):
         """Run the setup script and parse its requirements (dependencies).
 
         We build our own dependency tree and then flatten it before returning.
@@ -110,23 +509,33 @@ class Scanner(base.Scanner):
         logging.debug("Matched setup.py handler: %s", file_path)
 
         file_path = os.path.abspath(file_path)
+        site_packages = self.site_packages or \
+                        Scanner.find_site_packages(os.path.dirname(file_path))
+        if site_packages:
+            # Read in finish, along with the other virtualenvs
+            self.virtualenvs.add(site_packages)
+            return []
+
         extra_requires = Scanner.get_extra_requirements(file_path)
 
-        if not Scanner.pip_install(file_path, extra_requires):
+        env_dir = Scanner.pip_install(file_path, extra_requires)
+        if not env_dir:
             logging.error("Unable to run pip install for: %s", file_path)
             return []
 
+        project_dir = os.path.dirname(file_path)
+        names = ['PKG-INFO', 'METADATA']
+        paths = self.get_index(project_dir).find(project_dir, names)
+        paths += fs.Index(fs.Find(env_dir)).find(env_dir, names)
         deps = []
-        for path in fs.Find(os.path.dirname(file_path)).files:
-            if not os.path.basename(path) in ['PKG-INFO', 'METADATA']:
-                continue
-
-
+        for path in paths:
             metadata = open(path, 'r').read()
 
             identifier, lic = Scanner.parse_metadata(metadata)
             dependency = base.Dependency(identifier, path)
-            dependency.licenses.add(lic)
+            dependency.package_dir = os.path.dirname(path)
+            if lic is not None:
+                dependency.licenses.add(lic)
             deps.append(dependency)
 
         return deps
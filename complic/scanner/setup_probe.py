@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+    Runs a setup.py and prints (as JSON) the arguments given to setup().
+
+Only meant for setup.py files which can't be understood statically. It's
+executed as a standalone script in its own interpreter so that whatever
+the setup.py does (imports, sys.path changes, side effects) never reaches
+complic's process:
+
+    python setup_probe.py /path/to/setup.py
+
+Only depends on the standard library and setuptools on purpose.
+"""
+
+import distutils.core
+import json
+import os
+import runpy
+import sys
+
+import setuptools
+
+
+def probe(setup_py):
+    """Executes <setup_py> with setup() replaced, returns what we care about."""
+    captured = {}
+
+    def setup(**kwargs):
+        captured.update(kwargs)
+
+    setuptools.setup = setup
+    distutils.core.setup = setup
+    runpy.run_path(setup_py, run_name='__main__')
+    return {
+        'extras_require': sorted(captured.get('extras_require') or {}),
+    }
+
+
+def main(setup_py): # pragma: nocover
+    setup_py = os.path.abspath(setup_py)
+    os.chdir(os.path.dirname(setup_py))
+    sys.path.insert(0, os.path.dirname(setup_py))
+    sys.argv = [setup_py, '--name']
+    # Whatever setup.py prints must not end up mixed with our output
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    result = probe(setup_py)
+    stdout.write(json.dumps(result))
+
+
+if __name__ == '__main__': # pragma: nocover
+    main(sys.argv[1])
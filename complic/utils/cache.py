@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+On-disk caches shared across runs, stored in ~/.complic/cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+
+CACHE_DIR = os.path.join(os.environ.get("HOME", os.getcwd()),
+                         '.complic',
+                         'cache')
+
+
+def get_dir(*parts):
+    """Returns (creating it if needed) a directory inside the cache."""
+    path = os.path.join(CACHE_DIR, *parts)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError: # pragma: nocover
+            # Someone else created it in the meantime
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def digest(*parts):
+    """Hex digest identifying the given strings."""
+    sha = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf8')
+        sha.update(part)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def file_digest(path):
+    """Hex digest of the contents of <path>."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(65536), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Store(object):
+    """Very basic key/value store, one JSON file per key.
+
+    Writes are atomic (write + rename) so concurrent runs sharing the same
+    cache never see half-written entries."""
+
+    def __init__(self, namespace):
+        self.directory = get_dir(namespace)
+
+    def path(self, key):
+        return os.path.join(self.directory, digest(key) + '.json')
+
+    def get(self, key, default=None):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return default
+        with open(path, 'r') as entry:
+            try:
+                return json.loads(entry.read())
+            except ValueError:
+                logging.warning("Ignoring corrupted cache entry: %s", path)
+                return default
+
+    def set(self, key, value):
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'w') as entry:
+            entry.write(json.dumps(value))
+        os.rename(tmp_path, self.path(key))
+        return value
@@ -3,36 +3,353 @@
 Filesystem handling utilities.
 """
 
+import bisect
+import heapq
 import logging
+import fnmatch
 import shutil
 import tempfile
+import threading
 import os
 
+from complic.utils import cache
+
+try:
+    from os import scandir as _scandir
+except ImportError: # pragma: nocover
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+
+# Directory names which are never descended into.
+DEFAULT_IGNORE = ['.git']
+
+# How many directories each thread of parallel_walk may list ahead of the
+# one being yielded
+AHEAD = 64
+
+
+def listdir(path):
+    """Returns two lists (directories, files) with the entries of <path>.
+
+    Uses scandir (when available) so that the file type comes straight
+    from the directory entry instead of an extra stat() per entry."""
+    dirs = []
+    files = []
+    if _scandir is None: # pragma: nocover
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            if not os.path.isdir(full_path):
+                files.append(name)
+            elif not os.path.islink(full_path):
+                dirs.append(name)
+        return dirs, files
+
+    for entry in _scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            dirs.append(entry.name)
+        elif not entry.is_dir(): # Symlinks to directories aren't followed
+            files.append(entry.name)
+    return dirs, files
+
+
+def walk(root, ignore=None, lister=listdir):
+    """Yields (directory, [filenames]) for every directory under <root>.
+
+    Directories whose name matches any of the <ignore> globs are pruned
+    before descending, so their contents are never even listed."""
+    if ignore is None:
+        ignore = DEFAULT_IGNORE
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            dirs, files = lister(directory)
+        except OSError as e:
+            logging.warning("Unable to list directory %s: %s", directory, e)
+            continue
+        yield directory, files
+        # Reversed so that directories are visited in listing order
+        stack.extend(reversed(_prune(directory, dirs, ignore)))
+
+
+def _prune(directory, dirs, ignore):
+    return [os.path.join(directory, d) for d in dirs \
+            if not any(fnmatch.fnmatch(d, glob) for glob in ignore)]
+
+
+def parallel_walk(root, ignore=None, lister=listdir, jobs=4):
+    """Same as walk(), but directories are listed by a pool of <jobs> threads.
+
+    Useful on network filesystems where listing a directory is mostly
+    waiting. Threads list the directories in the order walk() yields them,
+    at most AHEAD per thread ahead of the one being yielded (which is listed
+    right away if no thread got to it yet). Directories are yielded in
+    exactly the same order walk() would."""
+    if ignore is None:
+        ignore = DEFAULT_IGNORE
+    listed = threading.Condition()
+    # Heap of (position in the walk, directory) yet to be listed, the
+    # smallest one is always the next directory to yield once listed
+    pending = [((), root)]
+    # Directories taken by a thread and not yielded yet, and the listings
+    # of those the thread is done with
+    taken = set()
+    listings = {}
+    stop = threading.Event()
+
+    def list_directory(position, directory):
+        """(files, subdirectories) of <directory>, None if unreadable."""
+        try:
+            dirs, files = lister(directory)
+        except OSError as e:
+            logging.warning("Unable to list directory %s: %s", directory, e)
+            return None
+        subdirs = _prune(directory, dirs, ignore)
+        with listed:
+            for i, subdir in enumerate(subdirs):
+                heapq.heappush(pending, (position + (i,), subdir))
+            listed.notify_all()
+        return files, subdirs
+
+    def worker():
+        while True:
+            with listed:
+                while not stop.is_set() and \
+                        (not pending or len(taken) >= AHEAD * jobs):
+                    listed.wait()
+                if stop.is_set():
+                    return
+                position, directory = heapq.heappop(pending)
+                taken.add(directory)
+            try:
+                listing = list_directory(position, directory)
+            except Exception as e: # pylint: disable=broad-except
+                # Raised by the consumer, as walk() would
+                listing = e
+            with listed:
+                listings[directory] = listing
+                listed.notify_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            with listed:
+                while directory not in listings and \
+                        not (pending and pending[0][1] == directory):
+                    listed.wait()
+                if directory in listings:
+                    position = None
+                    taken.remove(directory)
+                    listing = listings.pop(directory)
+                    listed.notify_all()
+                else:
+                    position = heapq.heappop(pending)[0]
+            if position is not None:
+                listing = list_directory(position, directory)
+            if listing is None:
+                continue
+            if isinstance(listing, Exception):
+                raise listing
+            files, subdirs = listing
+            yield directory, files
+            stack.extend(reversed(subdirs))
+    finally:
+        stop.set()
+        with listed:
+            listed.notify_all()
+        for thread in threads:
+            thread.join()
+
+
+def disk_usage(path):
+    """Size (in bytes) of all the files under <path>."""
+    total = 0
+    for directory, files in walk(path, ignore=[]):
+        for filename in files:
+            try:
+                total += os.lstat(os.path.join(directory, filename)).st_size
+            except OSError: # pragma: nocover
+                pass # Removed in the meantime
+    return total
+
+
+class TreeCache(object):
+    """Remembers directory listings of <root> between runs.
+
+    Each directory is stored along with its mtime and inode. As long as
+    those don't change the listing is reused, so a re-scan only needs a
+    stat() per directory instead of reading all of them again."""
+
+    def __init__(self, root, ignore=None):
+        self.root = os.path.abspath(root)
+        self.store = cache.Store('index')
+        self.key = ':'.join([self.root] + sorted(ignore or []))
+        self.entries = self.store.get(self.key, {})
+        self.visited = {}
+        self.hits = 0
+        # listdir is called from the threads of parallel_walk
+        self._lock = threading.Lock()
+
+    def listdir(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_ino:
+            with self._lock:
+                self.hits += 1
+            dirs, files = entry[2], entry[3]
+        else:
+            dirs, files = listdir(path)
+        self.visited[path] = [stat.st_mtime, stat.st_ino, dirs, files]
+        return dirs, files
+
+    def save(self):
+        """Persists the directories seen in this run (and only those)."""
+        logging.debug("Directory listings reused from cache: %i/%i",
+                      self.hits, len(self.visited))
+        self.entries = self.visited
+        self.visited = {}
+        self.hits = 0
+        self.store.set(self.key, self.entries)
+
 
 class Find(object):
     """Traverse the filesystem and build file and directory lists.
 
-    Everything inside .git is ignored by default."""
+    Everything inside .git is ignored by default, other directories can be
+    pruned by passing a list of globs (matched against directory names) in
+    <ignore>.
+
+    Iterating over a Find object streams the paths as they are found, the
+    results are kept (grouped by directory) so that any further iterations
+    don't touch the filesystem again. If a TreeCache is provided, unchanged
+    directories are taken from it and it's saved once the walk finishes.
 
-    def __init__(self, root):
+    With <jobs> greater than 1, directories are listed concurrently (see
+    parallel_walk), the results and their order are the same."""
+
+    def __init__(self, root, ignore=None, tree_cache=None, jobs=1):
         self.root = root
-        self._files = []
-        self._directories = []
+        self.ignore = DEFAULT_IGNORE if ignore is None else ignore
+        self.tree_cache = tree_cache
+        self.jobs = jobs
+        # [(directory, (filename, filename, ...)), ...]
+        self._tree = []
+        self._walker = None
+        self._done = False
 
-        self._findall()
+    def _next_directory(self):
+        """Pulls the next directory from the walk, None when finished."""
+        if self._done:
+            return None
+        if self._walker is None:
+            logging.debug("Retrieving file list from: %s", self.root)
+            lister = listdir
+            if self.tree_cache:
+                lister = self.tree_cache.listdir
+            if self.jobs > 1:
+                self._walker = parallel_walk(self.root, self.ignore, lister,
+                                             self.jobs)
+            else:
+                self._walker = walk(self.root, self.ignore, lister)
+        try:
+            directory, files = next(self._walker)
+        except StopIteration:
+            self._done = True
+            if self.tree_cache:
+                self.tree_cache.save()
+            return None
+        self._tree.append((directory, tuple(files)))
+        return self._tree[-1]
 
-    def _findall(self):
-        """Store the results in object attributes, ignore .git files."""
-        logging.debug("Retrieving file list from: %s", self.root)
-        for root, dirs, files in os.walk(self.root):
-            if r'/.git' in root: # pragma: nocover
-                continue
+    def __iter__(self):
+        index = 0
+        while index < len(self._tree) or self._next_directory():
+            directory, files = self._tree[index]
+            index += 1
             for filename in files:
-                self._files.append(os.path.join(root, filename))
+                yield os.path.join(directory, filename)
 
     @property
     def files(self):
-        return self._files
+        return list(self)
+
+
+class Index(object):
+    """Sorted list of paths which can be queried by subtree and basename.
+
+    Meant to be built once per run (from the paths seen by the scanners)
+    and shared by the handlers, instead of each of them walking their
+    subtree again. When a handler knows some directory changed (a build
+    tool wrote to it) it refreshes just that directory."""
+
+    def __init__(self, paths=(), ignore=None):
+        self.ignore = DEFAULT_IGNORE if ignore is None else ignore
+        self._paths = []
+        self._known = set()
+        self._pending = []
+        self._lock = threading.Lock()
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        with self._lock:
+            if path in self._known:
+                return
+            self._known.add(path)
+            self._pending.append(path)
+
+    def _sorted(self):
+        """Merges pending additions, must be called with the lock held."""
+        if self._pending:
+            self._paths.extend(self._pending)
+            self._paths.sort()
+            self._pending = []
+        return self._paths
+
+    def _bounds(self, directory):
+        """Slice of the sorted paths living under <directory>."""
+        prefix = directory.rstrip('/') + '/'
+        paths = self._sorted()
+        start = bisect.bisect_left(paths, prefix)
+        end = start
+        while end < len(paths) and paths[end].startswith(prefix):
+            end += 1
+        return start, end
+
+    def subtree(self, directory):
+        """All the paths under <directory>, sorted."""
+        with self._lock:
+            start, end = self._bounds(directory)
+            return self._paths[start:end]
+
+    def find(self, directory, basenames):
+        """Paths under <directory> whose file name is one of <basenames>."""
+        return [path for path in self.subtree(directory) \
+                if os.path.basename(path) in basenames]
+
+    def refresh(self, directory):
+        """Walks <directory> again, replacing whatever we knew about it."""
+        logging.debug("Refreshing file index for: %s", directory)
+        found = sorted(Find(directory, self.ignore))
+        with self._lock:
+            start, end = self._bounds(directory)
+            self._known.difference_update(self._paths[start:end])
+            self._known.update(found)
+            self._paths[start:end] = found
+
+    def __len__(self):
+        with self._lock:
+            return len(self._known)
 
 
 class chdir(object):
@@ -1,27 +1,213 @@
 #!/usr/bin/env python
 
 import logging
+import os
+import shutil
+import signal
 import subprocess
 import shlex
+import threading
+import time
 
+from complic.utils import cache
 
-def cmd(command, print_error=True):
-    """Runs a subprocess command (without shell)."""
-    logging.debug("Running: %s", command)
+
+# Maximum number of commands running at the same time, per executable.
+# Build tools are heavy on memory/CPU, running too many of them at once
+# (with --jobs) only makes everything slower.
+LIMITS = {
+    'mvn': 2,
+    'pip': 2,
+    'pod': 4,
+}
+DEFAULT_LIMIT = 8
+
+# Default timeout (seconds) for every command, None waits forever
+TIMEOUT = None
+
+# Replay commands with declared inputs from ~/.complic/cache (see cmd)
+CACHE = False
+
+# Environment variables which may change the outcome of a command
+CACHE_ENV = ['PATH', 'JAVA_HOME', 'MAVEN_OPTS', 'PIP_INDEX_URL', 'PYTHONPATH']
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+# Executable name -> full path (or None), see which()
+_executables = {}
+
+
+def which(executable):
+    """Full path of <executable> if it's in PATH, None otherwise.
+
+    PATH is only searched once per executable and run."""
+    if executable not in _executables:
+        import distutils.spawn # Only needed (and loaded) the first time
+        _executables[executable] = distutils.spawn.find_executable(executable)
+    return _executables[executable]
+
+
+def get_semaphore(tool):
+    """The semaphore bounding how many <tool> commands run at once."""
+    with _semaphores_lock:
+        if tool not in _semaphores:
+            limit = LIMITS.get(tool, DEFAULT_LIMIT)
+            _semaphores[tool] = threading.BoundedSemaphore(limit)
+        return _semaphores[tool]
+
+
+def _kill(proc, killed):
+    """Kills <proc> and everything it spawned (it leads its process group)."""
+    killed.set()
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError: # pragma: nocover
+        pass # Already gone
+
+
+def _pump(pipe, callback, lines):
+    """Reads <pipe> line by line, handing each one to <callback>.
+
+    Lines are only kept in <lines> when there's no callback."""
+    for line in iter(pipe.readline, b''):
+        if callback:
+            callback(line)
+        else:
+            lines.append(line)
+    pipe.close()
+
+
+def run(command, cwd=None, timeout=None, on_stdout=None, on_stderr=None):
+    """Runs a subprocess command (without shell), optionally inside <cwd>.
+
+    Output is read as it's produced: each line is given to <on_stdout> or
+    <on_stderr> if provided, otherwise it's collected and returned. The
+    command (and its children) is killed after <timeout> seconds.
+
+    Returns (returncode, stdout, stderr, timed_out)."""
+    args = shlex.split(command)
+    tool = os.path.basename(args[0]) if args else ''
+    timeout = TIMEOUT if timeout is None else timeout
+
+    with get_semaphore(tool):
+        logging.debug("Running: %s", command)
+        proc = subprocess.Popen(args,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=cwd,
+                                preexec_fn=os.setsid)
+        out, err = [], []
+        pumps = [
+            threading.Thread(target=_pump, args=(proc.stdout, on_stdout, out)),
+            threading.Thread(target=_pump, args=(proc.stderr, on_stderr, err)),
+        ]
+        for pump in pumps:
+            pump.daemon = True
+            pump.start()
+
+        timer = None
+        killed = threading.Event()
+        if timeout:
+            timer = threading.Timer(timeout, _kill, args=(proc, killed))
+            timer.daemon = True
+            timer.start()
+        try:
+            proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+        for pump in pumps:
+            pump.join()
+
+    return proc.returncode, b''.join(out), b''.join(err), killed.is_set()
+
+
+def get_key(command, cwd, inputs):
+    """Identifies a run of <command>: command line, environment and the
+    contents of its <inputs>."""
+    parts = [command, cwd or '']
+    parts.extend(os.environ.get(name, '') for name in CACHE_ENV)
+    for path in sorted(inputs):
+        digest = cache.file_digest(path) if os.path.isfile(path) else ''
+        parts.extend([path, digest])
+    return cache.digest(*parts)
+
+
+def replay(key):
+    """Restores the outputs of a cached run, returns (rc, out, err).
+
+    None if it isn't cached, or some of its outputs went missing from the
+    cache: the command has to run again."""
+    entry = cache.Store('commands').get(key)
+    if entry is None:
+        return None
+    artifacts = cache.get_dir('artifacts', key)
+    for number in range(len(entry['outputs'])):
+        if not os.path.isfile(os.path.join(artifacts, str(number))):
+            logging.debug("Output missing from the cache: %s",
+                          entry['outputs'][number])
+            return None
+    for number, path in enumerate(entry['outputs']):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.copyfile(os.path.join(artifacts, str(number)), path)
+    return (entry['returncode'],
+            entry['out'].encode('utf8'),
+            entry['err'].encode('utf8'))
+
+
+def record(key, returncode, out, err, outputs, since=0):
+    """Keeps the result of a run, along with a copy of its <outputs> (those
+    written since <since>, the run didn't produce older ones)."""
+    artifacts = cache.get_dir('artifacts', key)
+    produced = [path for path in outputs \
+                if os.path.isfile(path) and os.path.getmtime(path) >= since]
+    for number, path in enumerate(produced):
+        shutil.copyfile(path, os.path.join(artifacts, str(number)))
+    cache.Store('commands').set(key, {
+        'returncode': returncode,
+        'out': out.decode('utf8', 'replace'),
+        'err': err.decode('utf8', 'replace'),
+        'outputs': produced,
+    })
+
+
+def cmd(command, print_error=True, cwd=None, timeout=None, inputs=None,
+        outputs=None):
+    """Runs a subprocess command (without shell), optionally inside <cwd>.
+
+    A command declaring its <inputs> (files it reads) is deterministic as
+    far as we're concerned: when CACHE is enabled and it already ran
+    successfully with the same inputs, its result is replayed instead.
+    That includes restoring the files it produced (<outputs>)."""
 
     # Avoid: TypeError: execve() ... must be encoded string without NULL
     if isinstance(command, unicode):
         command = command.encode('utf8')
 
-    proc = subprocess.Popen(shlex.split(command),
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    out, err = proc.communicate()
+    key = None
+    if CACHE and inputs is not None:
+        key = get_key(command, cwd, inputs)
+        result = replay(key)
+        if result:
+            logging.debug("Replaying cached result of: %s", command)
+            return result
+
+    # Whole seconds, some filesystems don't keep finer modification times
+    started = int(time.time())
+    returncode, out, err, timed_out = run(command, cwd, timeout)
 
-    if proc.returncode != 0 and print_error:
+    if timed_out:
+        logging.error("Timed out after %ss, killed: %s",
+                      timeout or TIMEOUT, command)
+    if returncode != 0 and print_error:
         logging.error("Something happened when running: %s", command)
         logging.error("STDOUT: %s", out.strip())
         logging.error("STDERR: %s", err.strip())
-        logging.error("RC: %i", proc.returncode)
+        logging.error("RC: %i", returncode)
 
-    return proc.returncode, out, err
+    # Failures may well be transient (network, etc.), never kept
+    if key and returncode == 0:
+        record(key, returncode, out, err, outputs or [], started)
+    return returncode, out, err
@@ -36,6 +36,6 @@ setup(
     setup_requires=['pytest-runner'],
     tests_require=['pylint', 'pytest', 'pytest-cov', 'pytest-mock'],
     package_data = {
-        '': ['*.json'],
+        '': ['*.json', 'texts/*.txt'],
     },    
 )
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import pytest
+
+from complic.utils import cache, shell
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, mocker):
+    """Keep the tests away from the real ~/.complic/cache."""
+    path = str(tmpdir.join('cache'))
+    mocker.patch.object(cache, 'CACHE_DIR', path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def executables(mocker):
+    """Executables are looked for (and mocked) by each test on its own."""
+    mocker.patch.dict(shell._executables, clear=True)
@@ -1,20 +1,32 @@
 #!/usr/bin/env python
 
+import os
+import re
+import subprocess
+import sys
+
 from complic.utils import fs
+from complic.utils import shell
+from complic.scanner import base
 
+import complic.scanner
 from complic import cli
 from complic.utils import config
 from complic.licenses import evidence
+from complic.licenses import fuzzy
+from complic.licenses import text
 
 
 def test_get_dependencies(mocker):
-    scanner_a = mocker.Mock()
-    scanner_a.scan.return_value = ['dependency1']
+    scanner_a = base.Scanner()
+    scanner_a.register_handler(re.compile(r'.*/list$'),
+                               lambda path: ['dependency1'])
 
-    scanner_b = mocker.Mock()
-    scanner_b.scan.return_value = ['dependency2']
+    scanner_b = base.Scanner()
+    scanner_b.register_handler(re.compile(r'.*/files$'),
+                               lambda path: ['dependency2'])
 
-    out = cli.get_dependencies([scanner_a, scanner_b], ['list', 'of', 'files'])
+    out = cli.get_dependencies([scanner_a, scanner_b], ['/list', '/of', '/files'])
 
     assert len(out) == 2
     assert 'dependency1' in out
@@ -47,10 +59,12 @@ def test_engine(mocker):
     dep4 = mocker.Mock()
     dep4.identifier = 'npm:package:1.1.1'
     dep4.licenses = set([])
+    dep4.package_dir = None
 
     dep5 = mocker.Mock()
     dep5.identifier = 'npm:package:2.1.1'
     dep5.licenses = set([])
+    dep5.package_dir = None
 
     cli.get_dependencies.return_value = [
         dep1, dep2, dep3, dep4, dep5
@@ -60,3 +74,180 @@ def test_engine(mocker):
     # Shouldn't really be testing types, but I don't know
     # what else to put here.
     assert isinstance(report, evidence.Report)
+
+
+def test_engine_detects_licenses(tmpdir, mocker):
+    mocker.patch.object(fs, 'Find')
+    mocker.patch.object(cli, 'get_dependencies')
+    mocker.patch.object(config, 'Manager')
+    config.Manager.return_value = {'dependencies': {}}
+    mocker.patch.object(complic.scanner, 'get')
+    complic.scanner.get.return_value = []
+    mit = open(os.path.join(text.TEXTS, 'MIT.txt')).read()
+
+    deps = []
+    for name, lics in [('undeclared', []), ('unknown', ['UNKNOWN']),
+                       ('declared', ['MIT'])]:
+        package = tmpdir.mkdir(name)
+        package.join('LICENSE').write(mit)
+        dependency = base.Dependency('python:' + name + ':1.0',
+                                     str(package.join('METADATA')))
+        dependency.package_dir = str(package)
+        dependency.licenses.update(lics)
+        deps.append(dependency)
+    unshipped = base.Dependency('python:unshipped:1.0', '/some/PKG-INFO')
+    unshipped.package_dir = str(tmpdir.mkdir('unshipped'))
+    deps.append(unshipped)
+    cli.get_dependencies.return_value = deps + \
+        [base.Dependency('js:nowhere:1.0', '/some/package.json')]
+
+    report = cli.engine('/some/dir', 'project_name').report_raw
+    assert report['dependencies']['python:undeclared:1.0'] == ['MIT (detected)']
+    assert report['dependencies']['python:unknown:1.0'] == ['MIT (detected)']
+    assert report['dependencies']['python:declared:1.0'] == ['MIT']
+    # Guesses never count as known licenses
+    assert report['licenses']['MIT']
+    assert report['licenses']['MIT (detected)'] is False
+    assert report['dependencies']['python:unshipped:1.0'] == ['<no license>']
+    assert report['dependencies']['js:nowhere:1.0'] == ['<no license>']
+    assert report['detected'] == {
+        'python:undeclared:1.0': {'MIT': 1.0},
+        'python:unknown:1.0': {'MIT': 1.0},
+    }
+    assert deps[0].confidence == {'MIT': 1.0}
+    assert report['stats']['complic.licenses.text'] == {
+        'license files identified': 2}
+
+
+def test_engine_suggests_licenses(mocker):
+    mocker.patch.object(fs, 'Find')
+    mocker.patch.object(cli, 'get_dependencies')
+    mocker.patch.object(config, 'Manager')
+    config.Manager.return_value = {'dependencies': {}}
+    mocker.patch.object(complic.scanner, 'get')
+    complic.scanner.get.return_value = []
+
+    deps = []
+    for name, lics in [('a', ['Eclipse 2', 'MIT']), ('b', ['Eclipse 2']),
+                       ('c', ['UNKNOWN', 'Proprietary'])]:
+        dependency = base.Dependency('python:' + name + ':1.0', '/some/METADATA')
+        dependency.licenses.update(lics)
+        deps.append(dependency)
+    cli.get_dependencies.return_value = deps
+    mocker.spy(fuzzy.Suggester, 'suggest')
+
+    report = cli.engine('/some/dir', 'project_name').report_raw
+    assert list(report['suggestions']) == ['Eclipse 2']
+    assert report['suggestions']['Eclipse 2'][0][0] == 'EPL-2.0'
+    assert fuzzy.Suggester.suggest.call_count == 1
+    assert sorted(fuzzy.Suggester.suggest.call_args[0][1]) == [
+        'Eclipse 2', 'Proprietary']
+
+    cli.get_dependencies.return_value = deps[:1]
+    mocker.spy(fuzzy.Suggester, '__init__')
+    deps[0].licenses = set(['MIT'])
+    assert cli.engine('/some/dir', 'project_name').report_raw[
+        'suggestions'] == {}
+    assert not fuzzy.Suggester.__init__.called
+
+
+def test_engine_with_cache(mocker):
+    mocker.patch.object(fs, 'Find')
+    mocker.patch.object(fs, 'TreeCache')
+    mocker.patch.object(cli, 'get_dependencies')
+    mocker.patch.object(config, 'Manager')
+    config.Manager.return_value = {'dependencies': {}}
+    cli.get_dependencies.return_value = []
+
+    mocker.patch.object(complic.scanner, 'get')
+    complic.scanner.get.return_value = []
+    mocker.patch.object(shell, 'CACHE', False)
+
+    cli.engine('/some/dir', 'project_name', ['node_modules'], cache=True,
+               site_packages='/venv/lib/python3.6/site-packages')
+    assert shell.CACHE
+    complic.scanner.get.assert_called_once_with(
+        False, '/venv/lib/python3.6/site-packages', [])
+    fs.TreeCache.assert_called_once_with('/some/dir', ['.git', 'node_modules'])
+    fs.Find.assert_called_once_with('/some/dir', ['.git', 'node_modules'],
+                                    fs.TreeCache.return_value, 1)
+
+
+def test_engine_site_packages_without_setuppy(tmpdir, mocker):
+    mocker.patch.object(config, 'Manager')
+    config.Manager.return_value = {'dependencies': {}}
+    site_packages = tmpdir.mkdir("site-packages")
+    site_packages.mkdir("six-1.11.0.dist-info").join("METADATA").write(
+        "Name: six\nVersion: 1.11.0\nLicense: MIT\n")
+    project = tmpdir.mkdir("project")
+    project.join("README").write("")
+
+    report = cli.engine(str(project), 'project_name',
+                        site_packages=str(site_packages)).report_raw
+    assert report['dependencies'] == {'python:six:1.11.0': ['MIT']}
+
+def test_engine_walks_wheelhouses(mocker):
+    mocker.patch.object(fs, 'Find')
+    fs.Find.return_value = ['/some/dir/setup.py']
+    mocker.patch.object(cli, 'get_dependencies')
+    cli.get_dependencies.return_value = []
+    mocker.patch.object(config, 'Manager')
+    config.Manager.return_value = {'dependencies': {}}
+    mocker.patch.object(complic.scanner, 'get')
+    complic.scanner.get.return_value = []
+
+    cli.engine('/some/dir', 'project_name',
+               wheelhouses=['/some/dir/wheelhouse', '/pip/cache'])
+    assert complic.scanner.get.call_args[0][2] == ['/some/dir/wheelhouse',
+                                                   '/pip/cache']
+    # The one inside the directory is already walked
+    assert [c[0][0] for c in fs.Find.call_args_list] == ['/some/dir',
+                                                         '/pip/cache']
+    files = cli.get_dependencies.call_args[0][1]
+    assert list(files) == ['/some/dir/setup.py'] * 2
+
+
+# Modules complic must not import until it's actually scanning something
+HEAVY = ['setuptools', 'distutils', 'complic.scanner.java',
+         'complic.scanner.npm', 'complic.scanner.python',
+         'complic.scanner.cocoapods']
+
+
+def run_python(code, home):
+    """Runs <code> in a new interpreter, with <home> as HOME (where the
+    configuration is created)."""
+    env = dict(os.environ, HOME=home)
+    return subprocess.check_output([sys.executable, '-c', code], env=env,
+                                   cwd=os.path.dirname(os.path.dirname(__file__)))
+
+def heavy_imports(code):
+    """<code> followed by printing which of HEAVY it imported."""
+    return code + """
+import sys
+print('imported:' + ','.join(m for m in %r if m in sys.modules))
+""" % (HEAVY,)
+
+
+def test_import_budget(tmpdir):
+    """Starting complic (or scanning nothing) must stay cheap: no scanner
+    is imported, nor setuptools/distutils, and no executable looked for."""
+    out = run_python(heavy_imports("""
+import complic.cli
+import complic.utils.shell
+complic.cli.engine(%r, 'empty')
+assert not complic.utils.shell._executables
+""" % (str(tmpdir.mkdir('project')),)), str(tmpdir))
+    assert out.splitlines()[-1] == b'imported:'
+    assert tmpdir.join('.complic').check(dir=True)
+
+def test_help_budget(tmpdir):
+    out = run_python(heavy_imports("""
+import runpy, sys
+sys.argv = ['complic', '--help']
+try:
+    runpy.run_module('complic.cli', run_name='__main__')
+except SystemExit:
+    pass
+"""), str(tmpdir))
+    assert b'--site-packages' in out
+    assert out.splitlines()[-1] == b'imported:'
@@ -41,3 +41,27 @@ def test_report_json(report):
 
 def test_report_text(report):
     assert isinstance(report.to_text(), str)
+
+def test_report_stats(report):
+    report.add_stats('complic.scanner.npm', {'duplicates': 3})
+    report.add_stats('complic.scanner.java', {})
+    assert report.report_raw['stats'] == {'complic.scanner.npm': {'duplicates': 3}}
+    assert 'complic.scanner.npm: duplicates: 3' in report.to_text()
+
+def test_report_detected(report):
+    report.add_license('MIT', 'other:identifier', True)
+    report.add_detected('some:identifier', 'MIT', 0.97)
+    out = report.report_raw
+    assert out['detected'] == {'some:identifier': {'MIT': 0.97}}
+    assert out['licenses']['MIT (detected)'] is False
+    problem = [p for p in report.problems if p['licenses'] == ['MIT (detected)']]
+    assert problem[0]['dependencies'] == ['some:identifier']
+    assert problem[0]['description'].startswith('Not declared')
+
+def test_report_suggestions(report):
+    report.add_suggestions('another_lic', [('MIT', 0.8), ('X11', 0.6)])
+    assert report.report_raw['suggestions'] == {
+        'another_lic': [('MIT', 0.8), ('X11', 0.6)]}
+    problem = [p for p in report.problems if p['licenses'] == ['another_lic']]
+    assert problem[0]['suggestions'] == [('MIT', 0.8), ('X11', 0.6)]
+    assert 'Closest known licenses: MIT (0.80), X11 (0.60)' in report.to_text()
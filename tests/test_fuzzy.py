@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+from complic.licenses import fuzzy
+from complic.licenses import regex
+
+
+names = {
+    'apache 2.0': 'Apache-2.0',
+    'apache license 2.0': 'Apache-2.0',
+    'apache 1.1': 'Apache-1.1',
+    'mit': 'MIT',
+    'mit license': 'MIT',
+    'x11': 'X11',
+    'lgpl 2.1+': 'LGPL-2.1+',
+    'lgpl 2.1': 'LGPL-2.1',
+}
+
+def test_simplify():
+    assert fuzzy.simplify('GPL v3.0') == 'gpl 3'
+    assert fuzzy.simplify('Apache-2.0') == fuzzy.simplify('apache 2')
+    assert fuzzy.simplify('LGPL-2.1+') == 'lgpl 2.1+'
+    assert fuzzy.simplify('v10.0.1') == '10.0.1'
+    assert fuzzy.simplify('devv2') == 'devv2'
+
+def test_ngrams():
+    assert fuzzy.ngrams('MIT', 3) == {' mi': 1, 'mit': 1, 'it ': 1}
+    assert fuzzy.ngrams('', 3) == {}
+
+def test_suggest():
+    suggester = fuzzy.Suggester(names)
+    out = suggester.suggest(['Apache 2', 'MIT/X11', 'GNU LGPL v2.1+', 'Apache 2'])
+    assert out['Apache 2'][0] == ('Apache-2.0', 1.0)
+    assert [lic for lic, _ in out['Apache 2']] == ['Apache-2.0', 'Apache-1.1']
+    assert sorted(lic for lic, _ in out['MIT/X11']) == ['MIT', 'X11']
+    assert out['GNU LGPL v2.1+'][0][0] == 'LGPL-2.1+'
+    assert out['GNU LGPL v2.1+'][1][0] == 'LGPL-2.1'
+    assert out['GNU LGPL v2.1+'][0][1] > out['GNU LGPL v2.1+'][1][1]
+
+def test_suggest_top():
+    suggester = fuzzy.Suggester(names)
+    assert len(suggester.suggest(['Apache 2'], top=1)['Apache 2']) == 1
+
+def test_suggest_nothing_close():
+    suggester = fuzzy.Suggester(names)
+    assert suggester.suggest(['Proprietary', 'zzz', '']) == {}
+
+def test_suggest_inventory():
+    suggester = fuzzy.Suggester(regex.Normalizer().index['exact'])
+    out = suggester.suggest(['GPL v3 or later', 'Eclipse 2'])
+    assert out['GPL v3 or later'][0] == ('GPL-3.0-OR-LATER', 1.0)
+    assert out['Eclipse 2'][0][0] == 'EPL-2.0'
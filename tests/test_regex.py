@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 
+import collections
+import json
+
 import pytest
 
 from complic.licenses import regex
+from complic.utils import cache
 from complic.licenses import exceptions
 
 
@@ -31,3 +35,147 @@ def test_normalizer_match():
     n = regex.Normalizer(lics)
     assert n.match('aaa hello world') == 'some_license'
 
+
+def test_normalizer_exact_names():
+    n = regex.Normalizer({
+        'GPL-2.0': {'regexp': 'GPL.*2', 'name': 'GNU General Public License v2.0 only',
+                    'isDeprecatedLicenseId': True},
+        'GPL-2.0-ONLY': {'regexp': 'NOPE', 'licenseId': 'GPL-2.0-only',
+                         'name': 'GNU General Public License v2.0 only'},
+    })
+    assert n.match('gnu general public license V2.0 only') == 'GPL-2.0-ONLY'
+    assert n.match('gpl-2.0') == 'GPL-2.0'
+    assert n.match('GPL 2.0-only') == 'GPL-2.0-ONLY'
+    assert n.match('GPL version 2') == 'GPL-2.0'
+
+def test_normalizer_inventory_order():
+    inventory = collections.OrderedDict([
+        ('GENERIC', {'regexp': '.*License.*'}),
+        ('BSD-2-CLAUSE', {'regexp': '(BSD 2-Clause|BSD)'}),
+        ('BSD-3-CLAUSE', {'regexp': '(BSD 3-Clause|New.*BSD)'}),
+        ('X11', {'regexp': '.*(MIT|X11).*'}),
+        ('MIT', {'regexp': '((.*)(MIT)(.*))'}),
+    ])
+    n = regex.Normalizer(inventory)
+    # The first regex matching wins, however long the other matches are
+    assert n.match('BSD 3-Clause or so') == 'BSD-2-CLAUSE'
+    assert n.match('Uses MIT') == 'X11'
+    assert n.match('MIT License') == 'GENERIC'
+    assert n.match('New BSD') == 'BSD-3-CLAUSE'
+
+# Answers from before the inventory was indexed (trying every regex in
+# turn), which indexing must not change
+COMMON = [
+    ('BSD License', 'BSD-2-CLAUSE'),
+    ('BSD', 'BSD-2-CLAUSE'),
+    ('New BSD License', 'BSD-3-CLAUSE'),
+    ('BSD 3-Clause', 'BSD-3-CLAUSE'),
+    ('LGPLv3', 'LGPL-2.0-OR-LATER'),
+    ('LGPLv2', 'LGPL-2.0'),
+    ('LGPL', 'LGPL-2.0-OR-LATER'),
+    ('GNU Lesser General Public License v3.0', 'LGPL-2.0-OR-LATER'),
+    ('GPLv2', 'GPL-2.0'),
+    ('GPLv2+', 'GPL-2.0'),
+    ('GPLv3', 'LGPL-3.0'),
+    ('Apache 2.0', 'APACHE-2.0'),
+    ('Apache License, Version 2.0', 'APACHE-2.0'),
+    ('The Apache Software License, Version 2.0', 'APACHE-2.0'),
+    ('ASL 2.0', 'APACHE-2.0'),
+    ('MIT License', 'MIT'),
+    ('The MIT License (MIT)', 'MIT'),
+    ('ISC License', 'ISC'),
+    ('Eclipse Public License 1.0', 'EPL-1.0'),
+    ('CDDL + GPLv2 with classpath exception', 'CDDL-1.1'),
+    ('Public Domain', 'WTFPL'),
+    ('GPL', None),
+    ('Proprietary', None),
+]
+
+def test_normalizer_common_strings():
+    n = regex.Normalizer()
+    assert [(string, n.lookup(string)) for string, _ in COMMON] == COMMON
+
+def test_normalizer_candidates():
+    n = regex.Normalizer({
+        'PREFIX': {'regexp': '(Apache|ASL) 2'},
+        'LITERAL': {'regexp': '.*(Codehaus)+'},
+        'ANYTHING': {'regexp': '(.*)(a|b)'},
+    })
+    assert n.candidates('Apache 2') == set(['PREFIX', 'ANYTHING'])
+    assert n.candidates('Version 2') == set(['ANYTHING'])
+    assert n.candidates('The Codehaus License') == set(['LITERAL', 'ANYTHING'])
+    assert n.candidates('') == set(['ANYTHING'])
+
+def test_literal_analysis():
+    parse = regex.sre_parse.parse
+    assert regex.literal_prefixes(parse('abc.*d')) == set(['abc'])
+    assert regex.literal_prefixes(parse('((ab)+|cd)x')) == set(['ab', 'cd'])
+    assert regex.literal_prefixes(parse('(ab|.*)')) is None
+    assert regex.literal_prefixes(parse('a?b')) is None
+    assert regex.required_literals(parse('.*(ab)+c.*de?')) == ['ab', 'c', 'd']
+
+def test_normalizer_memo(mocker):
+    mocker.patch.object(regex.Normalizer, 'MEMO_SIZE', 2)
+    n = regex.Normalizer(lics)
+    mocker.spy(n, 'lookup')
+    for _ in range(3):
+        assert n.match('aaa 1') == 'some_license'
+        with pytest.raises(exceptions.UnknownLicenseError):
+            n.match('unknown')
+    assert n.lookup.call_count == 2
+    assert n.stats == {'cache hits': 4, 'cache misses': 2}
+
+    # Least recently used goes first
+    n.match('aaa 2')
+    assert list(n.memo) == ['unknown', 'aaa 2']
+    n.save() # Not persistent, nothing happens
+
+def test_normalizer_persistent():
+    n = regex.Normalizer(lics, persistent=True)
+    n.match('aaa 1')
+    with pytest.raises(exceptions.UnknownLicenseError):
+        n.match('unknown')
+    n.save()
+
+    n = regex.Normalizer({'some_license': {'regexp': 'aaa .*'}},
+                         persistent=True)
+    assert n.match('aaa 1') == 'some_license'
+    with pytest.raises(exceptions.UnknownLicenseError):
+        n.match('unknown')
+    assert n.stats == {'cache hits': 2, 'cache misses': 0}
+
+    # A different inventory starts from scratch
+    n = regex.Normalizer({'other': {'regexp': 'unknown'}}, persistent=True)
+    assert n.match('unknown') == 'other'
+    assert n.misses == 1
+
+def test_normalizer_lazy(mocker):
+    mocker.spy(regex, 'load_index')
+    n = regex.Normalizer()
+    assert not regex.load_index.called
+    assert n.match('MIT') == 'MIT'
+    assert n.match('The Apache Software License, Version 2.0') == 'APACHE-2.0'
+    assert regex.load_index.call_count == 1
+    # Only the regexes actually tried were compiled
+    assert 0 < len(n.compiled) < len(n.licenses)
+
+def test_shipped_index_up_to_date():
+    index = regex.load_index()
+    with open(regex.INVENTORY, 'r') as inventory:
+        lics = json.loads(inventory.read())
+    index.pop('inventory')
+    assert json.loads(json.dumps(regex.build_index(lics))) == index
+
+def test_outdated_index(tmpdir, mocker):
+    inventory = tmpdir.join('inventory.json')
+    inventory.write(json.dumps(lics))
+    index = tmpdir.join('index.json')
+    mocker.patch.object(regex, 'INVENTORY', str(inventory))
+    mocker.patch.object(regex, 'INDEX', str(index))
+
+    assert regex.load_index()['licenses'] == {'some_license': 'aaa .*'}
+    index.write(json.dumps({'inventory': 'outdated', 'licenses': {}}))
+    assert regex.load_index()['licenses'] == {'some_license': 'aaa .*'}
+    index.write(json.dumps({'inventory': cache.file_digest(str(inventory)),
+                            'licenses': {}}))
+    assert regex.load_index()['licenses'] == {}
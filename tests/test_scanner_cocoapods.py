@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
 import distutils
+import json
+
+import pytest
 
 from complic.scanner.cocoapods import Scanner
 from complic.utils import shell
@@ -84,8 +87,107 @@ def test_handle_podfile(tmpdir, mocker):
     p.write('fake')
     path = str(p.realpath())
 
-    dependencies = Scanner.handle_podfile(path)
+    dependencies = Scanner().handle_podfile(path)
     assert len(dependencies) == 1
     assert dependencies[0].identifier == 'pod:AFNetworking:2.6.3'
     assert len(dependencies[0].licenses) == 1
     assert 'MIT' in dependencies[0].licenses
+
+def test_podspec_cached_by_version(mocker):
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.return_value = (0, '{"name": "AFNetworking", "license": "MIT"}', '')
+    assert Scanner.get_podspec('AFNetworking', '2.6.3')['license'] == 'MIT'
+    assert Scanner.get_podspec('AFNetworking', '2.6.3')['license'] == 'MIT'
+    shell.cmd.assert_called_once_with("pod spec cat 'AFNetworking' --version='2.6.3'")
+    Scanner.get_podspec('AFNetworking', '3.0.0')
+    Scanner.get_podspec('AFNetworking')
+    Scanner.get_podspec('AFNetworking')
+    assert shell.cmd.call_count == 4
+
+def test_handle_podfile_resolves_unique_pods(tmpdir, mocker):
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.side_effect = lambda command: (0, json.dumps({
+        "license": {"type": command.split("'")[1]},
+    }), '')
+    p = tmpdir.mkdir("project").join("Podfile.lock")
+    p.write("""PODS:
+  - AFNetworking (2.6.3):
+    - AFNetworking/NSURLConnection (= 2.6.3)
+    - AFNetworking/NSURLSession (= 2.6.3)
+  - Braintree (4.0.0)
+""")
+    deps = Scanner().handle_podfile(str(p))
+    assert [d.identifier for d in deps] == ['pod:AFNetworking:2.6.3',
+                                            'pod:Braintree:4.0.0']
+    assert deps[0].licenses == set(['AFNetworking'])
+    assert deps[1].licenses == set(['Braintree'])
+    assert shell.cmd.call_count == 2
+    Scanner().handle_podfile(str(p))
+    assert shell.cmd.call_count == 2
+
+PODFILE = """PODS:
+  - AFNetworking (2.6.3)
+  - Braintree (4.0.0)
+  - MyLocalPod (0.1.0)
+  - Missing (1.0)
+"""
+
+@pytest.fixture
+def repos(tmpdir, mocker):
+    repos = tmpdir.mkdir('repos')
+    mocker.patch.object(Scanner, 'REPOS', str(repos))
+    # md5('AFNetworking') starts with a75
+    sharded = repos.mkdir('trunk').mkdir('Specs').mkdir('a').mkdir('7').mkdir('5')
+    sharded.mkdir('AFNetworking').mkdir('2.6.3').join(
+        'AFNetworking.podspec.json').write('{"license": {"type": "MIT"}}')
+    legacy = repos.mkdir('private')
+    legacy.mkdir('Braintree').mkdir('4.0.0').join(
+        'Braintree.podspec.json').write('{"license": "Braintree"}')
+    return repos
+
+def test_find_podspec(repos, tmpdir):
+    project = tmpdir.mkdir('project')
+    project.mkdir('Pods').mkdir('Local Podspecs').join(
+        'MyLocalPod.podspec.json').write('{"license": "Apache-2.0"}')
+    spec_dirs = Scanner.get_spec_dirs()
+    assert len(spec_dirs) == 2
+    path = Scanner.find_podspec('AFNetworking', '2.6.3', str(project), spec_dirs)
+    assert path.endswith('/a/7/5/AFNetworking/2.6.3/AFNetworking.podspec.json')
+    assert Scanner.find_podspec('Braintree', '4.0.0', str(project), spec_dirs)
+    assert Scanner.find_podspec('MyLocalPod', '0.1.0', str(project), spec_dirs)
+    assert not Scanner.find_podspec('AFNetworking', '1.0', str(project), spec_dirs)
+
+def test_handle_podfile_offline(repos, tmpdir, mocker):
+    # Pods are resolved by several threads and Mock's call_count isn't
+    # thread safe, calls are counted in a list instead
+    calls = []
+    mocker.patch.object(shell, 'cmd', side_effect=lambda *args, **kwargs: \
+                        calls.append(args) or (0, '{"license": "BSD"}', ''))
+    project = tmpdir.mkdir('project')
+    project.join('Podfile.lock').write(PODFILE)
+    local_specs = project.mkdir('Pods').mkdir('Local Podspecs')
+    local_specs.join('MyLocalPod.podspec.json').write('{"license": "Apache-2.0"}')
+
+    deps = Scanner(offline=True).handle_podfile(str(project.join('Podfile.lock')))
+    assert not calls
+    assert [(d.identifier, d.licenses) for d in deps] == [
+        ('pod:AFNetworking:2.6.3', set(['MIT'])),
+        ('pod:Braintree:4.0.0', set(['Braintree'])),
+        ('pod:Missing:1.0', set()),
+        ('pod:MyLocalPod:0.1.0', set(['Apache-2.0'])),
+    ]
+
+    local_specs.join('MyLocalPod.podspec.json').write('invalid')
+    deps = Scanner().handle_podfile(str(project.join('Podfile.lock')))
+    assert len(calls) == 2
+    assert deps[3].licenses == set(['BSD'])
+
+def test_handle_manifest(repos, tmpdir):
+    project = tmpdir.mkdir('project')
+    manifest = project.mkdir('Pods').join('Manifest.lock')
+    manifest.write("PODS:\n  - AFNetworking (2.6.3)\n")
+    scanner = Scanner(offline=True)
+    deps = scanner.handle_manifest(str(manifest))
+    assert deps[0].licenses == set(['MIT'])
+    project.join('Podfile.lock').write('')
+    assert scanner.handle_manifest(str(manifest)) == []
@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 
+import multiprocessing
+import pickle
+import sys
 import re
+import threading
 
 import complic.scanner
 from complic.scanner import base
+from complic.scanner import npm
+from complic.utils import fs
 
 def test_scanners_returned():
     assert len(complic.scanner.get()) > 0
@@ -17,3 +23,208 @@ def test_base_scanner():
     deps = scanner.scan(['some', 'file'])
     assert len(deps) == 2
 
+
+def test_literal_match():
+    assert base.literal_match(re.compile(r'.*/pom.xml$')) == ('basename', 'pom.xml')
+    assert base.literal_match(re.compile(r'.*\.tar\.gz$')) == ('suffix', '.tar.gz')
+    assert base.literal_match(re.compile(r'.*/a/.*/b$')) == (None, None)
+
+def test_dispatcher_routes_once(mocker):
+    java = base.Scanner()
+    pom = mocker.Mock(return_value=['pom'])
+    java.register_handler(re.compile(r'.*/pom.xml$'), pom)
+
+    other = base.Scanner()
+    wheel = mocker.Mock(return_value=['wheel'])
+    other.register_handler(re.compile(r'.*\.whl$'), wheel)
+    nested = mocker.Mock(return_value=['nested'])
+    other.register_handler(re.compile(r'.*/nested/.*'), nested)
+
+    deps = base.Dispatcher([other, java]).scan([
+        '/a/pom.xml',
+        '/a/b/pom.xml',
+        'pom.xml',
+        '/a/xpom.xml',
+        '/a/x.whl',
+        '/nested/x.whl',
+    ])
+    assert deps == ['wheel', 'wheel', 'nested', 'pom', 'pom']
+    pom.assert_any_call('/a/pom.xml')
+    pom.assert_any_call('/a/b/pom.xml')
+    wheel.assert_any_call('/nested/x.whl')
+    nested.assert_called_once_with('/nested/x.whl')
+
+def test_dispatcher_shares_index():
+    scanner = base.Scanner()
+    seen = []
+    def handler(path):
+        seen.append(scanner.index.find('/a', ['pom.xml']))
+        return []
+    scanner.register_handler(re.compile(r'.*/pom.xml$'), handler)
+    scanner.scan(['/a/pom.xml', '/a/b/pom.xml'])
+    # Handlers run once all the files are in the index
+    assert seen == [['/a/b/pom.xml', '/a/pom.xml']] * 2
+
+def test_dispatcher_concurrent_same_results():
+    scanners = []
+    for name in ['a', 'b', 'c']:
+        scanner = base.Scanner()
+        scanner.register_handler(re.compile(r'.*/%s$' % name),
+                                 lambda path, name=name: [name + path])
+        scanners.append(scanner)
+    files = ['/1/a', '/1/b', '/2/a', '/1/c', '/3/a']
+    serial = base.Dispatcher(scanners).scan(files)
+    assert base.Dispatcher(scanners, jobs=3).scan(files) == serial
+    assert serial == ['a/1/a', 'a/2/a', 'a/3/a', 'b/1/b', 'c/1/c']
+
+def test_dispatcher_concurrent_isolates_errors():
+    def broken(path):
+        raise RuntimeError("mvn exploded")
+    bad = base.Scanner()
+    bad.register_handler(re.compile(r'.*/pom.xml$'), broken)
+    good = base.Scanner()
+    good.register_handler(re.compile(r'.*/package.json$'), lambda path: [path])
+    deps = base.Dispatcher([bad, good], jobs=2).scan(['/pom.xml', '/package.json'])
+    assert deps == ['/package.json']
+
+def test_dependency_is_picklable():
+    dependency = base.Dependency('js:hello:1.0', '/a/package.json')
+    dependency.licenses.add('MIT')
+    copy = pickle.loads(pickle.dumps(dependency))
+    assert copy.identifier == dependency.identifier
+    assert copy.path == dependency.path
+    assert copy.licenses == set(['MIT'])
+
+def test_dispatcher_process_pool(tmpdir, mocker):
+    mocker.patch.object(base, 'CHUNK_SIZE', 2)
+    scanner = base.Scanner()
+    scanner.register_handler(re.compile(r'.*/package.json$'),
+                             npm.Scanner.handle_pkgjson,
+                             parallel=True)
+    files = []
+    for i in range(5):
+        pkgjson = tmpdir.mkdir("module%i" % i).join("package.json")
+        pkgjson.write('{"name": "m%i", "version": "1.0", "license": "MIT"}' % i)
+        files.append(str(pkgjson))
+
+    serial = base.Dispatcher([scanner]).scan(files)
+    parallel = base.Dispatcher([scanner], processes=2).scan(files)
+    assert [d.identifier for d in parallel] == [d.identifier for d in serial]
+    assert [d.identifier for d in parallel][0] == 'js:m0:1.0'
+    assert parallel[4].licenses == set(['MIT'])
+
+def test_dispatcher_forks_before_threads(tmpdir, mocker):
+    # Sent to the workers while the tree is still being walked
+    mocker.patch.object(base, 'CHUNK_SIZE', 1)
+    tmpdir.mkdir("module").join("package.json").write(
+        '{"name": "m", "version": "1.0"}')
+    threads = []
+    pool = multiprocessing.Pool
+    def fork(*args):
+        threads.append(threading.active_count())
+        return pool(*args)
+    mocker.patch.object(multiprocessing, 'Pool', side_effect=fork)
+    scanner = base.Scanner()
+    scanner.register_handler(re.compile(r'.*/package.json$'),
+                             npm.Scanner.handle_pkgjson,
+                             parallel=True)
+    before = threading.active_count()
+    dispatcher = base.Dispatcher([scanner], jobs=2, processes=2)
+    deps = dispatcher.scan(fs.Find(str(tmpdir), jobs=4))
+    assert [d.identifier for d in deps] == ['js:m:1.0']
+    assert threads == [before]
+
+def test_dispatcher_process_pool_isolates_errors(tmpdir):
+    bad = base.Scanner()
+    bad.register_handler(re.compile(r'.*/package.json$'),
+                         npm.Scanner.handle_pkgjson,
+                         parallel=True)
+    good = base.Scanner()
+    good.register_handler(re.compile(r'.*/setup.py$'), lambda path: [path])
+    pkgjson = tmpdir.mkdir("module").join("package.json")
+    # A license object without its type
+    pkgjson.write('{"name": "m", "version": "1.0", "license": {"url": "x"}}')
+    files = [str(pkgjson), '/setup.py']
+    for jobs in [1, 2]:
+        dispatcher = base.Dispatcher([bad, good], jobs=jobs, processes=2)
+        assert dispatcher.scan(files) == ['/setup.py']
+        assert dispatcher.pool is None
+
+def test_get_is_lazy():
+    scanners = complic.scanner.get(offline=True)
+    assert [s.__module__ for s in scanners] == [
+        'complic.scanner.java', 'complic.scanner.npm',
+        'complic.scanner.python', 'complic.scanner.cocoapods']
+    assert all(s.scanner is None for s in scanners)
+    assert scanners[0].args == (True,)
+
+def test_get_wheelhouses():
+    python = complic.scanner.get()[2]
+    assert not any(p.match('/a/x.whl') for p in python.patterns)
+    python = complic.scanner.get(wheelhouses=['/wheels/', '/a.b'])[2]
+    assert python.args == (None, ['/wheels/', '/a.b'])
+    assert [bool(p.match(path)) for p in python.patterns[2:] \
+            for path in ['/wheels/x.whl', '/axb/x.whl', '/a.b/c/x.tar.gz']] == [
+                True, False, False,
+                False, False, True]
+
+def test_get_site_packages(mocker):
+    mocker.patch('complic.scanner.python.Scanner')
+    assert complic.scanner.get()[2].scanner is None
+    # Read even if no python project shows up
+    python = complic.scanner.get(site_packages='/venv')[2]
+    assert python.scanner is not None
+    assert python.finish() == python.scanner.finish.return_value
+
+def test_dispatcher_finish():
+    class Finishing(base.Scanner):
+        def finish(self):
+            return ['finished']
+    class Broken(base.Scanner):
+        def finish(self):
+            raise RuntimeError("exploded")
+    lazy = base.LazyScanner('complic.scanner.java', [r'.*/pom.xml$'])
+    assert lazy.finish() == []
+    deps = base.Dispatcher([Finishing(), Broken(), lazy]).scan(['/a'])
+    assert deps == ['finished']
+
+def test_scanner_stats_per_instance():
+    first, second = base.Scanner(), base.Scanner()
+    first.stats['found'] += 2
+    second.stats['found'] += 1
+    second.reset()
+    assert first.stats == {'found': 2}
+    assert second.stats == {}
+
+def test_dispatcher_loads_lazy_scanners(mocker):
+    created = []
+    class FakeScanner(base.Scanner):
+        def __init__(self, flag):
+            super(FakeScanner, self).__init__()
+            created.append(flag)
+            self.register_handler(re.compile(r'.*/pom.xml$'), self.handle)
+        def handle(self, path):
+            self.stats['handled'] += 1
+            return ['pom:' + path]
+    module = mocker.Mock(Scanner=FakeScanner)
+    mocker.patch.dict(sys.modules, {'fake_scanner': module})
+
+    lazy = base.LazyScanner('fake_scanner', [r'.*/pom.xml$', r'.*/build.gradle$'],
+                            'flag')
+    other = base.LazyScanner('never_imported', [r'.*/package.json$'])
+    dispatcher = base.Dispatcher([lazy, other])
+
+    assert dispatcher.scan(['/a/README']) == []
+    assert lazy.scanner is None
+    assert lazy.stats == {}
+
+    deps = dispatcher.scan(['/a/build.gradle', '/a/pom.xml', '/b/pom.xml'])
+    assert deps == ['pom:/a/pom.xml', 'pom:/b/pom.xml']
+    assert created == ['flag']
+    assert lazy.stats == {'handled': 2}
+    assert dispatcher.scanners[0] is lazy.scanner
+    assert dispatcher.scanners[0].index is dispatcher.index
+    assert other.scanner is None
+
+    lazy.reset()
+    assert lazy.stats == {}
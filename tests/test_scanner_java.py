@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
 import distutils
+import os
 
+import pytest
+
+from complic.scanner import java
 from complic.scanner.java import Scanner
 from complic.utils import shell
 from complic.utils import fs
@@ -57,19 +61,17 @@ def test_parse_thirdparty():
 def test_handle_bad_pom(mocker):
     mocker.patch.object(shell, 'cmd')
     shell.cmd.return_value = (1, '', '')
-    assert not Scanner.handle_pom('fake_path')
+    assert not Scanner().handle_pom('fake_path')
 
 def test_handle_good_pom(tmpdir, mocker):
 
     mocker.patch.object(shell, 'cmd')
     shell.cmd.return_value = (0, '', '')
 
-    p = tmpdir.mkdir("project").join("THIRD-PARTY.txt")
-    p.write('fake')
-    thirdparty_txt = str(p.realpath())
-
-    mocker.patch.object(fs, 'Find')
-    fs.Find.return_value.files = ['/absolute/path', thirdparty_txt]
+    project = tmpdir.mkdir("project")
+    project.join("THIRD-PARTY.txt").write('fake')
+    project.join("pom.xml").write('fake')
+    pom = str(project.join("pom.xml").realpath())
 
     mocker.patch.object(Scanner, 'parse_thirdparty')
     Scanner.parse_thirdparty.return_value = {
@@ -77,10 +79,229 @@ def test_handle_good_pom(tmpdir, mocker):
         'java:antlr:antlr:2.7.2': set(['Uknown license']),
     }
 
-    dependencies = Scanner.handle_pom('fake')
+    dependencies = Scanner().handle_pom(pom)
 
     assert len(dependencies) == 2
     assert dependencies[0].identifier == 'java:antlr:antlr:2.7.2'
     assert dependencies[1].identifier == 'java:commons:chain:1.1'
     assert len(dependencies[0].licenses) == 1
     assert len(dependencies[1].licenses) == 2
+
+def test_handle_pom_refreshes_shared_index(tmpdir, mocker):
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.return_value = (0, '', '')
+
+    project = tmpdir.mkdir("project")
+    project.join("pom.xml").write('fake')
+    pom = str(project.join("pom.xml").realpath())
+
+    scanner = Scanner()
+    scanner.index = fs.Index([pom])
+    # Written by mvn, not in the index yet
+    project.mkdir("target").join("THIRD-PARTY.txt").write(
+        " (MIT) Chain (commons:chain:1.1 - http://jakarta/)")
+
+    dependencies = scanner.handle_pom(pom)
+    assert len(dependencies) == 1
+    assert dependencies[0].identifier == 'java:commons:chain:1.1'
+
+
+def pom_with_modules(*modules):
+    pom = '<project xmlns="http://maven.apache.org/POM/4.0.0"><modules>'
+    for module in modules:
+        pom += '<module>%s</module>' % module
+    return pom + '</modules></project>'
+
+def test_parse_modules():
+    assert Scanner.parse_modules(pom_with_modules('a', 'b/pom.xml')) == ['a', 'b/pom.xml']
+    assert Scanner.parse_modules('<project></project>') == []
+    assert Scanner.parse_modules('not xml') == []
+
+def test_handle_pom_once_per_reactor(tmpdir, mocker):
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.return_value = (0, '', '')
+
+    root = tmpdir.mkdir("reactor")
+    root.join("pom.xml").write(pom_with_modules('a', 'b', 'a/'))
+    root.mkdir("a").join("pom.xml").write(pom_with_modules())
+    root.mkdir("b").join("pom.xml").write(pom_with_modules('c/pom.xml'))
+    root.join("b").mkdir("c").join("pom.xml").write(pom_with_modules())
+    root.mkdir("unrelated").join("pom.xml").write(pom_with_modules())
+
+    license_dir = root.mkdir("target").mkdir("generated-sources").mkdir("license")
+    license_dir.join("THIRD-PARTY.txt").write(
+        " (MIT) Chain (commons:chain:1.1 - http://jakarta/)\n"
+        " (BSD) Antlr (antlr:antlr:2.7.2 - no url defined)\n")
+    module_file = root.join("a").mkdir("target").join("THIRD-PARTY.txt")
+    module_file.write(" (MIT) Chain (commons:chain:1.1 - http://jakarta/)\n")
+    # Left over from an earlier build
+    stale = root.join("b").mkdir("target").join("THIRD-PARTY.txt")
+    stale.write(" (GPL) Old (old:old:0.1 - http://old/)\n")
+    stale.setmtime(0)
+
+    root_dir = str(root.realpath())
+    scanner = Scanner()
+    scanner.index = fs.Index(fs.Find(root_dir))
+
+    deps = scanner.handle_pom(os.path.join(root_dir, 'b', 'c', 'pom.xml'))
+    assert shell.cmd.call_count == 1
+    assert 'aggregate-add-third-party' in shell.cmd.call_args[0][0]
+    assert os.path.join(root_dir, 'pom.xml') in shell.cmd.call_args[0][0]
+    # Every pom of the reactor decides the outcome of the plugin
+    assert len(shell.cmd.call_args[1]['inputs']) == 4
+    assert str(license_dir.join("THIRD-PARTY.txt")) in \
+        shell.cmd.call_args[1]['outputs']
+    assert [d.identifier for d in deps] == ['java:antlr:antlr:2.7.2',
+                                            'java:commons:chain:1.1']
+    assert deps[0].path == str(license_dir.join("THIRD-PARTY.txt"))
+    assert deps[1].path == str(module_file)
+
+    assert scanner.handle_pom(os.path.join(root_dir, 'pom.xml')) == []
+    assert scanner.handle_pom(os.path.join(root_dir, 'a', 'pom.xml')) == []
+    assert shell.cmd.call_count == 1
+
+    scanner.handle_pom(os.path.join(root_dir, 'unrelated', 'pom.xml'))
+    assert shell.cmd.call_count == 2
+
+    scanner.reset()
+    assert scanner.handle_pom(os.path.join(root_dir, 'a', 'pom.xml'))
+    assert shell.cmd.call_count == 3
+
+
+def write_pom(repo, group, artifact, version, body):
+    directory = os.path.join(repo, group.replace('.', os.sep), artifact, version)
+    os.makedirs(directory)
+    path = os.path.join(directory, '%s-%s.pom' % (artifact, version))
+    with open(path, 'w') as pom:
+        pom.write('<project xmlns="http://maven.apache.org/POM/4.0.0">'
+                  '<artifactId>%s</artifactId>%s</project>' % (artifact, body))
+    return path
+
+def dependency_xml(group, artifact, version=None, extra=''):
+    xml = '<dependency><groupId>%s</groupId><artifactId>%s</artifactId>' % (group, artifact)
+    if version:
+        xml += '<version>%s</version>' % (version)
+    return xml + extra + '</dependency>'
+
+@pytest.fixture
+def repository(tmpdir):
+    repo = str(tmpdir.mkdir('repository'))
+    write_pom(repo, 'org.acme', 'parent', '1', """
+        <groupId>org.acme</groupId><version>1</version>
+        <licenses><license><name>Apache License, Version 2.0</name></license></licenses>
+        <properties><lib.version>2.0</lib.version></properties>
+        <dependencyManagement><dependencies>%s</dependencies></dependencyManagement>
+    """ % dependency_xml('org.acme', 'managed', '3.1'))
+    write_pom(repo, 'org.acme', 'lib', '2.0', """
+        <parent><groupId>org.acme</groupId><artifactId>parent</artifactId><version>1</version></parent>
+        <version>${lib.version}</version>
+        <dependencies>%s%s%s%s</dependencies>
+    """ % (dependency_xml('org.acme', 'managed'),
+           dependency_xml('junit', 'junit', '4.12', '<scope>test</scope>'),
+           dependency_xml('org.acme', 'optional', '1', '<optional>true</optional>'),
+           dependency_xml('org.acme', 'excluded', '1')))
+    write_pom(repo, 'org.acme', 'managed', '3.1', """
+        <groupId>org.acme</groupId><version>3.1</version>
+        <licenses><license><name>MIT</name></license></licenses>
+    """)
+    write_pom(repo, 'org.acme', 'excluded', '1', "<groupId>org.acme</groupId>")
+    return java.LocalRepository(repo)
+
+def test_local_repository_inherits_parent(repository):
+    model = repository.get('org.acme', 'lib', '2.0')
+    assert model['coords'] == ('org.acme', 'lib', '2.0')
+    assert model['licenses'] == ['Apache License, Version 2.0']
+    assert repository.get('org.acme', 'missing', '1') is None
+    # Memoized
+    assert repository.get('org.acme', 'lib', '2.0') is model
+
+def test_local_repository_resolve(repository, tmpdir):
+    project = tmpdir.mkdir('project')
+    project.join('pom.xml').write("""<project>
+        <groupId>com.me</groupId><artifactId>app</artifactId><version>1</version>
+        <properties><v>2.0</v></properties>
+        <dependencies>%s%s</dependencies></project>""" % (
+            dependency_xml('org.acme', 'lib', '${v}', '<exclusions><exclusion>'
+                           '<groupId>org.acme</groupId><artifactId>excluded</artifactId>'
+                           '</exclusion></exclusions>'),
+            dependency_xml('org.acme', 'unknown', '1')))
+    model = repository.load(str(project.join('pom.xml')))
+    assert repository.resolve(model) == [
+        ('org.acme', 'lib', '2.0'),
+        ('org.acme', 'unknown', '1'),
+        ('org.acme', 'managed', '3.1'),
+    ]
+
+def test_handle_pom_offline(repository, tmpdir, mocker):
+    mocker.patch.object(shell, 'cmd')
+    project = tmpdir.mkdir('project')
+    project.join('pom.xml').write("""<project>
+        <groupId>com.me</groupId><artifactId>app</artifactId><version>1</version>
+        <modules><module>core</module></modules>
+        <dependencies>%s</dependencies></project>""" % (
+            dependency_xml('org.acme', 'lib', '2.0')))
+    project.mkdir('core').join('pom.xml').write("""<project>
+        <parent><groupId>com.me</groupId><artifactId>app</artifactId><version>1</version></parent>
+        <artifactId>core</artifactId>
+        <dependencies>%s</dependencies></project>""" % (
+            dependency_xml('com.me', 'app', '1')))
+
+    scanner = Scanner(offline=True)
+    scanner.repository = repository
+    deps = scanner.handle_pom_offline(str(project.join('core', 'pom.xml')))
+    assert not shell.cmd.called
+    assert [d.identifier for d in deps] == [
+        'java:org.acme:excluded:1',
+        'java:org.acme:lib:2.0',
+        'java:org.acme:managed:3.1',
+    ]
+    assert deps[1].licenses == set(['Apache License, Version 2.0'])
+    assert deps[2].licenses == set(['MIT'])
+    assert deps[0].licenses == set()
+    assert scanner.handle_pom_offline(str(project.join('pom.xml'))) == []
+
+def test_offline_when_mvn_missing(mocker):
+    mocker.patch.object(distutils.spawn, 'find_executable')
+    distutils.spawn.find_executable.return_value = False
+    mocker.patch.object(Scanner, 'handle_pom_offline')
+    Scanner.handle_pom_offline.return_value = []
+    Scanner().scan(['hello/pom.xml'])
+    Scanner.handle_pom_offline.assert_called_once_with('hello/pom.xml')
+
+def test_local_repository_bom_and_ranges(repository, tmpdir):
+    write_pom(repository.path, 'org.acme', 'bom', '1', """
+        <groupId>org.acme</groupId><version>1</version>
+        <dependencyManagement><dependencies>%s</dependencies></dependencyManagement>
+    """ % dependency_xml('org.acme', 'from-bom', '5'))
+    project = tmpdir.mkdir('project')
+    project.join('pom.xml').write("""<project>
+        <parent><groupId>org.acme</groupId><artifactId>parent</artifactId><version>1</version>
+        <relativePath>..</relativePath></parent>
+        <artifactId>app</artifactId>
+        <dependencyManagement><dependencies>%s</dependencies></dependencyManagement>
+        <dependencies>%s%s</dependencies></project>""" % (
+            dependency_xml('org.acme', 'bom', '1', '<scope>import</scope><type>pom</type>'),
+            dependency_xml('org.acme', 'from-bom'),
+            dependency_xml('org.acme', 'ranged', '[1.0,2.0)')))
+    tmpdir.join('pom.xml').write('<project><artifactId>other</artifactId></project>')
+    model = repository.load(str(project.join('pom.xml')))
+    assert model['licenses'] == ['Apache License, Version 2.0']
+    assert repository.resolve(model) == [('org.acme', 'from-bom', '5')]
+
+def test_local_repository_direct_scopes_and_missing_parent(repository, tmpdir):
+    write_pom(repository.path, 'org.acme', 'provided', '1', """
+        <groupId>org.acme</groupId><version>1</version>
+        <dependencies>%s</dependencies>
+    """ % dependency_xml('org.acme', 'provided-transitive', '1', '<scope>provided</scope>'))
+    project = tmpdir.mkdir('project')
+    project.join('pom.xml').write("""<project>
+        <parent><groupId>com.me</groupId><artifactId>missing</artifactId><version>7</version></parent>
+        <artifactId>app</artifactId>
+        <dependencies>%s%s%s</dependencies></project>""" % (
+            dependency_xml('org.acme', 'provided', '1', '<scope>provided</scope>'),
+            dependency_xml('org.acme', 'system', '1', '<scope>system</scope>'),
+            dependency_xml('junit', 'junit', '4.12', '<scope>test</scope>')))
+    model = repository.load(str(project.join('pom.xml')))
+    assert model['coords'] == ('com.me', 'app', '7')
+    assert repository.resolve(model) == [('org.acme', 'provided', '1'),
+                                         ('org.acme', 'system', '1')]
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import distutils
+import json
+import os
 
+from complic.scanner import base
 from complic.scanner.npm import Scanner
 
 
@@ -95,3 +98,183 @@ def test_valid_pkgjson(tmpdir):
     assert out[0].identifier == 'js:hello:1.0'
     assert 'GPLv2' in out[0].licenses
     assert 'MIT' in out[0].licenses
+
+
+def test_package_lock_v2(tmpdir):
+    project = tmpdir.mkdir("project")
+    project.join("package-lock.json").write(json.dumps({
+        "lockfileVersion": 2,
+        "packages": {
+            "": {"name": "app", "version": "1.0.0"},
+            "node_modules/left-pad": {"version": "1.3.0", "license": "WTFPL"},
+            "node_modules/@babel/core": {"version": "7.1.2", "license": "MIT"},
+            "node_modules/a/node_modules/left-pad": {"version": "1.3.0", "license": "WTFPL"},
+            "node_modules/nolicense": {"version": "2.0.0"},
+            "node_modules/broken": {"version": "0.0.1"},
+            "node_modules/linked": {"resolved": "packages/linked", "link": True},
+            "packages/linked": {"version": "0.1.0"},
+        },
+    }))
+    installed = project.mkdir("node_modules").mkdir("nolicense").join("package.json")
+    installed.write('{"name": "nolicense", "version": "2.0.0", "license": "ISC"}')
+    project.join("node_modules").mkdir("broken").join("package.json").write('{')
+
+    deps = Scanner().handle_package_lock(str(project.join("package-lock.json")))
+    assert [d.identifier for d in deps] == [
+        'js:@babel/core:7.1.2',
+        'js:broken:0.0.1',
+        'js:left-pad:1.3.0',
+        'js:nolicense:2.0.0',
+    ]
+    assert deps[0].licenses == set(['MIT'])
+    assert not deps[1].licenses
+    assert deps[3].licenses == set(['ISC'])
+
+def test_package_lock_v1_and_invalid(tmpdir):
+    project = tmpdir.mkdir("project")
+    lock = project.join("package-lock.json")
+    lock.write(json.dumps({
+        "lockfileVersion": 1,
+        "dependencies": {
+            "a": {"version": "1.0.0", "dependencies": {"b": {"version": "2.0.0"}}},
+        },
+    }))
+    installed = project.mkdir("node_modules").mkdir("b").join("package.json")
+    installed.write('{"name": "b", "version": "1.9.0", "license": "ISC"}')
+    deps = Scanner().handle_package_lock(str(lock))
+    assert [d.identifier for d in deps] == ['js:a:1.0.0', 'js:b:2.0.0']
+    assert not deps[1].licenses
+
+    # Not hoisted, installed in the node_modules of its parent instead
+    nested = project.join("node_modules").mkdir("a").mkdir("node_modules").mkdir("b")
+    nested.join("package.json").write('{"name": "b", "version": "2.0.0", "license": "MIT"}')
+    deps = Scanner().handle_package_lock(str(lock))
+    assert deps[1].licenses == set(['MIT'])
+    assert deps[1].package_dir == str(nested)
+
+    lock.write('bad json')
+    assert Scanner().handle_package_lock(str(lock)) == []
+
+def test_yarn_lock(tmpdir):
+    lock = tmpdir.mkdir("project").join("yarn.lock")
+    lock.write('''# yarn lockfile v1
+
+"@babel/core@^7.0.0", "@babel/core@^7.1.0":
+  version "7.1.2"
+  dependencies:
+    left-pad "^1.0.0"
+
+left-pad@^1.0.0:
+  version "1.3.0"
+
+__metadata:
+  version: 6
+
+"is-odd@npm:^3.0.0":
+  version: 3.0.1
+''')
+    node_modules = tmpdir.join("project").mkdir("node_modules")
+    node_modules.mkdir("left-pad").join("package.json").write(
+        '{"name": "left-pad", "version": "1.0.0", "license": "ISC"}')
+    nested = node_modules.mkdir("@babel").mkdir("core").mkdir("node_modules")
+    nested.mkdir("left-pad").join("package.json").write(
+        '{"name": "left-pad", "version": "1.3.0", "license": "WTFPL"}')
+    deps = Scanner().handle_yarn_lock(str(lock))
+    assert [d.identifier for d in deps] == [
+        'js:@babel/core:7.1.2',
+        'js:is-odd:3.0.1',
+        'js:left-pad:1.3.0',
+    ]
+    assert deps[2].licenses == set(['WTFPL'])
+
+def test_pnpm_lock(tmpdir):
+    lock = tmpdir.mkdir("project").join("pnpm-lock.yaml")
+    lock.write('''lockfileVersion: 5.4
+
+importers:
+  .:
+    specifiers:
+      left-pad: ^1.3.0
+
+packages:
+
+  /left-pad/1.3.0:
+    resolution: {integrity: sha512-abc/def==}
+    dev: false
+
+  /@babel/core/7.1.2_peer@1.0.0:
+    resolution: {integrity: sha512-abc/def==}
+
+  /is-odd@3.0.1(peer@1.0.0):
+    resolution: {integrity: sha512-abc/def==}
+
+  '@scope/pkg@2.0.0':
+    resolution: {integrity: sha512-abc/def==}
+''')
+    store = tmpdir.join("project").mkdir("node_modules").mkdir(".pnpm")
+    store.mkdir("left-pad@1.3.0").mkdir("node_modules").mkdir("left-pad") \
+        .join("package.json").write('{"name": "left-pad", "version": "1.3.0", "license": "WTFPL"}')
+    store.mkdir("@scope+pkg@2.0.0").mkdir("node_modules").mkdir("@scope").mkdir("pkg") \
+        .join("package.json").write('{"name": "@scope/pkg", "version": "2.0.0", "license": "MIT"}')
+    deps = Scanner().handle_pnpm_lock(str(lock))
+    assert [d.identifier for d in deps] == [
+        'js:@babel/core:7.1.2',
+        'js:@scope/pkg:2.0.0',
+        'js:is-odd:3.0.1',
+        'js:left-pad:1.3.0',
+    ]
+    assert [d.licenses for d in deps] == [set(), set(['MIT']), set(), set(['WTFPL'])]
+
+def test_pkgjson_skipped_with_lockfile(tmpdir):
+    project = tmpdir.mkdir("project")
+    project.join("yarn.lock").write('')
+    pkgjson = project.mkdir("node_modules").mkdir("a").join("package.json")
+    pkgjson.write('{"name": "a", "version": "1.0"}')
+    project.join("package.json").write('{"name": "app", "version": "1.0"}')
+    assert Scanner.handle_pkgjson(str(pkgjson)) == []
+    assert len(Scanner.handle_pkgjson(str(project.join("package.json")))) == 1
+
+def test_sniff():
+    assert Scanner.sniff('{"name": "a", "version": "1.0"}') == ('a', '1.0')
+    assert Scanner.sniff('{"name": "a"}') is None
+    assert Scanner.sniff('{"author": {"name": "me", "url": "x"}, '
+                         '"name": "a", "version": "1.0"}') == ('a', '1.0')
+    assert Scanner.sniff('{"author": {"name": "me"}, "version": "1.0"}') \
+        is None
+    assert Scanner.sniff('{"name": "a", "version": "1.0", "name": "b"}') \
+        is None
+
+def test_duplicate_pkgjson_not_parsed(tmpdir, mocker):
+    scanner = Scanner()
+    scanner.reset()
+    paths = []
+    for parent in ['x', 'y', 'z']:
+        pkgjson = tmpdir.mkdir(parent).mkdir("node_modules").mkdir("a").join("package.json")
+        pkgjson.write('{"name": "a", "version": "1.0", "license": "MIT"}')
+        paths.append(str(pkgjson))
+    mocker.spy(json, 'loads')
+    deps = [dep for path in paths for dep in Scanner.handle_pkgjson(path)]
+    assert json.loads.call_count == 1
+    assert [d.identifier for d in deps] == ['js:a:1.0'] * 3
+    assert [d.licenses for d in deps] == [set(['MIT'])] * 3
+    assert [d.path for d in deps] == paths
+    assert [d.package_dir for d in deps] == [os.path.dirname(p) for p in paths]
+    assert Scanner.stats['duplicate package.json parses avoided'] == 2
+    scanner.reset()
+    assert not Scanner.stats
+    assert not Scanner.manifests
+
+def test_duplicate_stats_from_workers(tmpdir, mocker):
+    mocker.patch.object(distutils.spawn, 'find_executable')
+    distutils.spawn.find_executable.return_value = True
+    mocker.patch.object(base, 'CHUNK_SIZE', 2)
+    paths = []
+    for parent in range(6):
+        pkgjson = tmpdir.mkdir(str(parent)).join("package.json")
+        pkgjson.write('{"name": "a%i", "version": "1.0"}' % (parent // 2))
+        paths.append(str(pkgjson))
+    scanner = Scanner()
+    deps = base.Dispatcher([scanner], processes=2).scan(paths)
+    assert len(deps) == 6
+    # Each chunk of 2 is parsed by a worker, the second one is a duplicate
+    assert scanner.stats == {'duplicate package.json parses avoided': 3}
@@ -1,10 +1,21 @@
 #!/usr/bin/env python
 
+import atexit
 import distutils
+import distutils.core
+import io
 import os
+import shutil
+import tarfile
+import zipfile
 
+import setuptools
+
+from complic.utils import cache
 from complic.utils import shell
 from complic.utils import fs
+from complic.scanner import base
+from complic.scanner import setup_probe
 from complic.scanner.python import Scanner
 
 
@@ -76,59 +87,386 @@ setuptools.setup()
     assert not out
 
 def test_pip_install_ok(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
     mocker.patch.object(shell, 'cmd')
     shell.cmd.return_value = (0, '', '')
-    p = tmpdir.mkdir("project").join("setup.py")
-    setuppy = str(p.realpath())
+    setuppy = write_project(tmpdir, "")
+
+    env_dir = Scanner.pip_install(setuppy, ['an_extra'])
+    assert os.path.isdir(env_dir)
+    assert os.path.dirname(env_dir) == cache.get_dir('pipenv')
+    command = shell.cmd.call_args[0][0]
+    assert command.startswith("pip install --ignore-installed --target ")
+    assert command.endswith(" .[an_extra]")
+    assert shell.cmd.call_args[1]['cwd'] == os.path.dirname(setuppy)
+
+    # Same requirements, the environment is reused
+    assert Scanner.pip_install(setuppy, ['an_extra']) == env_dir
+    assert shell.cmd.call_count == 1
+
+    # Anything changing the requirements means a new environment
+    assert Scanner.pip_install(setuppy) != env_dir
+    tmpdir.join("project", "requirements-dev.txt").write("pytest")
+    assert Scanner.pip_install(setuppy, ['an_extra']) != env_dir
+    assert shell.cmd.call_count == 3
+
+def test_pip_install_without_cache(tmpdir, mocker):
+    mocker.patch.object(Scanner, 'temporary', None)
+    mocker.patch.object(atexit, 'register')
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.return_value = (0, '', '')
+    setuppy = write_project(tmpdir, "")
 
-    expected = "PYTHONUSERBASE='%s' " % (os.path.dirname(setuppy))
-    expected += "pip install --ignore-installed .[an_extra]"
-    assert Scanner.pip_install(setuppy, ['an_extra']) == True
-    assert shell.cmd.called_once_with(expected)
+    env_dir = Scanner.pip_install(setuppy)
+    environments = os.path.dirname(env_dir)
+    assert environments == Scanner.temporary
+    assert environments != cache.get_dir('pipenv')
+    assert os.path.basename(environments).startswith('complic-pipenv-')
+    assert Scanner.pip_install(setuppy) == env_dir
+    assert shell.cmd.call_count == 1
+    # Gone when complic exits
+    atexit.register.assert_called_once_with(shutil.rmtree, environments, True)
+    shutil.rmtree(environments)
 
 def test_pip_install_error(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
     mocker.patch.object(shell, 'cmd')
     shell.cmd.return_value = (1, '', '')
-    p = tmpdir.mkdir("project").join("setup.py")
-    setuppy = str(p.realpath())
+    setuppy = write_project(tmpdir, "")
+
+    assert Scanner.pip_install(setuppy) is None
+    assert os.listdir(cache.get_dir('pipenv')) == []
+
+def test_pip_install_concurrent(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
+    setuppy = write_project(tmpdir, "")
+    env_dir = os.path.join(cache.get_dir('pipenv'),
+                           Scanner.get_environment_key(setuppy))
+
+    def build_elsewhere(command, **kwargs):
+        os.makedirs(os.path.join(env_dir, 'package'))
+        return 0, '', ''
+    mocker.patch.object(shell, 'cmd', side_effect=build_elsewhere)
 
-    assert Scanner.pip_install(setuppy) == False
+    assert Scanner.pip_install(setuppy) == env_dir
+    assert os.listdir(cache.get_dir('pipenv')) == [os.path.basename(env_dir)]
 
+def test_evict_environments(mocker):
+    mocker.patch.object(Scanner, 'ENVIRONMENTS_SIZE', 25)
+    environments = cache.get_dir('pipenv')
+    for age, name in enumerate(['current', 'new', 'old', 'older', '.build']):
+        env = os.path.join(environments, name)
+        os.makedirs(env)
+        with open(os.path.join(env, 'METADATA'), 'w') as metadata:
+            metadata.write('x' * 10)
+        os.utime(env, (1000 - age, 1000 - age))
+
+    Scanner.evict_environments(environments,
+                               os.path.join(environments, 'current'))
+    assert sorted(os.listdir(environments)) == ['.build', 'current', 'new']
 
 def test_handle_setuppy_happy_path(tmpdir, mocker):
 
     mocker.patch.object(Scanner, 'get_extra_requirements')
     Scanner.get_extra_requirements.return_value = 'a_requirement'
 
+    env_dir = tmpdir.mkdir("env")
     mocker.patch.object(Scanner, 'pip_install')
-    Scanner.pip_install.return_value = True
-
-    #mocker.patch.object(fs, 'Find')
-    #fs.Find.return_value.files = ['/something/bad', '/a/PKG-INFO', '/b/METADATA']
+    Scanner.pip_install.return_value = str(env_dir)
 
     somedir = tmpdir.mkdir("project")
     random_file = somedir.join("randomfile")
     random_file.write('aaaa')
     pkg_info = somedir.join("PKG-INFO")
     pkg_info.write("Name: xxx\nVersion: 2.0.1\nLicense: GPLv2\n")
-    metadata = somedir.join("METADATA")
+    metadata = env_dir.mkdir("aaa-1.0.0.dist-info").join("METADATA")
     metadata.write("Name: aaa\nVersion: 1.0.0\nLicense: Unlicense\n")
     setuppy = somedir.join("setup.py")
     setuppy = str(setuppy.realpath())
 
-    deps = Scanner.handle_setuppy(setuppy)
+    deps = Scanner().handle_setuppy(setuppy)
 
     assert len(deps) == 2
     for d in deps:
         assert d.identifier in ['python:xxx:2.0.1', 'python:aaa:1.0.0']
         assert list(d.licenses)[0] in ['GPLv2', 'Unlicense']
 
+def test_handle_setuppy_streaming(tmpdir, mocker):
+    """The setup.py comes up before the rest of the project is walked, the
+    results must not depend on it (nor on --jobs) and the project must not
+    be walked again to find them."""
+    mocker.patch.object(shell, 'which', return_value='/usr/bin/pip')
+    mocker.patch.object(Scanner, 'get_extra_requirements', return_value=[])
+    mocker.patch.object(Scanner, 'pip_install',
+                        return_value=str(tmpdir.mkdir("env")))
+    setuppy = write_project(tmpdir, "")
+    project = tmpdir.join("project")
+    project.mkdir("src").mkdir("foo.egg-info").join("PKG-INFO").write(
+        "Name: foo\nVersion: 1.0\nLicense: MIT\n")
+
+    mocker.spy(fs, 'listdir')
+    for jobs in [1, 2]:
+        fs.listdir.reset_mock()
+        deps = base.Dispatcher([Scanner()], jobs).scan(fs.Find(str(project)))
+        assert [d.identifier for d in deps] == ['python:foo:1.0']
+        listed = [call[0][0] for call in fs.listdir.call_args_list]
+        assert sorted(listed) == sorted(set(listed))
+        assert str(project.join("src")) in listed
+
 def test_handle_setuppy_error_pipinstall(tmpdir, mocker):
 
     mocker.patch.object(Scanner, 'get_extra_requirements')
     Scanner.get_extra_requirements.return_value = 'a_requirement'
 
     mocker.patch.object(Scanner, 'pip_install')
-    Scanner.pip_install.return_value = False
+    Scanner.pip_install.return_value = None
+
+    assert not Scanner().handle_setuppy('fake')
+
+def write_project(tmpdir, setuppy, **files):
+    project = tmpdir.mkdir("project")
+    project.join("setup.py").write(setuppy)
+    for name, content in files.items():
+        project.join(name).write(content)
+    return str(project.join("setup.py"))
+
+def test_parse_setup_py(tmpdir):
+    setuppy = write_project(tmpdir, """from setuptools import setup
+setup(name='x', extras_require={'b': ['y'], 'a': ['z' + 'w']})
+""")
+    assert Scanner.parse_setup_py(setuppy) == ['a', 'b']
+
+def test_parse_setup_py_needs_execution(tmpdir):
+    cases = [
+        "setup(**kwargs)",
+        "setup(extras_require=get_extras())",
+        "setup(extras_require={NAME: []})",
+        "extras = {}",
+        "setup(",
+    ]
+    for number, case in enumerate(cases):
+        p = tmpdir.join("setup%i.py" % (number))
+        p.write(case)
+        assert Scanner.parse_setup_py(str(p)) is None
+
+def test_extras_from_setup_cfg_and_pyproject(tmpdir, mocker):
+    mocker.patch.object(shell, 'cmd')
+    setuppy = write_project(tmpdir, "import setuptools\nsetuptools.setup()\n",
+                            **{'setup.cfg': """[metadata]
+name = x
+[options.extras_require]
+Security = pyopenssl
+socks = pysocks
+""", 'pyproject.toml': """[project]
+name = "x"
+dependencies = ["requests"]
+
+[project.optional-dependencies]
+docs = ["sphinx"]
+"dev-tools" = [
+    "pytest",
+]
+test = [
+    "pytest==7.0",  # [pinned]
+    'mock>=2; python_version < "3"', [
+    "nested"],
+]
+
+[tool.black]
+line-length = 80
+"""})
+    assert Scanner.get_extra_requirements(setuppy) == \
+        ['dev-tools', 'docs', 'security', 'socks', 'test']
+    assert not shell.cmd.called
+
+def test_parse_setup_cfg_invalid(tmpdir):
+    p = tmpdir.join("setup.cfg")
+    p.write("no section header\n")
+    assert Scanner.parse_setup_cfg(str(p)) == []
+    p.write("[metadata]\nname = x\n")
+    assert Scanner.parse_setup_cfg(str(p)) == []
+
+def test_probe_setup_py(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
+    setuppy = write_project(tmpdir, """import setuptools
+import os
+print('noise')
+extras = dict((name, []) for name in ['one', 'two'])
+setuptools.setup(extras_require=extras)
+""")
+    assert Scanner.get_extra_requirements(setuppy) == ['one', 'two']
+
+    # Cached by contents, no need to execute again
+    mocker.patch.object(shell, 'cmd')
+    assert Scanner.probe_setup_py(setuppy) == ['one', 'two']
+    assert not shell.cmd.called
+
+def test_probe_setup_py_without_cache(tmpdir, mocker):
+    # Quotes in the path don't get in the way
+    project = tmpdir.mkdir("it's \"here\"")
+    project.join("setup.py").write(
+        "import setuptools\nsetuptools.setup(extras_require={'one': []})\n")
+    setuppy = str(project.join("setup.py"))
+    mocker.spy(shell, 'cmd')
+    for _ in range(2):
+        assert Scanner.probe_setup_py(setuppy) == ['one']
+    assert shell.cmd.call_count == 2
+    assert not os.path.exists(os.path.join(cache.CACHE_DIR, 'setup-probe'))
+
+def test_probe_setup_py_errors(tmpdir, mocker):
+    setuppy = write_project(tmpdir, "setup(**kwargs)")
+    mocker.patch.object(shell, 'cmd')
+    shell.cmd.return_value = (1, '', 'NameError')
+    assert Scanner.get_extra_requirements(setuppy) == []
+    shell.cmd.return_value = (0, 'garbage', '')
+    assert Scanner.get_extra_requirements(setuppy) == []
+    assert shell.cmd.call_count == 2
+
+def test_setup_probe(tmpdir, mocker):
+    mocker.patch.object(setuptools, 'setup')
+    mocker.patch.object(distutils.core, 'setup')
+    p = tmpdir.join("setup.py")
+    p.write("from distutils.core import setup\nsetup(extras_require={'x': []})")
+    assert setup_probe.probe(str(p)) == {'extras_require': ['x']}
+    p.write("from distutils.core import setup\nsetup(name='x')")
+    assert setup_probe.probe(str(p)) == {'extras_require': []}
+
+METADATA = b"""Metadata-Version: 2.1
+Name: requests
+Version: 2.19.1
+License: Apache 2.0
+
+License: not really, this is the description
+"""
+
+def make_tarball(path, members):
+    with tarfile.open(path, 'w:gz') as tarball:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tarball.addfile(info, io.BytesIO(content))
+
+def test_handle_wheel(tmpdir):
+    wheel = str(tmpdir.join("requests-2.19.1-py2.py3-none-any.whl"))
+    with zipfile.ZipFile(wheel, 'w') as archive:
+        archive.writestr('requests/__init__.py', '')
+        archive.writestr('requests-2.19.1.dist-info/METADATA', METADATA)
+
+    # Only read from wheelhouses
+    assert Scanner().scan([wheel]) == []
+    deps = Scanner(wheelhouses=[str(tmpdir)]).scan([wheel])
+    assert len(deps) == 1
+    assert deps[0].identifier == 'python:requests:2.19.1'
+    assert deps[0].licenses == set(['Apache 2.0'])
+    assert os.listdir(str(tmpdir)) == [os.path.basename(wheel)]
+
+def test_handle_wheel_errors(tmpdir):
+    wheel = tmpdir.join("broken.whl")
+    wheel.write("not a zip")
+    assert Scanner.handle_wheel(str(wheel)) == []
+    with zipfile.ZipFile(str(wheel), 'w') as archive:
+        archive.writestr('requests/__init__.py', '')
+    assert Scanner.handle_wheel(str(wheel)) == []
+    with zipfile.ZipFile(str(wheel), 'w') as archive:
+        archive.writestr('x-1.0.dist-info/METADATA', 'Name: x\n')
+    assert Scanner.handle_wheel(str(wheel)) == []
+    # No License header (License-Expression, classifiers...): no license
+    with zipfile.ZipFile(str(wheel), 'w') as archive:
+        archive.writestr('x-1.0.dist-info/METADATA',
+                         'Name: x\nVersion: 1.0\nLicense-Expression: MIT\n')
+    deps = Scanner.handle_wheel(str(wheel))
+    assert [d.identifier for d in deps] == ['python:x:1.0']
+    assert not deps[0].licenses
+
+def test_handle_sdist(tmpdir):
+    tarball = str(tmpdir.join("requests-2.19.1.tar.gz"))
+    make_tarball(tarball, [
+        ('requests-2.19.1/setup.py', b''),
+        ('requests-2.19.1/PKG-INFO', METADATA),
+    ])
+    sdist_zip = str(tmpdir.join("requests-2.19.1.zip"))
+    with zipfile.ZipFile(sdist_zip, 'w') as archive:
+        archive.writestr('requests-2.19.1/PKG-INFO', METADATA)
+
+    for path in [tarball, sdist_zip]:
+        deps = Scanner.handle_sdist(path)
+        assert deps[0].identifier == 'python:requests:2.19.1'
+        assert deps[0].licenses == set(['Apache 2.0'])
+
+def test_handle_sdist_not_python(tmpdir):
+    tarball = str(tmpdir.join("backup.tar.gz"))
+    make_tarball(tarball, [('backup/nested/PKG-INFO', METADATA)])
+    assert Scanner.handle_sdist(tarball) == []
+    broken = tmpdir.join("broken.tgz")
+    broken.write("not a tarball")
+    assert Scanner.handle_sdist(str(broken)) == []
+
+def make_site_packages(root):
+    site_packages = root.mkdir("lib").mkdir("python3.6").mkdir("site-packages")
+    site_packages.mkdir("requests-2.19.1.dist-info").join("METADATA").write(
+        METADATA)
+    site_packages.mkdir("six-1.11.0.egg-info").join("PKG-INFO").write(
+        "Name: six\nVersion: 1.11.0\nLicense: MIT\n")
+    site_packages.join("argparse-1.2.1.egg-info").write(
+        "Name: argparse\nVersion: 1.2.1\nLicense: Python Software Foundation\n")
+    site_packages.mkdir("broken-1.0.dist-info")
+    site_packages.mkdir("requests").join("__init__.py").write("")
+    return str(site_packages)
+
+def test_find_site_packages(tmpdir):
+    project = tmpdir.mkdir("project")
+    assert Scanner.find_site_packages(str(project)) is None
+    windows = project.mkdir("venv").mkdir("Lib").mkdir("site-packages")
+    assert Scanner.find_site_packages(str(project)) == str(windows)
+    site_packages = make_site_packages(project.mkdir(".venv"))
+    assert Scanner.find_site_packages(str(project)) == site_packages
+
+def test_scan_site_packages(tmpdir):
+    site_packages = make_site_packages(tmpdir)
+    deps = Scanner.scan_site_packages(site_packages)
+    assert [(d.identifier, d.licenses) for d in deps] == [
+        ('python:requests:2.19.1', set(['Apache 2.0'])),
+        ('python:six:1.11.0', set(['MIT'])),
+        ('python:argparse:1.2.1', set(['Python Software Foundation'])),
+    ]
+    assert [d.package_dir for d in deps] == [
+        os.path.join(site_packages, 'requests-2.19.1.dist-info'),
+        os.path.join(site_packages, 'six-1.11.0.egg-info'),
+        None,
+    ]
+
+def test_handle_setuppy_site_packages(tmpdir, mocker):
+    mocker.patch.object(distutils.spawn, 'find_executable')
+    distutils.spawn.find_executable.return_value = None
+    mocker.patch.object(Scanner, 'pip_install')
+    site_packages = make_site_packages(tmpdir.mkdir("env"))
+    setuppy = write_project(tmpdir, "")
+
+    deps = Scanner(site_packages).scan([setuppy])
+    assert len(deps) == 3
+    # Once per scan, however many setup.py there are
+    other = write_project(tmpdir.mkdir("other"), "")
+    assert len(Scanner(site_packages).scan([setuppy, other])) == 3
+    # Even without any
+    assert len(Scanner(site_packages).scan([])) == 3
+
+    tmpdir.join("project").mkdir(".venv").mkdir("Lib").mkdir("site-packages")
+    assert Scanner().handle_setuppy(setuppy) == []
+    assert not Scanner.pip_install.called
+
+def test_virtualenv_without_setuppy(tmpdir, mocker):
+    mocker.patch.object(distutils.spawn, 'find_executable')
+    distutils.spawn.find_executable.return_value = None
+    project = tmpdir.mkdir("project")
+    site_packages = make_site_packages(project.mkdir(".venv"))
+    project.join(".venv").join("pyvenv.cfg").write("home = /usr/bin\n")
+    tox = project.mkdir(".tox").mkdir("py36")
+    make_site_packages(tox)
+    tox.join("pyvenv.cfg").write("home = /usr/bin\n")
+    empty = project.mkdir("venv")
+    empty.join("pyvenv.cfg").write("home = /usr/bin\n")
 
-    assert not Scanner.handle_setuppy('fake')
+    deps = Scanner().scan(fs.Find(str(project)))
+    assert sorted(d.identifier for d in deps) == [
+        'python:argparse:1.2.1', 'python:requests:2.19.1', 'python:six:1.11.0']
+    assert all(d.path.startswith(site_packages) for d in deps)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os
+
+from complic.licenses import text
+
+
+def reference(lic):
+    with open(os.path.join(text.TEXTS, lic + '.txt'), 'r') as license_file:
+        return license_file.read()
+
+def shipped(lic, holder='Jane Doe'):
+    """A reference text the way a package would ship it: with an actual
+    copyright line and wrapped differently."""
+    contents = reference(lic).replace('Copyright (c) <year> <copyright holders>',
+                                      'Copyright (c) 2018 ' + holder)
+    return contents.replace(',\n', ',\n\n').replace('.\n', '. ')
+
+def real(name):
+    """A license the way some package actually ships it (tests/licenses)."""
+    path = os.path.join(os.path.dirname(__file__), 'licenses', name)
+    with open(path, 'r') as license_file:
+        return license_file.read()
+
+def variant(text, old, new):
+    assert old in text
+    return text.replace(old, new)
+
+def test_tokenize():
+    assert text.tokenize('The MIT-License\n2018,') == ['the', 'mit', 'license',
+                                                       '2018']
+    assert text.tokenize('Copyright (c) 2018 Jane\nAll rights reserved.\n'
+                         'Portions copyright 2017 Joe\n\xa9 2016 Jim\n'
+                         'Keep the above copyright notice.\nCOPYRIGHT HOLDERS'
+                         ' ARE NOT LIABLE\n<year> <copyright holders>') == \
+        ['keep', 'the', 'above', 'copyright', 'notice', 'copyright',
+         'holders', 'are', 'not', 'liable']
+    assert len(text.tokenize('Copyright (c) 2018 ' + 'word ' * 100)) == 103
+    assert text.tokenize('The MIT License (MIT)\n\nCopyright 2018 Jane\n'
+                         'Permission') == ['permission']
+    assert text.tokenize('1. Keep it\n  (b) Share it\n* Credit us\n'
+                         '2018 was 2. great') == \
+        ['keep', 'it', 'share', 'it', 'credit', 'us', '2018', 'was', '2',
+         'great']
+    assert text.tokenize('IN NO EVENT SHALL THE REGENTS OR CONTRIBUTORS BE '
+                         'LIABLE') == \
+        text.tokenize('In no event shall the author be liable')
+    assert text.tokenize('END OF TERMS AND CONDITIONS\nAPPENDIX') == \
+        ['end', 'of', 'terms', 'and', 'conditions']
+
+def test_trim():
+    assert text.trim([1, 2, 3, 4, 5], set([2, 4])) == set([2, 3, 4])
+    assert text.trim([1, 2], set([3])) == set()
+
+def test_shingles():
+    assert len(text.shingles('a b c d e f', 5)) == 2
+    assert len(text.shingles('a b', 5)) == 1
+    assert text.shingles('a b c d e', 5) == text.shingles('A, b. C d-e', 5)
+    assert text.shingles('...', 5) == set()
+
+def test_similarity():
+    assert text.similarity(set([1, 2]), set([2, 3])) == 1.0 / 3
+    assert text.similarity(set(), set([1])) == 0.0
+
+def test_identify():
+    detector = text.Detector()
+    for lic in ['MIT', 'ISC', 'BSD-2-CLAUSE', 'BSD-3-CLAUSE', 'APACHE-2.0',
+                'GPL-2.0', 'LGPL-2.1', 'MPL-2.0']:
+        found, confidence = detector.identify(shipped(lic))
+        assert found == lic
+        assert confidence > detector.MIN_CONFIDENCE
+    assert detector.identify(reference('MIT')) == ('MIT', 1.0)
+
+def test_identify_near_variants():
+    """Licenses a clause apart are told apart, or not identified at all."""
+    detector = text.Detector()
+    for lic in ['BSD-4-CLAUSE', 'JSON', 'MIT-0', 'BSD-2-CLAUSE-PATENT',
+                'LGPL-2.0', 'GPL-3.0', 'LGPL-3.0']:
+        assert detector.identify(shipped(lic))[0] == lic
+
+    mit = shipped('MIT')
+    assert detector.identify(variant(
+        mit, 'furnished to do so, subject to the following conditions:',
+        'furnished to do so, subject to the following conditions: '
+        'the Software shall not be used in weapons of any kind.')) is None
+    bsd = reference('BSD-3-CLAUSE')
+    assert detector.identify(variant(
+        bsd, 'this software without specific prior written permission.',
+        'this software without specific prior written permission.\n\n'
+        '4. All advertising materials mentioning features or use of this '
+        'software must display: This product includes software developed '
+        'by the University of California, Berkeley.')) is None
+
+def test_identify_real_variants():
+    """Holders, titles, preambles and appendices vary from copy to copy."""
+    detector = text.Detector()
+    for name in ['APACHE-2.0-no-appendix', 'BSD-3-CLAUSE-google',
+                 'BSD-3-CLAUSE-regents', 'ISC-authors', 'MIT-preamble']:
+        found, confidence = detector.identify(real(name))
+        assert name.startswith(found + '-')
+        assert confidence > detector.MIN_CONFIDENCE
+    # Text around the license doesn't count, text inside it does
+    mit = real('MIT-preamble')
+    assert detector.identify('Some title\n\n' + mit + '\n\nSome footer')[0] \
+        == 'MIT'
+    assert detector.identify(variant(
+        mit, 'subject to the following conditions:',
+        'subject to the following conditions: no use by the military.')) \
+        is None
+
+def test_identify_unrelated():
+    detector = text.Detector()
+    assert detector.identify('') is None
+    assert detector.identify('This software belongs to ACME, do not copy '
+                             'it or even look at it without our consent.') \
+        is None
+    # Some BSD-3 clauses aren't enough
+    partial = ' '.join(shipped('BSD-3-CLAUSE').split()[:60])
+    assert detector.identify(partial) is None
+
+def test_index_is_lazy(tmpdir):
+    tmpdir.join('MIT.txt').write(reference('MIT'))
+    tmpdir.join('README').write(reference('ISC'))
+    detector = text.Detector(str(tmpdir))
+    assert detector._index is None
+    assert detector.identify(shipped('ISC')) is None
+    assert sorted(detector.index['shingles']) == ['MIT']
+    assert detector.identify(shipped('MIT'))[0] == 'MIT'
+
+def test_license_files(tmpdir):
+    for name in ['LICENSE', 'license.md', 'LICENCE-MIT', 'COPYING.txt',
+                 'NOTICE', 'README.md', 'licenses.py', 'index.js']:
+        tmpdir.join(name).write('')
+    tmpdir.mkdir('LICENSES')
+    assert [os.path.basename(path) for path in text.license_files(str(tmpdir))] \
+        == ['COPYING.txt', 'LICENCE-MIT', 'LICENSE', 'NOTICE', 'license.md']
+    assert text.license_files(str(tmpdir.join('missing'))) == []
+
+def test_scan(tmpdir):
+    tmpdir.join('LICENSE-MIT').write(shipped('MIT'))
+    tmpdir.join('LICENSE-APACHE').write(shipped('APACHE-2.0'))
+    tmpdir.join('COPYING').write(shipped('MIT', 'Someone Else'))
+    tmpdir.join('NOTICE').write('This product includes software by ACME.')
+    detector = text.Detector()
+    found = detector.scan(str(tmpdir))
+    assert sorted(found) == ['APACHE-2.0', 'MIT']
+    assert detector.stats == {'license files identified': 3,
+                              'license files unidentified': 1}
+    assert detector.scan(str(tmpdir.join('missing'))) == {}
+
+def test_identify_file_unreadable(tmpdir):
+    detector = text.Detector()
+    assert detector.identify_file(str(tmpdir.join('LICENSE'))) is None
+    assert not detector.stats
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import os
+
+from complic.utils import cache
+
+
+def test_get_dir_creates(cache_dir):
+    path = cache.get_dir('some', 'namespace')
+    assert path == os.path.join(cache_dir, 'some', 'namespace')
+    assert os.path.isdir(path)
+    assert cache.get_dir('some', 'namespace') == path
+
+def test_digest_stable():
+    assert cache.digest('a', 'b') == cache.digest(u'a', u'b')
+    assert cache.digest('a', 'b') != cache.digest('ab')
+
+def test_file_digest(tmpdir):
+    a = tmpdir.join('a')
+    a.write('hello')
+    b = tmpdir.join('b')
+    b.write('hello')
+    assert cache.file_digest(str(a)) == cache.file_digest(str(b))
+
+def test_store_roundtrip(cache_dir):
+    store = cache.Store('test')
+    assert store.get('key') is None
+    assert store.get('key', {}) == {}
+    store.set('key', {'hello': ['world']})
+    assert cache.Store('test').get('key') == {'hello': ['world']}
+
+def test_store_corrupted_entry(cache_dir):
+    store = cache.Store('test')
+    with open(store.path('key'), 'w') as entry:
+        entry.write('not json')
+    assert store.get('key', 'default') == 'default'
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+
+import pytest
+
+from complic.utils import fs
+
+
+def make_tree(tmpdir):
+    root = tmpdir.mkdir("project")
+    root.join("pom.xml").write("")
+    root.mkdir(".git").join("config").write("")
+    root.mkdir("node_modules").mkdir("left-pad").join("package.json").write("")
+    root.mkdir("src").mkdir("main").join("App.java").write("")
+    return str(root.realpath())
+
+
+def test_find_ignores_git(tmpdir):
+    root = make_tree(tmpdir)
+    files = fs.Find(root).files
+    assert os.path.join(root, 'pom.xml') in files
+    assert os.path.join(root, 'src', 'main', 'App.java') in files
+    assert os.path.join(root, 'node_modules', 'left-pad', 'package.json') in files
+    assert not [f for f in files if '.git' in f]
+
+
+def test_find_prunes_globs(tmpdir, mocker):
+    root = make_tree(tmpdir)
+    mocker.spy(fs, 'listdir')
+    files = fs.Find(root, ['.git', 'node_*']).files
+    assert len(files) == 2
+    listed = [call[0][0] for call in fs.listdir.call_args_list]
+    assert os.path.join(root, 'node_modules') not in listed
+    assert os.path.join(root, '.git') not in listed
+
+
+def test_find_streams_and_replays(tmpdir, mocker):
+    root = make_tree(tmpdir)
+    finder = fs.Find(root)
+    mocker.spy(fs, 'listdir')
+    first = next(iter(finder))
+    assert first
+    assert fs.listdir.call_count == 1
+    files = list(finder)
+    assert fs.listdir.call_count > 1
+    calls = fs.listdir.call_count
+    assert list(finder) == files
+    assert fs.listdir.call_count == calls
+
+
+def test_walk_unreadable_directory(tmpdir):
+    assert list(fs.walk(str(tmpdir.join('doesntexist')))) == []
+
+
+def test_tree_cache_reuses_unchanged(tmpdir, mocker):
+    root = make_tree(tmpdir)
+
+    tree_cache = fs.TreeCache(root)
+    files = fs.Find(root, tree_cache=tree_cache).files
+    assert tree_cache.hits == 0
+
+    mocker.spy(fs, 'listdir')
+    tree_cache = fs.TreeCache(root)
+    assert fs.Find(root, tree_cache=tree_cache).files == files
+    assert fs.listdir.call_count == 0
+
+    new_dir = os.path.join(root, 'src', 'main')
+    open(os.path.join(new_dir, 'Other.java'), 'w').close()
+    os.utime(new_dir, (0, 12345))
+    tree_cache = fs.TreeCache(root)
+    out = fs.Find(root, tree_cache=tree_cache).files
+    assert os.path.join(new_dir, 'Other.java') in out
+    assert fs.listdir.call_count == 1
+
+
+def test_tree_cache_parallel_hits(tmpdir):
+    root = tmpdir.mkdir("tree")
+    for i in range(50):
+        root.mkdir("d%02i" % i)
+    root = str(root)
+    fs.Find(root, tree_cache=fs.TreeCache(root), jobs=4).files
+    tree_cache = fs.TreeCache(root)
+    list(fs.parallel_walk(root, lister=tree_cache.listdir, jobs=4))
+    assert tree_cache.hits == 51
+
+
+def test_parallel_find_same_order(tmpdir):
+    root = tmpdir.mkdir("deep")
+    for i in range(5):
+        level = root
+        for j in range(4):
+            level = level.mkdir("d%i_%i" % (i, j))
+            level.join("file%i" % j).write("")
+    root.mkdir(".git").join("config").write("")
+    root = str(root.realpath())
+    assert fs.Find(root, jobs=4).files == fs.Find(root).files
+    assert len(fs.Find(root, jobs=4).files) == 20
+
+
+def test_parallel_walk_unreadable_and_early_exit(tmpdir):
+    assert list(fs.parallel_walk(str(tmpdir.join('doesntexist')))) == []
+    root = make_tree(tmpdir)
+    walker = fs.parallel_walk(root, jobs=2)
+    assert next(walker)[0] == root
+    walker.close()
+
+
+def test_parallel_walk_bounded(tmpdir, mocker):
+    """Threads list a few directories ahead of the consumer, no more."""
+    mocker.patch.object(fs, 'AHEAD', 2)
+    for i in range(20):
+        tmpdir.mkdir("d%02i" % i).join("file").write("")
+    root = str(tmpdir)
+    listed = []
+    # The consumer catches up with the thread listing d01
+    slow = threading.Event()
+    def lister(directory):
+        listed.append(directory)
+        if directory.endswith('d01'):
+            slow.wait()
+        return fs.listdir(directory)
+    walker = fs.parallel_walk(root, lister=lister, jobs=2)
+    assert next(walker)[0] == root
+    deadline = time.time() + 5
+    while len(listed) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert len(listed) == 5
+    threading.Timer(0.1, slow.set).start()
+    assert list(walker) == list(fs.walk(root))[1:]
+    assert sorted(listed) == sorted(set(listed))
+
+
+def test_parallel_walk_raises_lister_errors(tmpdir):
+    root = make_tree(tmpdir)
+    def lister(directory):
+        if directory.endswith('src'):
+            raise ValueError("bad listing")
+        return fs.listdir(directory)
+    for walker in [fs.walk, fs.parallel_walk]:
+        with pytest.raises(ValueError):
+            list(walker(root, lister=lister))
+
+def test_index_subtree_queries():
+    index = fs.Index([
+        '/a/b/pom.xml',
+        '/a/b/target/THIRD-PARTY.txt',
+        '/a/bc/pom.xml',
+        '/a/pom.xml',
+    ])
+    index.add('/a/b/sub/pom.xml')
+    index.add('/a/b/sub/pom.xml')
+    assert len(index) == 5
+    assert index.subtree('/a/b') == [
+        '/a/b/pom.xml',
+        '/a/b/sub/pom.xml',
+        '/a/b/target/THIRD-PARTY.txt',
+    ]
+    assert index.find('/a/', ['pom.xml']) == [
+        '/a/b/pom.xml',
+        '/a/b/sub/pom.xml',
+        '/a/bc/pom.xml',
+        '/a/pom.xml',
+    ]
+    assert index.find('/z', ['pom.xml']) == []
+
+
+def test_index_refresh(tmpdir):
+    root = make_tree(tmpdir)
+    index = fs.Index(fs.Find(root))
+    target = os.path.join(root, 'src')
+    assert index.find(target, ['App.java'])
+
+    os.remove(os.path.join(target, 'main', 'App.java'))
+    open(os.path.join(target, 'THIRD-PARTY.txt'), 'w').close()
+    index.refresh(target)
+    assert not index.find(root, ['App.java'])
+    assert index.find(root, ['THIRD-PARTY.txt']) == [
+        os.path.join(target, 'THIRD-PARTY.txt')]
+    assert index.find(root, ['pom.xml'])
+
+def test_chdir(tmpdir):
+    cwd = os.getcwd()
+    with fs.chdir(str(tmpdir)) as new_dir:
+        assert os.getcwd() == os.path.realpath(new_dir)
+    assert os.getcwd() == cwd
+
+def test_disk_usage(tmpdir):
+    root = make_tree(tmpdir)
+    tmpdir.join("project", "pom.xml").write("x" * 10)
+    tmpdir.join("project", ".git", "config").write("x" * 5)
+    assert fs.disk_usage(root) == 15
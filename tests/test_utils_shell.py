@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
-from complic.utils import shell
+import os
+
+from complic.utils import cache, shell
 
 def test_command_ok():
     rc, out, err = shell.cmd(u'ls')
@@ -13,3 +15,102 @@ def test_command_nok():
     assert rc != 0
     assert not out
     assert err
+
+def test_command_cwd(tmpdir):
+    tmpdir.join('somefile').write('')
+    rc, out, err = shell.cmd('ls', cwd=str(tmpdir))
+    assert rc == 0
+    assert 'somefile' in out
+
+def test_run_streams_lines():
+    lines = []
+    rc, out, err, timed_out = shell.run("sh -c 'echo one; echo two; echo x >&2'",
+                                        on_stdout=lines.append)
+    assert rc == 0
+    assert lines == [b'one\n', b'two\n']
+    assert out == b''
+    assert err == b'x\n'
+    assert not timed_out
+
+def test_timeout_kills_process_group(mocker):
+    mocker.patch.object(shell, 'TIMEOUT', 0.2)
+    # The child keeps the pipe open, it has to be killed as well
+    rc, out, err = shell.cmd("sh -c 'sleep 30 & echo started; wait'")
+    assert rc != 0
+    assert out == b'started\n'
+    rc, out, err, timed_out = shell.run("sleep 30", timeout=0.1)
+    assert timed_out
+
+def test_limits_per_tool(mocker):
+    mocker.patch.dict(shell.LIMITS, {'true': 1})
+    mocker.patch.dict(shell._semaphores, clear=True)
+    semaphore = shell.get_semaphore('true')
+    assert shell.get_semaphore('true') is semaphore
+    assert shell.get_semaphore('ls') is not semaphore
+    assert semaphore.acquire(False)
+    semaphore.release()
+    assert shell.cmd('true')[0] == 0
+
+def test_cache_replays(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
+    source = tmpdir.join('input')
+    source.write('1')
+    output = tmpdir.join('target').join('output')
+    # Not written by the command, left over from somewhere else
+    stale = tmpdir.join('stale')
+    stale.write('old')
+    stale.setmtime(0)
+    command = "sh -c 'echo run >> runs; mkdir -p target; cp input target/output; echo done'"
+    def run():
+        return shell.cmd(command, cwd=str(tmpdir), inputs=[str(source)],
+                         outputs=[str(output), str(tmpdir.join('missing')),
+                                  str(stale)])
+
+    assert run() == (0, b'done\n', b'')
+    tmpdir.join('target').remove()
+    stale.remove()
+    assert run() == (0, b'done\n', b'')
+    assert output.read() == '1'
+    assert not stale.check()
+    assert tmpdir.join('runs').read() == 'run\n'
+
+    # Different inputs, run again
+    source.write('2')
+    run()
+    assert output.read() == '2'
+    assert tmpdir.join('runs').read() == 'run\nrun\n'
+
+def test_cache_missing_artifact(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
+    source = tmpdir.join('input')
+    source.write('1')
+    output = tmpdir.join('output')
+    command = "sh -c 'echo run >> runs; cp input output'"
+    def run():
+        return shell.cmd(command, cwd=str(tmpdir), inputs=[str(source)],
+                         outputs=[str(output)])
+
+    assert run()[0] == 0
+    key = shell.get_key(command, str(tmpdir), [str(source)])
+    os.remove(os.path.join(cache.get_dir('artifacts', key), '0'))
+    output.remove()
+    assert run()[0] == 0
+    assert output.read() == '1'
+    assert tmpdir.join('runs').read() == 'run\nrun\n'
+
+def test_cache_only_successful_runs(tmpdir, mocker):
+    mocker.patch.object(shell, 'CACHE', True)
+    command = "sh -c 'echo run >> runs; exit 1'"
+    for _ in range(2):
+        assert shell.cmd(command, cwd=str(tmpdir), inputs=[])[0] == 1
+        # No declared inputs, never cached
+        assert shell.cmd("sh -c 'echo run >> runs'", cwd=str(tmpdir))[0] == 0
+    assert tmpdir.join('runs').read() == 'run\n' * 4
+
+def test_which_is_cached(mocker):
+    import distutils.spawn
+    mocker.patch.object(distutils.spawn, 'find_executable')
+    distutils.spawn.find_executable.return_value = None
+    assert shell.which('mvn') is None
+    assert shell.which('mvn') is None
+    assert distutils.spawn.find_executable.call_count == 1
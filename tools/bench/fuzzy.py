@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+    Benchmarks license suggestions (complic.licenses.fuzzy.Suggester).
+
+    Times building the n-gram index over every name of the inventory and
+    scoring a batch of unknown strings against it, compared with scoring
+    each string against every name (no inverted index). The batch is made
+    of typical near-misses, made unique by appending a number.
+
+    Usage:
+        python tools/bench/fuzzy.py [--strings 1000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from complic.licenses import fuzzy
+from complic.licenses import regex
+
+
+SAMPLES = [
+    'Apache 2', 'MIT/X11', 'GNU LGPL v2.1+', 'Eclipse 2', 'Mozilla',
+    'BSD style', 'Dual MIT/GPL', 'GPL v3 or later', 'Proprietary',
+    'Apache Software Licence two', 'Some in-house license',
+]
+
+
+def vectors(suggester):
+    """Row -> TF-IDF vector of each name, out of the inverted index."""
+    rows = {}
+    for gram, postings in suggester.postings.items():
+        for row, weight in postings:
+            rows.setdefault(row, {})[gram] = weight
+    return rows
+
+
+def exhaustive(suggester, rows, string):
+    """Dot product of <string> with every name, best score per license."""
+    query = suggester.weigh(fuzzy.ngrams(string, suggester.NGRAM))
+    best = {}
+    for row, vector in rows.items():
+        score = sum(weight * vector.get(gram, 0.0) \
+                    for gram, weight in query.items())
+        lic = suggester.licenses[row]
+        best[lic] = max(score, best.get(lic, 0.0))
+    return sorted(best.items(), key=lambda item: (-item[1], item[0]))[:3]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--strings", type=int, default=1000)
+    args = parser.parse_args()
+
+    names = regex.Normalizer().index['exact']
+    strings = ['%s %i' % (SAMPLES[i % len(SAMPLES)], i) \
+               for i in range(args.strings)]
+
+    start = time.time()
+    suggester = fuzzy.Suggester(names)
+    built = time.time() - start
+
+    start = time.time()
+    suggester.suggest(strings)
+    indexed = time.time() - start
+
+    rows = vectors(suggester)
+    sample = strings[:100]
+    start = time.time()
+    for string in sample:
+        exhaustive(suggester, rows, string)
+    linear = (time.time() - start) / len(sample) * len(strings)
+
+    print "%i names, %i n-grams" % (len(names), len(suggester.postings))
+    print "index:      %8.1f ms" % (built * 1e3)
+    print "indexed:    %8.1f ms/%i strings" % (indexed * 1e3, len(strings))
+    print "exhaustive: %8.1f ms/%i strings (estimated, %.1fx)" % (
+        linear * 1e3, len(strings), linear / indexed)
+
+
+if __name__ == '__main__':
+    main()
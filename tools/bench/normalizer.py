@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+    Benchmarks license matching (complic.licenses.regex.Normalizer).
+
+    Compares the indexed Normalizer.lookup against trying every regex of
+    the inventory in turn (how matching used to work), Normalizer.match
+    (lookup plus memo) is timed as well. The sample is made of every
+    license name in the inventory plus typical strings found in package
+    metadata, some of them unknown.
+
+    Usage:
+        python tools/bench/normalizer.py [--rounds 20]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from complic.licenses import exceptions
+from complic.licenses import regex
+
+
+SAMPLES = [
+    'MIT', 'MIT License', 'The MIT License (MIT)', 'ISC', 'BSD',
+    'BSD 3-Clause', 'New BSD License', 'Apache 2.0', 'Apache-2.0',
+    'The Apache Software License, Version 2.0', 'ASL 2.0', 'GPLv2',
+    'LGPL 2.1', 'GNU Lesser General Public License v3.0', 'MPL 2.0',
+    'Eclipse Public License 1.0', 'CDDL + GPLv2 with classpath exception',
+    'Common Public License Version 1.0', 'Public Domain', 'Unlicense',
+    'Proprietary', 'Some in-house license', 'UNKNOWN', '',
+]
+
+
+def linear_match(compiled, string):
+    """The original algorithm: first regex (in dict order) matching wins."""
+    for lic, regexp in compiled.items():
+        if regexp.match(string):
+            return lic
+    raise exceptions.UnknownLicenseError
+
+
+def timed(function, normalizer, strings, rounds):
+    results = {}
+    start = time.time()
+    for _ in range(rounds):
+        for string in strings:
+            try:
+                results[string] = function(normalizer, string)
+            except exceptions.UnknownLicenseError:
+                results[string] = None
+    elapsed = time.time() - start
+    return elapsed / (rounds * len(strings)), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(regex.INVENTORY, 'r') as inventory:
+        lics = json.loads(inventory.read())
+    compiled = dict((lic, re.compile(props['regexp'])) \
+                    for lic, props in lics.items())
+    normalizer = regex.Normalizer()
+    strings = sorted(props['name'] for props in lics.values() \
+                     if 'name' in props) + SAMPLES
+
+    linear, linear_results = timed(linear_match, compiled, strings,
+                                   args.rounds)
+    indexed, indexed_results = timed(regex.Normalizer.lookup, normalizer,
+                                     strings, args.rounds)
+    memoized, _ = timed(regex.Normalizer.match, normalizer, strings,
+                        args.rounds)
+    candidates = sum(len(normalizer.candidates(s)) for s in strings)
+
+    print "%i licenses, %i strings" % (len(normalizer.licenses), len(strings))
+    print "linear:  %8.1f us/string" % (linear * 1e6)
+    print "indexed: %8.1f us/string (%.1fx, %.1f regexes/string)" % (
+        indexed * 1e6, linear / indexed, float(candidates) / len(strings))
+    print "memoized: %7.1f us/string (%.1fx)" % (memoized * 1e6,
+                                                  linear / memoized)
+    differ = [s for s in strings if linear_results[s] != indexed_results[s]]
+    print "different results: %i (ambiguous strings, order dependent before)" \
+        % (len(differ))
+    for string in differ:
+        print "  %r: %s -> %s" % (string, linear_results[string],
+                                  indexed_results[string])
+
+
+if __name__ == '__main__':
+    main()
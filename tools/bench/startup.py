@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+    Benchmarks the cold start of license matching.
+
+    Times what it takes until the first few strings are matched, which is
+    paid on every run of complic:
+        * inventory: parse inventory.json and compile every regex (how
+          Normalizer used to start)
+        * build: parse inventory.json and build the index (what happens
+          when complic/licenses/index.json is outdated)
+        * index: load the precompiled index (compiling regexes lazily)
+
+    Usage:
+        python tools/bench/startup.py [--rounds 20]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from complic.licenses import regex
+
+
+SAMPLES = ['MIT', 'Apache 2.0', 'BSD', 'The Apache Software License, Version 2.0']
+
+
+def from_inventory():
+    with open(regex.INVENTORY, 'r') as inventory:
+        lics = json.loads(inventory.read())
+    for props in lics.values():
+        re.compile(props['regexp'])
+
+
+def from_scratch():
+    with open(regex.INVENTORY, 'r') as inventory:
+        normalizer = regex.Normalizer(json.loads(inventory.read()))
+    for string in SAMPLES:
+        normalizer.lookup(string)
+
+
+def from_index():
+    normalizer = regex.Normalizer()
+    for string in SAMPLES:
+        normalizer.lookup(string)
+
+
+def timed(function, rounds):
+    elapsed = 0
+    for _ in range(rounds):
+        re.purge() # Otherwise re's own cache hides the compilation cost
+        start = time.time()
+        function()
+        elapsed += time.time() - start
+    return elapsed / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    for name, function in [('inventory', from_inventory),
+                           ('build', from_scratch),
+                           ('index', from_index)]:
+        print "%-10s %8.1f ms" % (name, timed(function, args.rounds) * 1e3)
+
+
+if __name__ == '__main__':
+    main()
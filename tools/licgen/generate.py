@@ -10,8 +10,13 @@
     Also, runs all regex tests to ensure they aren't ambiguous:
         * A license regex must match exactly one license.
         * 0 matches = error, > 1 match = error
+
+    Finally, the matching index (complic/licenses/index.json) is built
+    from the new inventory. With --index-only, only the index is rebuilt
+    from the current inventory.json.
 """
 
+import hashlib
 import logging
 import json
 import os
@@ -19,11 +24,30 @@ import re
 import sys
 import collections
 
-import requests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from complic.licenses import regex
 
 logging.basicConfig(format='%(asctime)s::%(levelname)s::%(message)s')
 logging.getLogger().setLevel(logging.DEBUG)
 
+
+def write_index(inventory):
+    """Writes the index of <inventory> (inventory.json's exact contents)."""
+    index = regex.build_index(json.loads(inventory))
+    index['inventory'] = hashlib.sha1(inventory).hexdigest()
+    with open(regex.INDEX, 'w') as index_file:
+        index_file.write(json.dumps(index, sort_keys=True,
+                                    separators=(',', ':')))
+    logging.info("License index written to: %s", regex.INDEX)
+
+
+if '--index-only' in sys.argv:
+    write_index(open(regex.INVENTORY, 'rb').read())
+    sys.exit(0)
+
+import requests
+
 licenses_path = os.path.join('tools', 'licgen', 'licenses.json')
 if not os.path.isfile(licenses_path):
     licenses_path = 'licenses.json'
@@ -98,4 +122,6 @@ for k in sorted(licenses):
     lic['licenseId'] = k
     sorted_lics[k] = lic
 
-print json.dumps(sorted_lics, indent=2)
+output = json.dumps(sorted_lics, indent=2)
+print output
+write_index(output + '\n') # print's newline ends up in inventory.json